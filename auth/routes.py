@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+from shared.database import get_db
+from auth.service import AuthService, current_user
+
+# API endpoints for accounts and tokens
+router = APIRouter()
+
+
+class RegisterRequest(BaseModel):
+    username: str = Field(..., min_length=3, max_length=100)
+    email: str = Field(..., max_length=255, pattern=r"^[^@\s]+@[^@\s]+$")
+    password: str = Field(..., max_length=256)
+
+
+class LoginRequest(BaseModel):
+    username: str = Field(..., max_length=100)
+    password: str = Field(..., max_length=256)
+
+
+@router.post("/register", status_code=201)
+async def register(body: RegisterRequest, db: Session = Depends(get_db)):
+    """Create an account, then get a token from /auth/token"""
+    
+    try:
+        user = await AuthService(db).register(body.username, body.email, body.password)
+        return {"user_id": user.id, "username": user.username, "email": user.email}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
+
+@router.post("/token")
+async def login(body: LoginRequest, db: Session = Depends(get_db)):
+    """
+    Swap a username and password for a bearer token
+    
+    Send it on every other request as "Authorization: Bearer <access_token>"
+    """
+    
+    try:
+        token, expires_in = await AuthService(db).login(body.username, body.password)
+        return {"access_token": token, "token_type": "bearer", "expires_in": expires_in}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
+
+@router.get("/me")
+async def me(user: dict = Depends(current_user)):
+    """Who this token belongs to"""
+    return user
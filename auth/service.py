@@ -0,0 +1,181 @@
+"""
+Password logins and JWT bearer tokens
+
+A request with a token already seen costs two dictionary lookups: the
+verified-token cache (signature and expiry were checked the first time)
+and the user cache. Only new tokens pay for the HMAC check, and only a user
+not seen for USER_CACHE_TTL seconds costs a query. Password hashing is slow
+on purpose, so it runs on its own bounded pool, never on the event loop.
+"""
+import asyncio
+import functools
+import json
+import logging
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwt
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from auth.models import User
+from shared.cache import LocalCache
+from shared.database import get_db
+from shared.metrics import CACHE_REQUESTS
+from shared.lazy import lazy_import
+from shared.utils import run_blocking
+from config import (
+    JWT_SECRET, JWT_ALGORITHM, ACCESS_TOKEN_TTL, TOKEN_CACHE_SIZE, USER_CACHE_TTL, PASSWORD_HASH_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+if JWT_SECRET:
+    _secret = JWT_SECRET
+else:
+    _secret = secrets.token_urlsafe(32)
+    logger.warning("JWT_SECRET isn't set - tokens from this process won't work in any other or after a restart")
+
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="docflow-hash")
+
+_verified_tokens = LocalCache(TOKEN_CACHE_SIZE, ACCESS_TOKEN_TTL)
+_users = LocalCache(TOKEN_CACHE_SIZE, USER_CACHE_TTL)
+
+
+# werkzeug takes longer to import than the rest of this module put together, and
+# is only needed once someone registers or logs in
+_werkzeug_security = lazy_import("werkzeug.security")
+
+def generate_password_hash(password: str) -> str:
+    return _werkzeug_security.generate_password_hash(password)
+
+def check_password_hash(password_hash: str, password: str) -> bool:
+    return _werkzeug_security.check_password_hash(password_hash, password)
+
+
+def unauthorized(detail: str = "Not authenticated") -> HTTPException:
+    return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+
+@functools.lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    # Checked against when the username doesn't exist, so a miss takes as long as a wrong password
+    return generate_password_hash(secrets.token_urlsafe(16))
+
+
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_password_executor, generate_password_hash, password)
+
+
+def _check_password(password: str, password_hash: Optional[str]) -> bool:
+    return check_password_hash(password_hash or _dummy_hash(), password) and password_hash is not None
+
+
+async def verify_password(password: str, password_hash: Optional[str]) -> bool:
+    """False for no hash (unknown user) too - after the same amount of work"""
+    return await asyncio.get_running_loop().run_in_executor(_password_executor, _check_password, password, password_hash)
+
+
+def create_access_token(user_id: int, ttl: int = ACCESS_TOKEN_TTL) -> Tuple[str, int]:
+    """(token, seconds until it expires)"""
+    now = int(time.time())
+    claims = {"sub": str(user_id), "iat": now, "exp": now + ttl}
+    return jwt.encode(claims, _secret, algorithm=JWT_ALGORITHM), ttl
+
+
+def verify_token(token: str) -> int:
+    """The user id in a valid token - 401 for anything else"""
+    cached = _verified_tokens.get(token)
+    if cached is not None:
+        CACHE_REQUESTS.inc(cache="token", result="local")
+        return int(cached)
+    CACHE_REQUESTS.inc(cache="token", result="miss")
+    try:
+        claims = jwt.decode(token, _secret, algorithms=[JWT_ALGORITHM])
+        user_id = int(claims["sub"])
+        expires_in = claims["exp"] - time.time()
+    except (JWTError, KeyError, TypeError, ValueError):
+        raise unauthorized("Invalid or expired token")
+    # Remembered only until the token expires, so a cached token is never accepted late
+    if expires_in > 0:
+        _verified_tokens.set(token, str(user_id), ttl=expires_in)
+    return user_id
+
+
+def _cached_user(user_id: int) -> Optional[dict]:
+    cached = _users.get(str(user_id))
+    if cached is None:
+        return None
+    CACHE_REQUESTS.inc(cache="user", result="local")
+    return json.loads(cached)
+
+
+def get_user(db: Session, user_id: int) -> Optional[dict]:
+    """id, username and email of a user (cached) - None if there's no such user"""
+    user = _cached_user(user_id)
+    if user is not None:
+        return user
+    CACHE_REQUESTS.inc(cache="user", result="miss")
+    row = db.query(User.id, User.username, User.email).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    user = {"id": row.id, "username": row.username, "email": row.email}
+    _users.set(str(user_id), json.dumps(user))
+    return user
+
+
+_bearer = HTTPBearer(auto_error=False)
+
+async def current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer),
+    db: Session = Depends(get_db)
+) -> dict:
+    """Route dependency - the signed-in user, or 401"""
+    if credentials is None:
+        raise unauthorized()
+    user_id = verify_token(credentials.credentials)
+    # The common case answers without a trip to the I/O pool
+    user = _cached_user(user_id) or await run_blocking(get_user, db, user_id)
+    if user is None:
+        raise unauthorized("User no longer exists")
+    return user
+
+async def current_user_id(user: dict = Depends(current_user)) -> int:
+    return user["id"]
+
+
+class AuthService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    async def register(self, username: str, email: str, password: str) -> User:
+        """Create an account - 409 if the username or email is taken"""
+        if len(password) < 8:
+            raise HTTPException(status_code=400, detail="Password must be at least 8 characters")
+        password_hash = await hash_password(password)
+        return await run_blocking(self._create_user, username, email, password_hash)
+
+    async def login(self, username: str, password: str) -> Tuple[str, int]:
+        """(token, expires_in) for the right password - 401 otherwise, whichever part was wrong"""
+        row = await run_blocking(self._find_login, username)
+        if not await verify_password(password, row.password_hash if row else None):
+            raise unauthorized("Incorrect username or password")
+        return create_access_token(row.id)
+
+    def _create_user(self, username: str, email: str, password_hash: str) -> User:
+        user = User(username=username, email=email, password_hash=password_hash)
+        try:
+            self.db.add(user)
+            self.db.commit()
+            self.db.refresh(user)
+        except IntegrityError:
+            self.db.rollback()
+            raise HTTPException(status_code=409, detail="Username or email already registered")
+        return user
+
+    def _find_login(self, username: str):
+        row = self.db.query(User.id, User.password_hash).filter(User.username == username).first()
+        self.db.rollback()  # Don't hold the connection while the hash is checked
+        return row
@@ -0,0 +1,235 @@
+"""
+Throughput, latency and memory for upload, list, get and delete
+
+For each concurrency level, uploads --requests synthetic PDF/DOCX/CSV files
+(cycling through the kinds and sizes asked for), pages through the listing
+as many times, fetches documents one by one, then deletes everything it
+uploaded. Each phase reports requests per second, p50/p95/p99 latency,
+errors and the peak RSS of whatever is serving the requests.
+
+Two ways to drive the app:
+
+    inprocess - straight into the ASGI app in this process: no sockets or
+                HTTP parsing, so the numbers are docflow's own work
+    uvicorn   - a real uvicorn server in its own process, over localhost
+
+The JSON it prints (or writes with --output) carries the commit it ran on,
+so runs from two commits can be diffed with benchmarks.compare:
+
+    python -m benchmarks.api_load --concurrency 1 8 32 --sizes-kb 16 256 2048 --output before.json
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.common import (
+    REPO_ROOT, PeakRss, ServerProcess, asgi_request, create_bench_user, latency_summary, multipart_body
+)
+from benchmarks.payloads import PAYLOADS, make_payload
+
+
+class InProcessTarget:
+    """The app imported into this process, with its startup and shutdown run like a server would"""
+
+    def __init__(self, env: dict):
+        self.env = env
+        self.workdir = None
+        self.app = None
+        self.token = None
+        self._lifespan = None
+
+    async def __aenter__(self):
+        self.workdir = tempfile.mkdtemp(prefix="docflow-bench-")
+        # Settings are read when config is first imported, so they go in before the app does
+        os.environ.update({
+            "DATABASE_URL": f"sqlite:///{self.workdir}/bench.db",
+            "UPLOAD_DIR": os.path.join(self.workdir, "uploads"),
+            "JWT_SECRET": secrets.token_urlsafe(32),
+            **self.env,
+        })
+        from main import app
+        self.app = app
+        self.token = create_bench_user()
+        self._lifespan = app.router.lifespan_context(app)
+        # The startup banner would end up in the JSON on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            await self._lifespan.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        with contextlib.redirect_stdout(sys.stderr):
+            await self._lifespan.__aexit__(*exc)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def memory(self) -> PeakRss:
+        return PeakRss()
+
+    async def send(self, method: str, path: str, body: bytes = b"", headers: dict = None):
+        headers = {"Authorization": f"Bearer {self.token}", **(headers or {})}
+        return await asgi_request(self.app, method, path, body, headers)
+
+
+class UvicornTarget:
+    """A uvicorn server in its own process - requests go from a thread pool over fresh connections"""
+
+    def __init__(self, env: dict, workers: int, concurrency: int):
+        self.server = ServerProcess(env=env, workers=workers)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench-client")
+
+    async def __aenter__(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.server.start)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.executor.shutdown()
+        self.server.stop()
+        shutil.rmtree(self.server.workdir, ignore_errors=True)
+
+    def memory(self) -> PeakRss:
+        # With --workers the requests are served by uvicorn's children
+        return PeakRss(self.server.process.pid, children=True)
+
+    async def send(self, method: str, path: str, body: bytes = b"", headers: dict = None):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, lambda: self.server.request(method, path, body=body or None, headers=headers))
+
+
+async def run_phase(target, jobs: list, concurrency: int, expected_status: int):
+    """Run (method, path, body, headers) jobs on concurrency clients - returns (summary, response bodies)"""
+    samples, statuses, bodies = [], Counter(), []
+    pending = iter(jobs)
+
+    async def client():
+        # One shared iterator, so each job is taken exactly once
+        for method, path, body, headers in pending:
+            status, data, elapsed = await target.send(method, path, body, headers)
+            statuses[status] += 1
+            if status == expected_status:
+                samples.append(elapsed)
+                bodies.append(data)
+
+    with target.memory() as memory:
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    errors = {str(status): count for status, count in statuses.items() if status != expected_status}
+    summary = {
+        "requests": len(jobs),
+        "errors": sum(errors.values()),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        **latency_summary(samples),
+        "peak_rss_mb": memory.peak_mb,
+    }
+    if errors:
+        summary["error_statuses"] = errors
+    return summary, bodies
+
+
+def upload_jobs(kinds: list, sizes: list, count: int, first_seed: int) -> list:
+    """Multipart bodies built up front, so generating them isn't timed"""
+    jobs = []
+    for n in range(count):
+        kind, size = kinds[n % len(kinds)], sizes[(n // len(kinds)) % len(sizes)]
+        filename, content_type, content = make_payload(kind, size, seed=first_seed + n)
+        body, header = multipart_body(filename, content_type, content)
+        jobs.append(("POST", "/documents/", body, {"Content-Type": header}))
+    return jobs
+
+
+async def run_level(target, concurrency: int, args, first_seed: int) -> dict:
+    sizes = [int(size_kb * 1024) for size_kb in args.sizes_kb]
+    uploads = upload_jobs(args.kinds, sizes, args.requests, first_seed)
+    uploaded_bytes = sum(len(body) for _, _, body, _ in uploads)
+
+    results = {}
+    results["upload"], bodies = await run_phase(target, uploads, concurrency, 201)
+    results["upload"]["mb_per_second"] = round(uploaded_bytes / (1024 * 1024) / results["upload"]["seconds"], 1)
+    ids = [json.loads(body)["document_id"] for body in bodies]
+
+    listing = [("GET", f"/documents/?limit={args.page_size}", b"", None)] * args.requests
+    results["list"], _ = await run_phase(target, listing, concurrency, 200)
+
+    details = [("GET", f"/documents/{ids[n % len(ids)]}", b"", None) for n in range(args.requests)] if ids else []
+    results["get"], _ = await run_phase(target, details, concurrency, 200)
+
+    deletes = [("DELETE", f"/documents/{document_id}", b"", None) for document_id in ids]
+    results["delete"], _ = await run_phase(target, deletes, concurrency, 200)
+    return results
+
+
+async def run_mode(mode: str, args, env: dict) -> dict:
+    if mode == "inprocess":
+        target = InProcessTarget(env)
+    else:
+        target = UvicornTarget(env, args.workers, max(args.concurrency))
+
+    results = {}
+    async with target:
+        for level, concurrency in enumerate(args.concurrency):
+            # Fresh seeds per level, so no upload is a duplicate of an earlier one
+            results[f"concurrency_{concurrency}"] = await run_level(
+                target, concurrency, args, first_seed=(level + 1) * 1_000_000)
+    return results
+
+
+def git_commit() -> dict:
+    def git(*command):
+        return subprocess.run(["git", *command], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except OSError:
+        return {"commit": None, "dirty": None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=["inprocess", "uvicorn"], default=["inprocess", "uvicorn"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32], help="concurrent clients per level")
+    parser.add_argument("--requests", type=int, default=200, help="requests per phase at each level")
+    parser.add_argument("--kinds", nargs="+", choices=sorted(PAYLOADS), default=sorted(PAYLOADS))
+    parser.add_argument("--sizes-kb", nargs="+", type=float, default=[16, 256, 2048], help="upload sizes to cycle through")
+    parser.add_argument("--page-size", type=int, default=50, help="?limit= for the listing phase")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="extra settings for the app under test")
+    parser.add_argument("--output", help="also write the JSON here")
+    args = parser.parse_args()
+
+    env = {
+        # The benchmark user shouldn't run into the quota or the size limit halfway through
+        "STORAGE_QUOTA_BYTES": "0",
+        "MAX_FILE_SIZE": str(max(10 * 1024 * 1024, int(max(args.sizes_kb) * 1024) + 1024)),
+    }
+    env.update(setting.split("=", 1) for setting in args.env)
+
+    results = {mode: asyncio.run(run_mode(mode, args, env)) for mode in args.modes}
+    report = {
+        "benchmark": "api_load",
+        **git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {**vars(args), "env": env},
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
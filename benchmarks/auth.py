@@ -0,0 +1,149 @@
+"""
+What does authentication add to a request?
+
+Runs a tiny route in-process (no network, so only the auth work shows)
+without auth, with a token already verified and its user cached (every
+request after the first), with a token that has to be verified, and with
+neither the token nor the user cached. Then fires concurrent logins and
+records how long the event loop stalls while their hashes are checked.
+
+    python -m benchmarks.auth --requests 5000 --logins 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from fastapi import Depends, FastAPI
+from sqlalchemy.orm import Session, sessionmaker
+from werkzeug.security import generate_password_hash
+from benchmarks.common import latency_summary
+from shared.database import Base, create_database_engine, get_db
+from auth import service as auth_service
+from auth.models import User
+from auth.service import AuthService, create_access_token, current_user_id
+import documents.models  # noqa: F401
+
+
+async def call(app, path: str, headers: dict) -> int:
+    """One GET through the ASGI app, returns the status"""
+    messages = []
+    scope = {
+        "type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "headers": [(key.lower().encode(), value.encode()) for key, value in headers.items()],
+        "http_version": "1.1", "scheme": "http", "server": ("bench", 80), "client": ("bench", 1),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]["status"]
+
+
+async def time_requests(app, path: str, headers: dict, count: int, before_each=None) -> list:
+    samples = []
+    for _ in range(count):
+        if before_each:
+            before_each()
+        started = time.perf_counter()
+        status = await call(app, path, headers)
+        samples.append(time.perf_counter() - started)
+        assert status == 200, status
+    return samples
+
+
+async def login_storm(session_factory, logins: int) -> dict:
+    """Concurrent logins while a ticker measures how late the event loop wakes it"""
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    async def login():
+        db = session_factory()
+        try:
+            await AuthService(db).login("bench", "bench-password")
+        finally:
+            db.close()
+
+    ticking = asyncio.ensure_future(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticking
+    return {
+        "logins": logins,
+        "logins_per_second": round(logins / elapsed, 1),
+        "event_loop_lag": latency_summary(lags),
+    }
+
+
+async def run(requests: int, logins: int) -> dict:
+    with tempfile.TemporaryDirectory(prefix="docflow-auth-") as tmp:
+        engine = create_database_engine(f"sqlite:///{os.path.join(tmp, 'auth.db')}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        with session_factory() as db:
+            user = User(username="bench", email="bench@example.com", password_hash=generate_password_hash("bench-password"))
+            db.add(user)
+            db.commit()
+            user_id = user.id
+
+        app = FastAPI()
+
+        def session():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+        app.dependency_overrides[get_db] = session
+
+        # Both take a session like every real route does (the auth dependency shares it)
+        @app.get("/anonymous")
+        async def anonymous(db: Session = Depends(get_db)):
+            return {"ok": True}
+
+        @app.get("/authenticated")
+        async def authenticated(user_id: int = Depends(current_user_id), db: Session = Depends(get_db)):
+            return {"ok": True}
+
+        token, _ = create_access_token(user_id)
+        headers = {"Authorization": f"Bearer {token}"}
+        forget_token = auth_service._verified_tokens.clear
+        forget_both = lambda: (auth_service._verified_tokens.clear(), auth_service._users.clear())
+
+        await time_requests(app, "/authenticated", headers, 100)  # Warm up
+        results = {
+            "no_auth": latency_summary(await time_requests(app, "/anonymous", {}, requests)),
+            "cached_token_and_user": latency_summary(await time_requests(app, "/authenticated", headers, requests)),
+            "token_verified_each_time": latency_summary(
+                await time_requests(app, "/authenticated", headers, requests, forget_token)),
+            "token_verified_and_user_queried": latency_summary(
+                await time_requests(app, "/authenticated", headers, requests, forget_both)),
+            "login": await login_storm(session_factory, logins),
+        }
+        engine.dispose()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--logins", type=int, default=32, help="concurrent logins for the event loop check")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.requests, args.logins)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import asyncio
+import http.client
+import math
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+# Benchmarks run from the repo root: python -m benchmarks.<name>
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile, good enough for latency reporting"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max in milliseconds"""
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2) if samples else 0.0,
+    }
+
+
+def create_bench_user() -> str:
+    """
+    Create the schema and the user a benchmark runs as, returns a token for them
+
+    Imports the app's modules when called, so DATABASE_URL and friends have to
+    be set by then.
+    """
+    from werkzeug.security import generate_password_hash
+    from shared.database import init_database, SessionLocal
+    from auth.models import User
+    from auth.service import create_access_token
+    import documents.models  # noqa: F401
+
+    init_database()
+    db = SessionLocal()
+    try:
+        user = User(username="bench", email="bench@example.com", password_hash=generate_password_hash("bench-password"))
+        db.add(user)
+        db.commit()
+        return create_access_token(user.id)[0]
+    finally:
+        db.close()
+
+
+def rss_bytes(pid: int, children: bool = False) -> Optional[int]:
+    """Resident memory of a process (and its children, e.g. uvicorn workers) - None off Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            rss = next(int(line.split()[1]) * 1024 for line in status if line.startswith("VmRSS:"))
+        if children:
+            with open(f"/proc/{pid}/task/{pid}/children") as listing:
+                rss += sum(rss_bytes(int(child)) or 0 for child in listing.read().split())
+        return rss
+    except (OSError, StopIteration, ValueError):
+        return None
+
+
+class PeakRss:
+    """
+    Highest RSS seen while the block runs, sampled on a background thread
+
+    ru_maxrss only ever goes up over the life of the process, so it can't
+    tell one phase from the next - sampling can.
+    """
+
+    def __init__(self, pid: int = None, children: bool = False, interval: float = 0.01):
+        self.pid = pid or os.getpid()
+        self.children = children
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = rss_bytes(self.pid, self.children)
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    @property
+    def peak_mb(self) -> Optional[float]:
+        return round(self.peak / (1024 * 1024), 1) if self.peak is not None else None
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+async def asgi_request(app, method: str, path: str, body: bytes = b"", headers: Dict[str, str] = None,
+                       chunk_size: int = 64 * 1024):
+    """
+    One request straight into an ASGI app, returns (status, body, seconds)
+
+    The body goes in chunk_size pieces, the way a server hands over what it reads off the socket.
+    """
+    path, _, query = path.partition("?")
+    headers = dict(headers or {})
+    headers.setdefault("Content-Length", str(len(body)))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": [(key.lower().encode(), value.encode()) for key, value in headers.items()],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    chunks = [body[offset:offset + chunk_size] for offset in range(0, len(body), chunk_size)] or [b""]
+    status, data = None, []
+
+    async def receive():
+        if chunks:
+            chunk = chunks.pop(0)
+            return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+        # The client stays connected until the response is done
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            data.append(message.get("body", b""))
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    return status, b"".join(data), time.perf_counter() - started
+
+
+def multipart_body(filename: str, content_type: str, content: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class ServerProcess:
+    """
+    A throwaway uvicorn server with its own database and upload folder
+
+    Runs in a separate process so the load generator doesn't share a GIL
+    with the server it's measuring.
+    """
+
+    def __init__(self, env: Optional[Dict[str, str]] = None, workers: int = 1, command: Optional[List[str]] = None):
+        self.port = free_port()
+        self.workdir = tempfile.mkdtemp(prefix="docflow-bench-")
+        self.env = dict(os.environ)
+        self.env.update({
+            "DATABASE_URL": f"sqlite:///{self.workdir}/bench.db",
+            "UPLOAD_DIR": os.path.join(self.workdir, "uploads"),
+            "PYTHONPATH": REPO_ROOT,
+            # Shared with the setup script, so the token it makes works on the server
+            "JWT_SECRET": secrets.token_urlsafe(32),
+        })
+        self.env.update(env or {})
+        self.workers = workers
+        # Defaults to plain uvicorn; the port is appended to whatever is given
+        self.command = command or [sys.executable, "-m", "uvicorn", "main:app", "--log-level", "warning",
+                                   "--workers", str(workers)]
+        self.process = None
+        self.token = None
+
+    def setup_database(self):
+        """Create the schema and the user the benchmark runs as, and get a token for them"""
+        script = "from benchmarks.common import create_bench_user\nprint(create_bench_user())\n"
+        result = subprocess.run([sys.executable, "-c", script], env=self.env, cwd=REPO_ROOT, check=True,
+                                capture_output=True, text=True)
+        self.token = result.stdout.strip().splitlines()[-1]
+
+    def start(self):
+        self.setup_database()
+        self.process = subprocess.Popen(
+            self.command + ["--port", str(self.port)],
+            env=self.env, cwd=REPO_ROOT, stdout=subprocess.DEVNULL,
+        )
+        deadline = time.time() + 20
+        while time.time() < deadline:
+            try:
+                self.request("GET", "/")
+                return self
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError("benchmark server did not come up")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=20)
+            self.process = None
+
+    def request(self, method: str, path: str, body: bytes = None, headers: Dict[str, str] = None,
+                authenticated: bool = True):
+        """One request on a fresh connection, returns (status, body, seconds)"""
+        headers = dict(headers or {})
+        if authenticated and self.token:
+            headers.setdefault("Authorization", f"Bearer {self.token}")
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        try:
+            started = time.perf_counter()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            return response.status, data, time.perf_counter() - started
+        finally:
+            conn.close()
+
+    def upload(self, filename: str, content_type: str, content: bytes):
+        body, header = multipart_body(filename, content_type, content)
+        return self.request("POST", "/documents/", body=body, headers={"Content-Type": header})
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
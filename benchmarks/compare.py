@@ -0,0 +1,92 @@
+"""
+What got slower between two benchmark runs?
+
+Takes two JSON reports from any of the benchmarks (same options, different
+commits) and lines up every latency, throughput and memory figure. Changes
+for the worse beyond --threshold percent are regressions, and the exit
+status is 1 if there are any - so it can gate CI:
+
+    git checkout main && python -m benchmarks.api_load --output before.json
+    git checkout my-branch && python -m benchmarks.api_load --output after.json
+    python -m benchmarks.compare before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# Suffixes of figures where lower is better, and where higher is
+LOWER_IS_BETTER = ("_ms", "_mb", "errors")
+HIGHER_IS_BETTER = ("_rps", "per_second")
+
+
+def flatten(report, prefix: str = "") -> Dict[str, float]:
+    """{"results.uvicorn.concurrency_8.upload.p95_ms": 12.3, ...} for every number in the report"""
+    figures = {}
+    if isinstance(report, dict):
+        for key, value in report.items():
+            figures.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(report, (int, float)) and not isinstance(report, bool):
+        figures[prefix] = report
+    return figures
+
+
+def direction(path: str) -> Optional[int]:
+    """+1 if a bigger number is worse, -1 if it's better, None for things like counts and settings"""
+    name = path.rsplit(".", 1)[-1]
+    if name.endswith(LOWER_IS_BETTER):
+        return 1
+    if name.endswith(HIGHER_IS_BETTER):
+        return -1
+    return None
+
+
+def compare(before: dict, after: dict, threshold: float, min_delta_ms: float = 0.5) -> Tuple[List[dict], List[dict]]:
+    """(every change, the ones that are regressions) - threshold is in percent"""
+    old, new = flatten(before.get("results", before)), flatten(after.get("results", after))
+    changes, regressions = [], []
+    for path in sorted(old.keys() & new.keys()):
+        sign = direction(path)
+        if sign is None or old[path] == new[path]:
+            continue
+        delta = new[path] - old[path]
+        percent = delta / old[path] * 100 if old[path] else float("inf")
+        change = {"figure": path, "before": old[path], "after": new[path], "change_pct": round(percent, 1)}
+        changes.append(change)
+        # Sub-millisecond wobbles in latency are noise, whatever the percentage
+        if path.endswith("_ms") and abs(delta) < min_delta_ms:
+            continue
+        if percent * sign > threshold:
+            regressions.append(change)
+    return changes, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent worse that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="ignore latency changes smaller than this")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    options = [{key: value for key, value in (report.get("config") or {}).items() if key != "output"} for report in (before, after)]
+    if options[0] != options[1]:
+        print("⚠️  The two runs used different options - the comparison may not mean much", file=sys.stderr)
+
+    changes, regressions = compare(before, after, args.threshold, args.min_delta_ms)
+    print(json.dumps({
+        "before": before.get("commit"),
+        "after": after.get("commit"),
+        "threshold_pct": args.threshold,
+        "regressions": regressions,
+        "changes": changes,
+    }, indent=2))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
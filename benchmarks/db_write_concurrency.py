@@ -0,0 +1,137 @@
+"""
+How many uploads per second can the database take, and how often does it say no?
+
+Writer threads go through the same transactions an upload and its
+processing make (insert a document, claim it, mark it done) while reader
+threads page through the listing. Runs against a fresh database per mode:
+
+    legacy    - how shared/database.py used to connect: rollback journal,
+                synchronous=FULL, a new connection per checkout
+    tuned     - the current settings (WAL, synchronous=NORMAL, busy_timeout, pooled)
+    postgres  - the same models on PostgreSQL, when --postgres-url is given
+
+    python -m benchmarks.db_write_concurrency --writers 16 --readers 4 --seconds 5
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from benchmarks.common import latency_summary
+from shared.database import Base, create_database_engine
+from auth.models import User
+from documents.models import Document, DocumentStatus
+from documents.service import DocumentService
+from processing.workflow import claim_document, finish_document
+import processing.models  # noqa: F401 - registers the processing tables for create_all
+
+
+def legacy_engine(url: str):
+    # The old setup: SQLAlchemy 1.4 defaults (NullPool for SQLite files) plus foreign keys, nothing else
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    return engine
+
+
+def run_workload(engine, seconds: float, writers: int, readers: int) -> dict:
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        user = User(username="bench", email="bench@example.com", password_hash="x")
+        db.add(user)
+        db.commit()
+        user_id = user.id
+
+    write_samples, read_samples, errors = [], [], []
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def writer(n: int):
+        count = 0
+        while time.time() < deadline:
+            count += 1
+            started = time.perf_counter()
+            db = Session()
+            try:
+                document = Document(user_id=user_id, filename=f"w{n}_{count}.pdf", file_path=f"/bench/{n}/{count}",
+                                    file_size=1024, mime_type="application/pdf", content_hash=f"{n:04x}{count:060x}")
+                db.add(document)
+                db.commit()
+                claim_document(db, document.id)
+                finish_document(db, document.id, DocumentStatus.COMPLETED)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    write_samples.append(elapsed)
+            except OperationalError as e:
+                db.rollback()
+                with lock:
+                    errors.append(str(e.orig))
+            finally:
+                db.close()
+
+    def reader():
+        while time.time() < deadline:
+            started = time.perf_counter()
+            db = Session()
+            try:
+                DocumentService(db, storage=object()).list_documents_page(user_id, limit=50)
+                with lock:
+                    read_samples.append(time.perf_counter() - started)
+            except OperationalError as e:
+                with lock:
+                    errors.append(str(e.orig))
+            finally:
+                db.close()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    return {
+        "uploads_per_second": round(len(write_samples) / seconds, 1),
+        "upload_transactions": latency_summary(write_samples),
+        "listing": latency_summary(read_samples),
+        "errors": len(errors),
+        "error_kinds": sorted(set(errors))[:3],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--postgres-url", help="also run against this (empty, throwaway) PostgreSQL database")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="docflow-bench-") as tmp:
+        modes = {
+            "legacy": legacy_engine(f"sqlite:///{os.path.join(tmp, 'legacy.db')}"),
+            "tuned": create_database_engine(f"sqlite:///{os.path.join(tmp, 'tuned.db')}"),
+        }
+        if args.postgres_url:
+            modes["postgres"] = create_database_engine(args.postgres_url)
+        for mode, engine in modes.items():
+            results[mode] = run_workload(engine, args.seconds, args.writers, args.readers)
+
+    print(json.dumps({"writers": args.writers, "readers": args.readers, "seconds": args.seconds, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
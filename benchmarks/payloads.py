@@ -0,0 +1,124 @@
+"""
+Synthetic uploads - small but real PDF, DOCX and CSV files of about a given size
+
+They pass content sniffing and the processing steps can read them, so
+benchmarks exercise the same path a real upload takes. The same seed gives
+the same bytes; different seeds give different bytes (so content-addressed
+storage doesn't just dedupe them).
+"""
+import io
+import random
+import zipfile
+from typing import Callable, Dict, Tuple
+
+_WORDS = (
+    "invoice contract report summary budget quarter revenue customer supplier payment schedule "
+    "delivery account balance review policy project meeting agenda minutes proposal estimate"
+).split()
+
+
+def _sentence(rng: random.Random, words: int = 12) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def make_pdf(size: int, seed: int = 0) -> bytes:
+    """A PDF with pages of text, padded out to roughly size bytes"""
+    rng = random.Random(seed)
+    lines_per_page = 60
+    # Each text line costs about 110 bytes in a content stream
+    line_count = max(1, size // 110)
+    page_count = (line_count + lines_per_page - 1) // lines_per_page
+
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for page in range(page_count):
+        page_id, content_id = 4 + page * 2, 5 + page * 2
+        kids.append(f"{page_id} 0 R")
+        lines = min(lines_per_page, line_count - page * lines_per_page)
+        text = "".join(f"({seed} {_sentence(rng)}) '\n" for _ in range(lines))
+        stream = f"BT /F1 10 Tf 12 TL 40 780 Td\n{text}ET".encode()
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>").encode()
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {page_count} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id])
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offsets[object_id] for object_id in sorted(objects))
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_at)
+    return bytes(out)
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/></Relationships>'
+)
+
+
+def make_docx(size: int, seed: int = 0) -> bytes:
+    """A Word document of paragraphs - stored uncompressed so the file ends up about size bytes"""
+    rng = random.Random(seed)
+    paragraphs = []
+    written = 0
+    while written < size - 1024:
+        paragraph = f"<w:p><w:r><w:t>{seed} {_sentence(rng, 20)}</w:t></w:r></w:p>"
+        paragraphs.append(paragraph)
+        written += len(paragraph)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+        + "".join(paragraphs) + "</w:body></w:document>"
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        # [Content_Types].xml first, like Word writes it (the sniffer relies on that)
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _RELS)
+        archive.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+def make_csv(size: int, seed: int = 0) -> bytes:
+    """id,customer,amount,quantity,created rows up to about size bytes"""
+    rng = random.Random(seed)
+    rows = ["id,customer,amount,quantity,created\n"]
+    written = len(rows[0])
+    row_id = 0
+    while written < size:
+        row_id += 1
+        row = (f"{seed}-{row_id},{rng.choice(_WORDS)}_{rng.randint(1, 999)},{rng.uniform(1, 10000):.2f},"
+               f"{rng.randint(1, 50)},2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}\n")
+        rows.append(row)
+        written += len(row)
+    return "".join(rows).encode()
+
+
+# kind -> (file extension, content type, generator)
+PAYLOADS: Dict[str, Tuple[str, str, Callable[[int, int], bytes]]] = {
+    "pdf": (".pdf", "application/pdf", make_pdf),
+    "docx": (".docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", make_docx),
+    "csv": (".csv", "text/csv", make_csv),
+}
+
+
+def make_payload(kind: str, size: int, seed: int = 0) -> Tuple[str, str, bytes]:
+    """(filename, content type, bytes) for one synthetic upload"""
+    extension, content_type, generate = PAYLOADS[kind]
+    return f"bench_{seed}{extension}", content_type, generate(size, seed)
@@ -0,0 +1,100 @@
+"""
+How fast is GET /documents/search with a lot of documents indexed?
+
+Fills a fresh database with synthetic documents (Zipf-distributed words, like
+real text) spread over a few users, indexes them with each backend, then
+times queries of one to three words - common, rare and mixed.
+
+    python -m benchmarks.search --documents 200000 --users 4
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+from benchmarks.common import latency_summary
+from shared.database import Base, create_database_engine
+from auth.models import User
+from documents.models import Document, DocumentStatus
+from search.index import Fts5Index, InvertedIndex, _indexes, search_documents
+import processing.models  # noqa: F401
+import search.models  # noqa: F401
+
+
+def make_vocabulary(size: int, rng: random.Random):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    words = sorted(words)
+    # Zipf weights - a handful of words are everywhere, most are rare
+    return words, [1 / (rank + 1) for rank in range(size)]
+
+
+def run(backend: str, documents: int, users: int, words_per_document: int, queries: int) -> dict:
+    rng = random.Random(42)
+    vocabulary, weights = make_vocabulary(20000, rng)
+    with tempfile.TemporaryDirectory(prefix="docflow-search-") as tmp:
+        engine = create_database_engine(f"sqlite:///{os.path.join(tmp, 'search.db')}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        index = Fts5Index(db) if backend == "fts5" else InvertedIndex()
+        _indexes[str(engine.url)] = index
+        try:
+            db.add_all([User(username=f"user{n}", email=f"user{n}@example.com", password_hash="x") for n in range(users)])
+            db.commit()
+
+            started = time.perf_counter()
+            batch = 2000
+            for first in range(0, documents, batch):
+                rows = [{"user_id": 1 + i % users, "filename": f"doc_{i}.pdf", "file_path": f"/bench/{i}",
+                         "file_size": 1, "mime_type": "application/pdf", "status": DocumentStatus.COMPLETED}
+                        for i in range(first, min(documents, first + batch))]
+                db.execute(insert(Document), rows)
+                for i, row in enumerate(rows, first + 1):
+                    body = " ".join(rng.choices(vocabulary, weights, k=words_per_document))
+                    index.add(db, i, row["user_id"], row["filename"], body)
+                db.commit()
+            build_seconds = time.perf_counter() - started
+
+            samples = {"common": [], "rare": [], "mixed": []}
+            for _ in range(queries):
+                picks = {
+                    "common": rng.sample(vocabulary[:20], 2),
+                    "rare": rng.sample(vocabulary[2000:], 1),
+                    "mixed": [rng.choice(vocabulary[:50]), rng.choice(vocabulary[200:2000])],
+                }
+                for kind, terms in picks.items():
+                    started = time.perf_counter()
+                    search_documents(db, 1 + rng.randrange(users), " ".join(terms), limit=20)
+                    samples[kind].append(time.perf_counter() - started)
+            return {
+                "index_build_seconds": round(build_seconds, 1),
+                "database_mb": round(os.path.getsize(os.path.join(tmp, "search.db")) / 1e6, 1),
+                **{f"{kind}_query": latency_summary(times) for kind, times in samples.items()},
+            }
+        finally:
+            _indexes.pop(str(engine.url), None)
+            db.close()
+            engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--words", type=int, default=60, help="words of text per document")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--backend", choices=["fts5", "inverted", "both"], default="both")
+    args = parser.parse_args()
+
+    backends = ["fts5", "inverted"] if args.backend == "both" else [args.backend]
+    results = {backend: run(backend, args.documents, args.users, args.words, args.queries) for backend in backends}
+    print(json.dumps({"documents": args.documents, "users": args.users, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 from shared.database import init_database, SessionLocal
 from auth.models import User
-from werkzeug.security import generate_password_hash
 
 def create_test_user():
     """Create a test user for API testing"""
+    from werkzeug.security import generate_password_hash  # Only needed here - keeps the script's startup quick
     
     init_database()
     db = SessionLocal()
@@ -0,0 +1,288 @@
+"""
+Removing stored files nothing points at any more
+
+Deleting a document never touches the disk in the request. The row goes,
+and a DeletedFile tombstone for its file is added in the same transaction,
+so after a crash there's either the document or the tombstone - never a
+row pointing at a file that was already unlinked. The reaper then works
+through the tombstones in batches.
+
+collect_garbage() catches whatever slips past that, like a crash between
+placing a file and committing its row. It walks the storage directory with
+os.scandir, checks what it finds against the database a batch at a time
+(memory stays flat however many files there are) and reports rows whose
+file is missing.
+
+    python -m documents.cleanup gc --dry-run   # see what would go
+    python -m documents.cleanup gc             # reclaim it
+    python -m documents.cleanup reap           # empty the tombstone queue now
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from documents.models import DeletedFile, Document, UploadSession
+from documents.storage import StorageBackend, get_storage, lock_paths
+from shared.database import SessionLocal, init_database
+from config import REAPER_INTERVAL, REAPER_BATCH_SIZE, GC_BATCH_SIZE, GC_MIN_AGE
+
+logger = logging.getLogger(__name__)
+
+# Most missing-file document ids a report lists (it always has the full count)
+MISSING_SAMPLE_SIZE = 100
+
+
+def _referenced(db: Session, paths: Set[str], include_tombstones: bool = False) -> Set[str]:
+    """Which of these paths the database still knows about"""
+    # Paths are stored however UPLOAD_DIR was spelled, so ask for both forms
+    candidates = paths | {os.path.abspath(path) for path in paths}
+    known = {row.file_path for row in db.query(Document.file_path).filter(Document.file_path.in_(candidates))}
+    # Resumable uploads fill a temp file inside the storage area
+    known.update(row.temp_path for row in db.query(UploadSession.temp_path).filter(UploadSession.temp_path.in_(candidates)))
+    if include_tombstones:
+        known.update(row.file_path for row in db.query(DeletedFile.file_path).filter(DeletedFile.file_path.in_(candidates)))
+    known |= {os.path.abspath(path) for path in known}
+    return {path for path in paths if path in known or os.path.abspath(path) in known}
+
+
+def _reap(db: Session, storage: StorageBackend, tombstones: List[Tuple[int, str]]) -> Tuple[int, int]:
+    """
+    Unlink the files behind these tombstones, returns (files removed, bytes freed)
+
+    Nothing may commit a new reference to one of these files (a duplicate
+    landing on a CAS blob) between the check and the unlink. On SQLite,
+    deleting the tombstones first takes the database's only write lock; on
+    PostgreSQL the paths' advisory locks, which place() takes too, keep
+    uploads of the same blobs waiting until this commits.
+    """
+    paths = {path for _, path in tombstones}
+    try:
+        lock_paths(db, paths)
+        db.query(DeletedFile).filter(DeletedFile.id.in_([id for id, _ in tombstones])).delete(synchronize_session=False)
+        # Another document can still need the file - a CAS blob shared by several, or taken back by a re-upload
+        unused = paths - _referenced(db, paths)
+        freed = sum(storage.unlink(path) for path in unused)
+        removed = len(unused)
+        db.commit()
+    except Exception:
+        # Tombstones come back with the rollback, and unlinking twice is harmless
+        db.rollback()
+        raise
+    return removed, freed
+
+
+def reap_deleted_files(db: Session, storage: StorageBackend, batch_size: int = REAPER_BATCH_SIZE) -> Tuple[int, int]:
+    """One batch of tombstones, oldest first - returns (files removed, bytes freed)"""
+    tombstones = [
+        (row.id, row.file_path)
+        for row in db.query(DeletedFile.id, DeletedFile.file_path).order_by(DeletedFile.id).limit(batch_size)
+    ]
+    # End the read so the delete in _reap starts a fresh transaction (SQLite won't upgrade a stale read)
+    db.rollback()
+    if not tombstones:
+        return 0, 0
+    return _reap(db, storage, tombstones)
+
+
+_wakeup = threading.Event()
+
+def wake_reaper():
+    """A delete was committed - have the reaper in this process run now rather than at its next interval"""
+    _wakeup.set()
+
+
+class Reaper:
+    """Empties the tombstone queue in the background until told to stop"""
+
+    def __init__(self, session_factory=SessionLocal, storage: Optional[StorageBackend] = None,
+                 interval: float = REAPER_INTERVAL, batch_size: int = REAPER_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.storage = storage if storage is not None else get_storage()
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stop_event = threading.Event()
+
+    def run_once(self) -> Tuple[int, int]:
+        """Reap until the queue is empty - returns (files removed, bytes freed)"""
+        removed = freed = 0
+        db = self.session_factory()
+        try:
+            while not self.stop_event.is_set() and db.query(DeletedFile.id).first() is not None:
+                files, size = reap_deleted_files(db, self.storage, self.batch_size)
+                removed, freed = removed + files, freed + size
+        finally:
+            db.close()
+        if removed:
+            logger.info("Reaped %s deleted files, %s bytes", removed, freed)
+        return removed, freed
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                # DB locked or gone for a moment - the tombstones are still there next time
+                logger.exception("Reaper error")
+            _wakeup.wait(self.interval)
+            _wakeup.clear()
+
+    def stop(self):
+        self.stop_event.set()
+        _wakeup.set()
+
+
+def start_reaper() -> Reaper:
+    """Background reaper thread inside the API process"""
+    reaper = Reaper()
+    threading.Thread(target=reaper.run, name="docflow-reaper", daemon=True).start()
+    return reaper
+
+
+@dataclass
+class GarbageReport:
+    files_scanned: int = 0
+    bytes_scanned: int = 0
+    orphans: int = 0
+    orphan_bytes: int = 0
+    files_removed: int = 0
+    bytes_reclaimed: int = 0
+    documents_checked: int = 0
+    missing_files: int = 0
+    missing_document_ids: List[int] = field(default_factory=list)  # The first MISSING_SAMPLE_SIZE of them
+    dry_run: bool = False
+
+
+def walk_files(root: str) -> Iterator[os.DirEntry]:
+    """Every regular file under root, streamed - only the directories still to visit are held"""
+    pending = [root]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except FileNotFoundError:
+            continue  # Removed while we were walking
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def collect_garbage(
+    db: Session,
+    storage: StorageBackend,
+    batch_size: int = GC_BATCH_SIZE,
+    min_age: float = GC_MIN_AGE,
+    dry_run: bool = False
+) -> GarbageReport:
+    """
+    Reconcile the storage directory with the database
+
+    Files no document, upload session or tombstone mentions, and that are
+    older than min_age, are orphans. They're tombstoned and reaped like any
+    deleted file, so the reaper's locked re-check is still the last word.
+    Then the documents table is walked by id for rows whose file is gone -
+    those are only reported, since the row is the user's record of the upload.
+    """
+    report = GarbageReport(dry_run=dry_run)
+    cutoff = time.time() - min_age
+
+    for batch in _batches(walk_files(str(storage.base_dir)), batch_size):
+        sizes = {}
+        for entry in batch:
+            try:
+                stat_result = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            report.files_scanned += 1
+            report.bytes_scanned += stat_result.st_size
+            # Young files may belong to an upload that hasn't committed yet
+            if stat_result.st_mtime < cutoff:
+                sizes[entry.path] = stat_result.st_size
+        if not sizes:
+            continue
+        orphans = set(sizes) - _referenced(db, set(sizes), include_tombstones=True)
+        db.rollback()
+        report.orphans += len(orphans)
+        report.orphan_bytes += sum(sizes[path] for path in orphans)
+        if dry_run or not orphans:
+            continue
+
+        tombstones = [DeletedFile(file_path=path) for path in sorted(orphans)]
+        db.add_all(tombstones)
+        db.flush()
+        tombstones = [(tombstone.id, tombstone.file_path) for tombstone in tombstones]
+        db.commit()
+        removed, freed = _reap(db, storage, tombstones)
+        report.files_removed += removed
+        report.bytes_reclaimed += freed
+
+    last_id = 0
+    while True:
+        rows = db.query(Document.id, Document.file_path).filter(
+            Document.id > last_id
+        ).order_by(Document.id).limit(batch_size).all()
+        db.rollback()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        report.documents_checked += len(rows)
+        for row in rows:
+            if not os.path.exists(row.file_path):
+                report.missing_files += 1
+                if len(report.missing_document_ids) < MISSING_SAMPLE_SIZE:
+                    report.missing_document_ids.append(row.id)
+
+    logger.info(
+        "GC scanned %s files (%s bytes): %s orphans (%s bytes), reclaimed %s bytes; %s documents missing their file",
+        report.files_scanned, report.bytes_scanned, report.orphans, report.orphan_bytes,
+        report.bytes_reclaimed, report.missing_files
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reclaim disk space from deleted and orphaned DocFlow files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    gc = commands.add_parser("gc", help="find files the database doesn't know about, and rows whose file is gone")
+    gc.add_argument("--dry-run", action="store_true", help="report only, remove nothing")
+    gc.add_argument("--min-age", type=float, default=GC_MIN_AGE, help="seconds a file must be untouched to count as an orphan")
+    gc.add_argument("--batch-size", type=int, default=GC_BATCH_SIZE)
+    commands.add_parser("reap", help="unlink every tombstoned file now")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    init_database()  # deleted_files may not exist yet on an older database
+    if args.command == "reap":
+        removed, freed = Reaper().run_once()
+        print(f"Reaped {removed} files, {freed} bytes")
+        return
+
+    db = SessionLocal()
+    try:
+        report = collect_garbage(db, get_storage(), batch_size=args.batch_size, min_age=args.min_age, dry_run=args.dry_run)
+    finally:
+        db.close()
+    action = "would reclaim" if report.dry_run else "reclaimed"
+    print(f"Scanned {report.files_scanned} files ({report.bytes_scanned} bytes)")
+    print(f"Orphans: {report.orphans} ({report.orphan_bytes} bytes), {action} "
+          f"{report.orphan_bytes if report.dry_run else report.bytes_reclaimed} bytes")
+    print(f"Documents missing their file: {report.missing_files} of {report.documents_checked}"
+          + (f" - ids {report.missing_document_ids}" if report.missing_document_ids else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+At-rest compression for stored documents
+
+CSVs and old binary Office files shrink 5-10x, so they're compressed as
+they're written - zstd when the zstandard package is installed, zlib
+otherwise. The choice is made per upload from the MIME type and a quick
+trial compression of the first chunk, and recorded as Document.codec
+(None means the file is stored as it came).
+
+Files are written as independent frames of COMPRESSION_FRAME_SIZE bytes
+each, followed by a seek table - the zstd seekable format, so `zstd -d`
+can read our .zst files directly. A read at any offset only decompresses
+the frames it touches, which keeps Range requests cheap.
+
+    [frame][frame]...[frame][skippable frame: (compressed, decompressed) size per frame][footer]
+"""
+import bisect
+import io
+import os
+import struct
+import zlib
+from typing import List, Optional
+from shared.lazy import optional_import
+from shared.validators import CSV, DOC, XLS
+from config import COMPRESSION_ENABLED, COMPRESSION_CODEC, COMPRESSION_LEVEL, COMPRESSION_FRAME_SIZE, COMPRESSION_MIN_SAVING
+
+# Optional - zlib does the same job, a bit slower and a bit bigger (imported on first use)
+zstandard = optional_import("zstandard")
+
+ZSTD, ZLIB = "zstd", "zlib"
+
+# What content-addressed blobs stored with each codec are called (<hash><suffix>)
+FILE_SUFFIXES = {ZSTD: ".zst", ZLIB: ".zz"}
+
+# Text and the old compound-file formats - everything else we take is already compressed inside
+COMPRESSIBLE_MIME_TYPES = frozenset({CSV, DOC, XLS})
+
+# How much of the first chunk the trial compression looks at
+PROBE_SIZE = 64 * 1024
+
+# zstd seekable format: a skippable frame holding the table, then a 9 byte footer
+_SKIPPABLE_MAGIC = 0x184D2A5E
+_SEEKABLE_MAGIC = 0x8F92EAB1
+_ENTRY = struct.Struct("<II")  # compressed size, decompressed size
+_FOOTER = struct.Struct("<IBI")  # frame count, descriptor, magic
+_SKIPPABLE_HEADER = struct.Struct("<II")  # magic, size of what follows
+
+DEFAULT_LEVELS = {ZSTD: 3, ZLIB: 6}
+
+
+def available_codecs() -> List[str]:
+    return [ZSTD, ZLIB] if zstandard is not None else [ZLIB]
+
+
+def default_codec() -> Optional[str]:
+    """What new files get compressed with - None if compression is switched off"""
+    if not COMPRESSION_ENABLED:
+        return None
+    if COMPRESSION_CODEC == "auto":
+        return available_codecs()[0]
+    if COMPRESSION_CODEC not in available_codecs():
+        raise ValueError(f"Compression codec '{COMPRESSION_CODEC}' isn't available. Options: auto, {', '.join(available_codecs())}")
+    return COMPRESSION_CODEC
+
+
+def _compressor(codec: str, level: Optional[int] = None):
+    level = level if level is not None else (COMPRESSION_LEVEL if COMPRESSION_LEVEL is not None else DEFAULT_LEVELS[codec])
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress
+    return lambda data: zlib.compress(data, level)
+
+
+def _decompressor(codec: str):
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("This file is zstd compressed - install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress
+    if codec == ZLIB:
+        return zlib.decompress
+    raise ValueError(f"Unknown codec '{codec}'")
+
+
+def choose_codec(mime_type: str, head: bytes) -> Optional[str]:
+    """
+    Codec for a new upload, going by its type and first chunk - None to store it raw
+
+    The trial runs at the fastest level, so it costs well under a millisecond.
+    """
+    codec = default_codec()
+    if codec is None or mime_type not in COMPRESSIBLE_MIME_TYPES or not head:
+        return None
+    sample = bytes(head[:PROBE_SIZE])
+    compressed = len(_compressor(codec, level=1)(sample))
+    return codec if compressed <= len(sample) * (1 - COMPRESSION_MIN_SAVING) else None
+
+
+class FrameWriter:
+    """
+    Compresses whatever is written into a file as a sequence of frames
+
+    Raw bytes are buffered up to one frame, so memory stays at about
+    COMPRESSION_FRAME_SIZE. close() writes the last frame and the seek table.
+    """
+
+    def __init__(self, file, codec: str, frame_size: int = COMPRESSION_FRAME_SIZE):
+        self.file = file
+        self.codec = codec
+        self.frame_size = frame_size
+        self.stored_size = 0
+        self._compress = _compressor(codec)
+        self._buffer = bytearray()
+        self._frames = []  # (compressed, decompressed) sizes
+        self._closed = False
+
+    def write(self, data: bytes):
+        self._buffer += data
+        while len(self._buffer) >= self.frame_size:
+            self._write_frame(self._buffer[:self.frame_size])
+            del self._buffer[:self.frame_size]
+
+    def _write_frame(self, raw):
+        frame = self._compress(bytes(raw))
+        self.file.write(frame)
+        self.stored_size += len(frame)
+        self._frames.append((len(frame), len(raw)))
+
+    def close(self):
+        """Last frame and the seek table - doesn't close the file itself. Safe to call twice."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._buffer or not self._frames:
+            self._write_frame(self._buffer)
+            self._buffer = bytearray()
+        entries = b"".join(_ENTRY.pack(*sizes) for sizes in self._frames)
+        footer = _FOOTER.pack(len(self._frames), 0, _SEEKABLE_MAGIC)
+        table = _SKIPPABLE_HEADER.pack(_SKIPPABLE_MAGIC, len(entries) + len(footer)) + entries + footer
+        self.file.write(table)
+        self.stored_size += len(table)
+
+
+class StoredFile(io.RawIOBase):
+    """
+    Read-only view of a stored document's original bytes
+
+    pread() is the random-access read the download and export paths use;
+    it's also a normal seekable file object, so csv/zipfile/TextIOWrapper
+    can read through it. This base class is for files stored raw.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.fd = os.open(path, os.O_RDONLY)
+        self.size = os.fstat(self.fd).st_size
+        self._position = 0
+
+    def pread(self, size: int, offset: int) -> bytes:
+        return os.pread(self.fd, size, offset)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.pread(len(buffer), self._position)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._position, os.SEEK_END: self.size}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            os.close(self.fd)
+        super().close()
+
+
+class CompressedFile(StoredFile):
+    """A compressed document - reads decompress just the frames they cover (the last one is kept)"""
+
+    def __init__(self, path: str, codec: str):
+        super().__init__(path)
+        try:
+            self._decompress = _decompressor(codec)
+            self._read_seek_table()
+        except Exception:
+            super().close()
+            raise
+        self._cached_frame = (-1, b"")
+
+    def _read_seek_table(self):
+        stored_size = self.size
+        if stored_size < _FOOTER.size:
+            raise ValueError("Compressed file is truncated")
+        frame_count, _, magic = _FOOTER.unpack(os.pread(self.fd, _FOOTER.size, stored_size - _FOOTER.size))
+        if magic != _SEEKABLE_MAGIC:
+            raise ValueError("Compressed file has no seek table")
+        table_size = frame_count * _ENTRY.size
+        table = os.pread(self.fd, table_size, stored_size - _FOOTER.size - table_size)
+        # Where each frame starts in the file, and in the original bytes
+        self._stored_offsets, self._offsets = [0], [0]
+        for compressed, decompressed in _ENTRY.iter_unpack(table):
+            self._stored_offsets.append(self._stored_offsets[-1] + compressed)
+            self._offsets.append(self._offsets[-1] + decompressed)
+        self.size = self._offsets[-1]
+
+    def _frame(self, index: int) -> bytes:
+        if self._cached_frame[0] != index:
+            start, end = self._stored_offsets[index], self._stored_offsets[index + 1]
+            self._cached_frame = (index, self._decompress(os.pread(self.fd, end - start, start)))
+        return self._cached_frame[1]
+
+    def pread(self, size: int, offset: int) -> bytes:
+        end = min(offset + size, self.size)
+        parts = []
+        while offset < end:
+            index = bisect.bisect_right(self._offsets, offset) - 1
+            frame = self._frame(index)
+            start = offset - self._offsets[index]
+            part = frame[start:start + end - offset]
+            if not part:
+                raise ValueError("Compressed frame is shorter than the seek table says")
+            parts.append(part)
+            offset += len(part)
+        return b"".join(parts)
+
+
+def open_stored(path: str, codec: Optional[str] = None) -> StoredFile:
+    """A stored document's original bytes, whichever way it was stored"""
+    return CompressedFile(path, codec) if codec else StoredFile(path)
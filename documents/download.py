@@ -0,0 +1,192 @@
+import os
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Mapping, Optional, Tuple
+from fastapi import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+from documents.models import Document
+from documents.compression import open_stored
+from shared.utils import original_filename, run_blocking
+from config import DOWNLOAD_CHUNK_SIZE
+
+# A stored document's bytes never change, but the client has to check back
+# with us each time (it might have been deleted or the user might have lost access)
+CACHE_CONTROL = "private, no-cache"
+
+
+def document_etag(document: Document) -> str:
+    """The content hash is already a perfect strong validator"""
+    if document.content_hash:
+        return f'"{document.content_hash}"'
+    # Rows from before hashing - still unique per stored file
+    return f'"{document.id}-{document.file_size}-{int(_as_utc(document.uploaded_at).timestamp())}"'
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes, but func.now() stored UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    if header.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in header.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+
+def is_not_modified(headers: Mapping[str, str], etag: str, last_modified: datetime) -> bool:
+    """Conditional GET check - only needs the DB row, never touches the file"""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        # When both are sent If-None-Match wins (RFC 9110 13.2.2)
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # HTTP dates only go down to the second
+        return int(last_modified.timestamp()) <= int(since.timestamp())
+    return False
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Turn a Range header into an inclusive (start, end), or None for the whole file
+
+    Only single ranges are served. Anything we don't understand (other units,
+    several ranges, junk) gets the whole file, which the RFC allows. A range
+    that starts past the end is a 416.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            # bytes=-500 is the last 500 bytes
+            suffix = int(last)
+            if suffix <= 0:
+                raise _range_not_satisfiable(size)
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise _range_not_satisfiable(size)
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _range_not_satisfiable(size: int) -> HTTPException:
+    return HTTPException(
+        status_code=416,
+        detail="Requested range not satisfiable",
+        headers={"Content-Range": f"bytes */{size}"}
+    )
+
+
+class DocumentFileResponse(FileResponse):
+    """
+    FileResponse that can send just part of the file
+
+    When the server offers the ASGI zero-copy extension the kernel copies
+    the file straight to the socket. Otherwise it's read with pread on the
+    I/O pool, one bounded chunk at a time, so a big PDF never sits in memory.
+    Files compressed at rest (codec set) always take the pread route - only
+    the frames the range covers get decompressed - and size is then the
+    original size rather than what's on disk.
+    """
+
+    chunk_size = DOWNLOAD_CHUNK_SIZE
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        byte_range: Optional[Tuple[int, int]] = None,
+        codec: Optional[str] = None,
+        size: Optional[int] = None,
+        **kwargs
+    ):
+        super().__init__(path, stat_result=stat_result, **kwargs)
+        self.codec = codec
+        size = size if size is not None else stat_result.st_size
+        self.start, self.end = byte_range or (0, size - 1)
+        self.headers["accept-ranges"] = "bytes"
+        if byte_range is not None:
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+        self.headers["content-length"] = str(self.end - self.start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        if self.send_header_only or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        stored = await run_blocking(open_stored, self.path, self.codec)
+        try:
+            if self.codec is None and "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": stored.fd, "offset": self.start, "count": count})
+                return
+            offset = self.start
+            while count > 0:
+                chunk = await run_blocking(stored.pread, min(self.chunk_size, count), offset)
+                if not chunk:
+                    break  # File got shorter under us - nothing sensible to do but stop
+                offset += len(chunk)
+                count -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": count > 0})
+            if count > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await run_blocking(stored.close)
+
+
+async def document_content_response(document: Document, headers: Mapping[str, str], method: str = "GET") -> Response:
+    """Build the response for GET/HEAD /documents/{id}/content"""
+    etag = document_etag(document)
+    last_modified = _as_utc(document.uploaded_at)
+    validators = {
+        "etag": etag,
+        "last-modified": formatdate(last_modified.timestamp(), usegmt=True),
+        "cache-control": CACHE_CONTROL,
+    }
+
+    # Answered from the DB row alone - no stat, no open
+    if is_not_modified(headers, etag, last_modified):
+        return Response(status_code=304, headers=validators)
+
+    try:
+        stat_result = await run_blocking(os.stat, document.file_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Document file is missing from storage")
+
+    # Compressed files are smaller on disk - the row has the size the client gets
+    size = document.file_size if document.codec else stat_result.st_size
+    byte_range = parse_range(headers.get("range"), size)
+    # If-Range: only send the part if the client's copy is still current
+    if_range = headers.get("if-range")
+    if byte_range is not None and if_range is not None and if_range.strip() != etag:
+        byte_range = None
+
+    return DocumentFileResponse(
+        document.file_path,
+        stat_result=stat_result,
+        byte_range=byte_range,
+        codec=document.codec,
+        size=size,
+        headers=validators,
+        media_type=document.mime_type,
+        filename=original_filename(document.filename),
+        content_disposition_type="inline",
+        method=method
+    )
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Dict, Set, Tuple
+from documents.models import DocumentStatus
+from shared.utils import run_blocking
+from config import STATUS_POLL_INTERVAL, SSE_KEEPALIVE
+
+# Nothing more will happen to a document in these states
+FINISHED_STATUSES = (DocumentStatus.COMPLETED, DocumentStatus.FAILED)
+
+
+class StatusNotifier:
+    """
+    Wakes up requests waiting on a document's status
+
+    Processing in this process calls notify() the moment it commits a
+    change, so waiters answer straight away. Workers in other processes
+    can't reach us, so waiters also re-read the row every
+    STATUS_POLL_INTERVAL - one primary-key lookup, not a client round-trip.
+    """
+
+    def __init__(self):
+        self._waiters: Dict[int, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+        self._lock = threading.Lock()
+
+    def notify(self, document_id: int):
+        """Safe to call from any thread"""
+        with self._lock:
+            waiters = list(self._waiters.get(document_id, ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    @contextmanager
+    def subscribe(self, document_id: int):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(document_id, set()).add(waiter)
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(document_id)
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[document_id]
+
+
+notifier = StatusNotifier()
+
+
+def notify_status(document_id: int):
+    notifier.notify(document_id)
+
+
+async def _wait(event: asyncio.Event, timeout: float) -> bool:
+    try:
+        await asyncio.wait_for(event.wait(), timeout=max(0.0, timeout))
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def wait_for_status_change(load_status: Callable[[], dict], document_id: int, since: str, timeout: float) -> dict:
+    """
+    Long-poll: return as soon as the status isn't `since` any more, or after timeout
+
+    load_status is a blocking call (it reads the DB) and runs on the I/O pool.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    with notifier.subscribe(document_id) as changed:
+        while True:
+            # Clear before reading, so a notify that lands in between isn't lost
+            changed.clear()
+            status = await run_blocking(load_status)
+            remaining = deadline - loop.time()
+            if status["status"] != since or remaining <= 0:
+                return status
+            await _wait(changed, min(STATUS_POLL_INTERVAL, remaining))
+
+
+async def status_event_stream(load_status: Callable[[], dict], document_id: int, first: dict) -> AsyncIterator[str]:
+    """
+    Server-Sent Events: one "status" event per change, ending once the document is finished
+
+    A comment line goes out after SSE_KEEPALIVE seconds of quiet so proxies
+    don't close the connection.
+    """
+    loop = asyncio.get_running_loop()
+    status = first
+    yield _sse("status", status)
+    with notifier.subscribe(document_id) as changed:
+        quiet_since = loop.time()
+        while status["status"] not in FINISHED_STATUSES:
+            changed.clear()
+            latest = await run_blocking(load_status)
+            if latest != status:
+                status = latest
+                yield _sse("status", status)
+                quiet_since = loop.time()
+                continue
+            if loop.time() - quiet_since >= SSE_KEEPALIVE:
+                yield ": keepalive\n\n"
+                quiet_since = loop.time()
+            await _wait(changed, STATUS_POLL_INTERVAL)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,233 @@
+"""
+Bulk export - all of a user's documents as one ZIP or tar, built as it's sent
+
+Nothing is assembled up front: each file is read in DOWNLOAD_CHUNK_SIZE
+pieces, pushed through the archive writer and handed to the client before
+the next piece is read, so memory stays flat however big the archive gets
+and no temporary archive ever touches the disk. The only thing that grows
+with the export is the manifest (a few hundred bytes per document), which
+goes in last as manifest.json so it can also list files that were missing.
+"""
+import json
+import tarfile
+import time
+import zipfile
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+from documents.compression import StoredFile, open_stored
+from shared.utils import original_filename, run_blocking
+from shared.validators import DOCX, XLSX
+from config import DOWNLOAD_CHUNK_SIZE
+
+# Already deflate-compressed inside (they're zips) - compressing again just burns CPU
+ALREADY_COMPRESSED = frozenset({DOCX, XLSX})
+
+MANIFEST_NAME = "manifest.json"
+
+
+class _Sink:
+    """Write-only file the archive writers write into - drained after every step"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class ZipExport:
+    """
+    ZIP written front to back - no seeking back to fill in sizes
+
+    zipfile sees a stream it can't seek, so each entry gets its CRC and sizes
+    in a data descriptor after the data, and zip64 records kick in by
+    themselves past 4GB.
+    """
+
+    media_type = "application/zip"
+    extension = "zip"
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._archive = zipfile.ZipFile(self._sink, "w", allowZip64=True)
+        self._entry = None
+
+    def start(self, name: str, size: int, modified: datetime, mime_type: str) -> bytes:
+        info = zipfile.ZipInfo(name, date_time=max(modified.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+        info.compress_type = zipfile.ZIP_STORED if mime_type in ALREADY_COMPRESSED else zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        info.file_size = size  # Only a hint - lets zipfile pick zip64 for big entries
+        self._entry = self._archive.open(info, "w")
+        return self._sink.drain()
+
+    def write(self, chunk: bytes) -> bytes:
+        self._entry.write(chunk)
+        return self._sink.drain()
+
+    def end(self) -> bytes:
+        self._entry.close()
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._archive.close()
+        return self._sink.drain()
+
+
+class TarExport:
+    """
+    Plain (ustar/pax) tar - headers are built by tarfile, the data is passed straight through
+
+    A tar header needs the size before the data, so the stored file's size is
+    used; if the file changes length underneath us the entry is cut or
+    zero-padded to match, which keeps the archive readable.
+    """
+
+    media_type = "application/x-tar"
+    extension = "tar"
+
+    def __init__(self):
+        self._remaining = 0
+        self._padding = 0
+        self._written = 0
+
+    def _out(self, data: bytes) -> bytes:
+        self._written += len(data)
+        return data
+
+    def start(self, name: str, size: int, modified: datetime, mime_type: str) -> bytes:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(modified.timestamp())
+        info.mode = 0o644
+        self._remaining = size
+        self._padding = -size % tarfile.BLOCKSIZE
+        return self._out(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+
+    def write(self, chunk: bytes) -> bytes:
+        chunk = chunk[:self._remaining]
+        self._remaining -= len(chunk)
+        return self._out(chunk)
+
+    def end(self) -> bytes:
+        return self._out(b"\0" * (self._remaining + self._padding))
+
+    def close(self) -> bytes:
+        # Two empty blocks mark the end, then pad to a whole record like tarfile does
+        end = tarfile.BLOCKSIZE * 2
+        end += -(self._written + end) % tarfile.RECORDSIZE
+        return self._out(b"\0" * end)
+
+
+EXPORT_FORMATS = {
+    "zip": ZipExport,
+    "tar": TarExport,
+}
+
+
+def _as_utc(value: Optional[datetime]) -> datetime:
+    if value is None:
+        return datetime.now(timezone.utc)
+    # SQLite hands back naive datetimes, but func.now() stored UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def archive_name(row) -> str:
+    # Names aren't unique per user, ids are
+    return f"documents/{row.id}_{original_filename(row.filename)}"
+
+
+def _open(path: str, codec: Optional[str]) -> Optional[StoredFile]:
+    """The stored file, decompressing if it was compressed at rest - None when it has gone"""
+    try:
+        return open_stored(path, codec)
+    except FileNotFoundError:
+        return None
+
+
+def _next_chunk(archive, stored: StoredFile, offset: int) -> Tuple[int, bytes]:
+    """Read and compress one chunk in a single trip to the I/O pool - (bytes read, archive bytes out)"""
+    chunk = stored.pread(DOWNLOAD_CHUNK_SIZE, offset)
+    return len(chunk), archive.write(chunk) if chunk else b""
+
+
+async def export_archive(
+    archive_format: str,
+    load_page: Callable[[Optional[str]], Tuple[list, Optional[str]]],
+    manifest_header: dict
+) -> AsyncIterator[bytes]:
+    """
+    The archive's bytes, a piece at a time, for a StreamingResponse
+
+    load_page(cursor) returns ([(listing row, file row)], next cursor) -
+    DocumentService.export_page does, one keyset page at a time.
+    """
+    async for piece in _archive_pieces(archive_format, load_page, manifest_header):
+        # Compressors hold on to small writes, so plenty of steps have nothing to send yet
+        if piece:
+            yield piece
+
+
+async def _archive_pieces(archive_format: str, load_page: Callable, manifest_header: dict) -> AsyncIterator[bytes]:
+    archive = EXPORT_FORMATS[archive_format]()
+    documents, missing = [], []
+    cursor = None
+    while True:
+        page, cursor = await run_blocking(load_page, cursor)
+        for row, files in page:
+            stored = await run_blocking(_open, files.file_path, files.codec)
+            if stored is None:
+                missing.append({"document_id": row.id, "filename": original_filename(row.filename)})
+                continue
+            try:
+                size = stored.size
+                name = archive_name(row)
+                yield archive.start(name, size, _as_utc(row.uploaded_at), row.mime_type)
+                offset = 0
+                while offset < size:
+                    read, data = await run_blocking(_next_chunk, archive, stored, offset)
+                    if not read:
+                        break  # Got shorter under us - the archive writer squares the entry up
+                    offset += read
+                    yield data
+                yield await run_blocking(archive.end)
+            finally:
+                stored.close()  # Never blocks, and has to happen even if the client went away
+            documents.append({
+                "path": name,
+                "document_id": row.id,
+                "filename": original_filename(row.filename),
+                "mime_type": row.mime_type,
+                "file_size": size,
+                "content_hash": files.content_hash,
+                "status": row.status,
+                "uploaded_at": _as_utc(row.uploaded_at).isoformat(),
+                "processed_at": _as_utc(row.processed_at).isoformat() if row.processed_at else None,
+            })
+        if not cursor:
+            break
+
+    manifest = json.dumps({
+        **manifest_header,
+        "format": archive_format,
+        "document_count": len(documents),
+        "total_bytes": sum(document["file_size"] for document in documents),
+        "documents": documents,
+        "missing": missing,
+    }, indent=2).encode()
+    yield archive.start(MANIFEST_NAME, len(manifest), datetime.now(timezone.utc), "application/json")
+    yield archive.write(manifest)
+    yield archive.end()
+    yield archive.close()
+
+
+def export_filename(archive_format: str) -> str:
+    return f"docflow-export-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}.{EXPORT_FORMATS[archive_format].extension}"
@@ -1,29 +1,105 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, Float, ForeignKey, CheckConstraint
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, Float, ForeignKey, CheckConstraint, Index
 from sqlalchemy.sql import func
 from shared.database import Base
 
+class DocumentStatus:
+    """The four lifecycle states: uploaded → processing → completed / failed"""
+    UPLOADED = "uploaded"
+    PROCESSING = "processing"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    
+    ALL = (UPLOADED, PROCESSING, COMPLETED, FAILED)
+
 class Document(Base):
     __tablename__ = "documents"
     
     # Basic document info
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)  # Links to user who uploaded it
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # Links to user who uploaded it (indexed via the listing indexes below)
     filename = Column(String(100), nullable=False)  # What the user sees
     file_path = Column(String(500), nullable=False)  # Where it's actually stored
     file_size = Column(Integer, nullable=False)  # Size in bytes
     mime_type = Column(String(50), nullable=False)  # application/pdf etc
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 of the bytes - shared blobs are ref-counted by this
+    codec = Column(String(10), nullable=True)  # How the file is compressed on disk ("zstd"/"zlib"), None if it isn't
     
     # Status tracking - took me a while to get these states right
-    status = Column(String(20), nullable=False, default="uploaded")
+    status = Column(String(20), nullable=False, default=DocumentStatus.UPLOADED)
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())  # Auto timestamp
+    processing_started_at = Column(DateTime(timezone=True), nullable=True)  # When a worker claimed it
     processed_at = Column(DateTime(timezone=True), nullable=True)  # When processing finished
+    processing_error = Column(String(500), nullable=True)  # Why it failed, if it did
     
     # Database constraint to prevent invalid status values - learned this prevents data corruption
     __table_args__ = (
         CheckConstraint("status IN ('uploaded', 'processing', 'completed', 'failed')", 
                        name='valid_status'),
+        # Listing pages walk (uploaded_at, id) for one user, so both shapes of that
+        # query are index range scans - with and without a status filter
+        Index("ix_documents_user_status_uploaded", "user_id", "status", "uploaded_at", "id"),
+        Index("ix_documents_user_uploaded", "user_id", "uploaded_at", "id"),
+        # Workers pick the oldest documents in a status - this is the processing queue's index
+        Index("ix_documents_status_id", "status", "id"),
     )
     
     def __repr__(self):
         # Useful for debugging - shows key info when you print the object
         return f"<Document(id={self.id}, filename='{self.filename}', status='{self.status}')>"
+
+
+class UploadSession(Base):
+    """A resumable upload in progress - chunks land in temp_path at their own offsets"""
+    __tablename__ = "upload_sessions"
+    
+    id = Column(String(26), primary_key=True)  # ULID, handed to the client
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    filename = Column(String(255), nullable=False)  # As the client named it
+    mime_type = Column(String(50), nullable=False)
+    total_size = Column(Integer, nullable=False)
+    chunk_size = Column(Integer, nullable=False)  # Every chunk is this size except the last
+    temp_path = Column(String(500), nullable=False)  # Preallocated file inside the storage area
+    state = Column(String(20), nullable=False, default="open", server_default="open")  # "completing" once a complete request has claimed it
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # Old sessions get expired
+    
+    @property
+    def chunk_count(self) -> int:
+        return max(1, -(-self.total_size // self.chunk_size))
+    
+    def __repr__(self):
+        return f"<UploadSession(id='{self.id}', filename='{self.filename}', size={self.total_size})>"
+
+
+class UploadChunk(Base):
+    """One chunk of an upload session that's safely on disk"""
+    __tablename__ = "upload_chunks"
+    
+    session_id = Column(String(26), ForeignKey("upload_sessions.id", ondelete="CASCADE"), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+
+
+class PendingUpload(Base):
+    """
+    A document accepted with 202 whose bytes haven't been checked and stored yet
+
+    Its file_path points at the raw temp file until the ingest step (the
+    first thing processing does) sniffs, hashes and places it.
+    """
+    __tablename__ = "pending_uploads"
+    
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class DeletedFile(Base):
+    """
+    A stored file whose document has gone - tombstone for the reaper
+
+    Added in the same transaction that deletes the row, and only removed
+    once the file is unlinked (or turns out to be needed again).
+    """
+    __tablename__ = "deleted_files"
+    
+    id = Column(Integer, primary_key=True)
+    file_path = Column(String(500), nullable=False)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now())
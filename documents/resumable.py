@@ -0,0 +1,220 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List, Optional
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from documents.models import Document, UploadChunk, UploadSession
+from documents.service import DocumentService, file_too_large
+from documents.storage import StreamingFileWriter
+from shared.utils import run_blocking, new_ulid
+from shared.validators import SNIFF_SIZE
+from config import MAX_FILE_SIZE, RESUMABLE_CHUNK_SIZE, RESUMABLE_MAX_CHUNK_SIZE, UPLOAD_SESSION_TTL
+
+# Smaller chunks just mean more requests - don't let a client pick something silly
+MIN_CHUNK_SIZE = 256 * 1024
+
+# UploadSession.state - a complete request claims the session before touching its file
+SESSION_OPEN = "open"
+SESSION_COMPLETING = "completing"
+
+
+class ResumableUploadService(DocumentService):
+    """
+    Uploads sent as numbered chunks over as many requests as it takes
+
+    The session's temp file is created full size up front inside the storage
+    area, and each chunk is written straight to its offset - so chunks can
+    arrive in any order, in parallel, or more than once, and there's no
+    assembly step at the end. Finishing hashes the file in one streaming
+    pass and places it like any other upload.
+    """
+
+    def create_session(self, user_id: int, filename: str, content_type: str, total_size: int,
+                       chunk_size: Optional[int] = None) -> UploadSession:
+        """Validate what we can up front and reserve the file"""
+        self._check_file_type(content_type, filename)
+        if total_size > MAX_FILE_SIZE:
+            raise file_too_large()
+        if total_size < 0:
+            raise HTTPException(status_code=400, detail="total_size can't be negative")
+        self.usage.check_quota(user_id, total_size)
+        chunk_size = chunk_size or RESUMABLE_CHUNK_SIZE
+        if not MIN_CHUNK_SIZE <= chunk_size <= RESUMABLE_MAX_CHUNK_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"chunk_size must be between {MIN_CHUNK_SIZE} and {RESUMABLE_MAX_CHUNK_SIZE} bytes"
+            )
+
+        # Clearing out abandoned uploads here keeps it off any hot path
+        self.expire_sessions()
+
+        # A storage writer gives us a temp file on the same filesystem as the final location
+        writer = self.storage.open_writer(user_id)
+        writer.finish()
+        try:
+            os.truncate(writer.temp_path, total_size)
+            session = UploadSession(
+                id=new_ulid(),
+                user_id=user_id,
+                filename=filename,
+                mime_type=content_type,
+                total_size=total_size,
+                chunk_size=chunk_size,
+                temp_path=writer.temp_path
+            )
+            self.db.add(session)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            writer.abort()
+            raise HTTPException(status_code=500, detail=f"Failed to start upload: {str(e)}")
+        return session
+
+    def get_session(self, user_id: int, session_id: str) -> UploadSession:
+        session = self.db.query(UploadSession).filter(
+            UploadSession.id == session_id,
+            UploadSession.user_id == user_id
+        ).first()
+        if not session:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return session
+
+    def received_chunks(self, session_id: str) -> List[int]:
+        rows = self.db.query(UploadChunk.chunk_index).filter(UploadChunk.session_id == session_id).order_by(UploadChunk.chunk_index)
+        return [row.chunk_index for row in rows]
+
+    def session_progress(self, user_id: int, session_id: str) -> dict:
+        """What's been stored so far - a client resuming after a dropped connection sends only the missing chunks"""
+        session = self.get_session(user_id, session_id)
+        received = self.received_chunks(session.id)
+        have = set(received)
+        return {
+            "upload_id": session.id,
+            "filename": session.filename,
+            "total_size": session.total_size,
+            "chunk_size": session.chunk_size,
+            "chunk_count": session.chunk_count,
+            "received_chunks": received,
+            "missing_chunks": [i for i in range(session.chunk_count) if i not in have],
+            "received_bytes": sum(self._chunk_length(session, i) for i in received),
+        }
+
+    def _chunk_length(self, session: UploadSession, index: int) -> int:
+        if not 0 <= index < session.chunk_count:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Chunk index out of range. This upload has chunks 0 to {session.chunk_count - 1}"
+            )
+        return min(session.chunk_size, session.total_size - index * session.chunk_size)
+
+    async def write_chunk(self, user_id: int, session_id: str, index: int, chunks: AsyncIterator[bytes]) -> dict:
+        """
+        Store one chunk at its offset
+
+        Idempotent - sending a chunk again just writes the same bytes over
+        themselves. It's only recorded as received once it's all on disk.
+        """
+        session = await run_blocking(self.get_session, user_id, session_id)
+        self._check_open(session)
+        expected = self._chunk_length(session, index)
+        offset = index * session.chunk_size
+
+        fd = await run_blocking(os.open, session.temp_path, os.O_WRONLY)
+        try:
+            written = 0
+            async for chunk in chunks:
+                if written + len(chunk) > expected:
+                    raise HTTPException(status_code=400, detail=f"Chunk {index} should be {expected} bytes")
+                await run_blocking(_pwrite_all, fd, chunk, offset + written)
+                written += len(chunk)
+            if written != expected:
+                raise HTTPException(status_code=400, detail=f"Chunk {index} should be {expected} bytes, got {written}")
+            await run_blocking(os.fsync, fd)
+        finally:
+            await run_blocking(os.close, fd)
+
+        await run_blocking(self._record_chunk, session.id, index)
+        return {"upload_id": session.id, "chunk": index, "size": expected}
+
+    def _check_open(self, session: UploadSession):
+        if session.state != SESSION_OPEN:
+            raise HTTPException(status_code=409, detail="Upload is already being completed")
+
+    def _record_chunk(self, session_id: str, index: int):
+        if self.db.query(UploadChunk).filter(UploadChunk.session_id == session_id, UploadChunk.chunk_index == index).first():
+            return
+        try:
+            self.db.add(UploadChunk(session_id=session_id, chunk_index=index))
+            self.db.commit()
+        except IntegrityError:
+            # The same chunk finished in a parallel request first
+            self.db.rollback()
+
+    def complete_session(self, user_id: int, session_id: str) -> Document:
+        """All chunks are in - validate the whole file and turn it into a document"""
+        session = self.get_session(user_id, session_id)
+        missing = self.session_progress(user_id, session_id)["missing_chunks"]
+        if missing:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload is missing {len(missing)} chunk(s), first missing is {missing[0]}"
+            )
+
+        # Claimed like processing claims a document - a retried complete (the first timed out while
+        # a big file was hashing) mustn't adopt the same temp file and make a second document
+        claimed = self.db.query(UploadSession).filter(
+            UploadSession.id == session.id,
+            UploadSession.state == SESSION_OPEN
+        ).update({UploadSession.state: SESSION_COMPLETING}, synchronize_session=False)
+        self.db.commit()
+        if not claimed:
+            raise HTTPException(status_code=409, detail="Upload is already being completed")
+
+        try:
+            # Same content check as a normal upload, on the start of the assembled file
+            with open(session.temp_path, "rb") as f:
+                head = f.read(SNIFF_SIZE)
+            self._check_file_content(session.mime_type, head)
+            writer = StreamingFileWriter.adopt(session.temp_path, max_size=MAX_FILE_SIZE, mime_type=session.mime_type)
+            writer.finish()
+            unique_filename = self._generate_unique_filename(session.filename)
+            document = self._create_document_record(user_id, session.mime_type, unique_filename, writer)
+        except Exception:
+            # Rejected, or the temp file is gone by now - either way the session is no use to anyone
+            self.db.rollback()
+            self._discard_session(session)
+            raise
+
+        # The temp file has been moved into place, so only the rows are left to go
+        self.db.delete(session)
+        self.db.commit()
+        return document
+
+    def abort_session(self, user_id: int, session_id: str):
+        session = self.get_session(user_id, session_id)
+        self._check_open(session)
+        self._discard_session(session)
+
+    def _discard_session(self, session: UploadSession):
+        temp_path = session.temp_path
+        self.db.delete(session)
+        self.db.commit()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    def expire_sessions(self, ttl_seconds: int = UPLOAD_SESSION_TTL) -> int:
+        """Throw away uploads nobody has finished within the TTL"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+        stale = self.db.query(UploadSession).filter(UploadSession.created_at < cutoff).all()
+        for session in stale:
+            self._discard_session(session)
+        return len(stale)
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int):
+    # pwrite can write less than it was given
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
@@ -1,16 +1,67 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+import functools
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from shared.database import get_db
-from documents.service import DocumentService
-from documents.models import Document
+from auth.service import current_user_id
+from shared.utils import run_blocking
+from documents.service import DocumentService, file_too_large, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from documents.resumable import ResumableUploadService
+from documents.download import document_content_response
+from documents.export import EXPORT_FORMATS, export_archive, export_filename
+from documents.events import status_event_stream, wait_for_status_change
+from search import index as search_index
+from documents.streaming import MultipartFileStream
+from config import MAX_FILE_SIZE, MULTIPART_OVERHEAD, STATUS_LONG_POLL_MAX
 
 # API endpoints for document operations
 router = APIRouter()
 
-@router.post("/", status_code=201)
+def declared_file_size(request: Request) -> int:
+    """Least the body's file(s) can add up to, going by Content-Length (0 if it wasn't sent)"""
+    content_length = request.headers.get("content-length", "")
+    return max(0, int(content_length) - MULTIPART_OVERHEAD) if content_length.isdigit() else 0
+
+# We read the multipart body ourselves, so describe the file field for the docs by hand
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"]
+                }
+            }
+        }
+    }
+}
+
+BATCH_UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+                    "required": ["files"]
+                }
+            }
+        }
+    }
+}
+
+@router.post("/", status_code=201, openapi_extra=UPLOAD_REQUEST_BODY)
 async def upload_document(
-    file: UploadFile = File(...),
+    request: Request,
+    response: Response,
+    mode: str = Query("sync", pattern="^(sync|async)$"),
+    user_id: int = Depends(current_user_id),
     db: Session = Depends(get_db)
 ):
     """
@@ -18,17 +69,47 @@ async def upload_document(
     
     - Checks file size and type
     - Prevents dodgy file extensions
-    - Saves to user folders
+    - Streams straight into user folders (no spooling)
     - Creates database record
-    """
     
-    # Using test user for now - proper auth would go here
-    test_user_id = 1
+    With ?mode=async (or a "Prefer: respond-async" header) it answers 202 as soon as the
+    bytes are received - content checks run in the background. Follow the document
+    with GET /documents/{id}/status?wait=30 or the /documents/{id}/events stream.
+    """
     
     try:
-        # Let the service handle all the validation logic
+        # Reject obviously oversized bodies before reading a single byte
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+            raise file_too_large()
+        
+        # Same for users already at their quota (or who would be after this file)
         service = DocumentService(db)
-        document = service.upload_document(test_user_id, file)
+        await run_blocking(service.usage.check_quota, user_id, declared_file_size(request))
+        
+        stream = MultipartFileStream(request.stream(), request.headers.get("content-type"))
+        part = await stream.next_file()
+        if part is None:
+            raise HTTPException(status_code=400, detail="No file provided")
+        
+        # Let the service handle all the validation logic
+        if mode == "async" or "respond-async" in request.headers.get("prefer", ""):
+            document = await service.accept_document_stream(user_id, part.filename, part.content_type, part.chunks())
+            response.status_code = 202
+            response.headers["Location"] = f"{request.url.path.rstrip('/')}/{document.id}/status"
+            return {
+                "document_id": document.id,
+                "filename": document.filename,
+                "file_size": document.file_size,
+                "mime_type": document.mime_type,
+                "status": document.status,
+                "uploaded_at": document.uploaded_at,
+                "status_url": f"/documents/{document.id}/status",
+                "events_url": f"/documents/{document.id}/events",
+                "message": "Upload accepted - checking and processing in the background"
+            }
+        
+        document = await service.upload_document_stream(user_id, part.filename, part.content_type, part.chunks())
         
         # Return useful info about the uploaded file
         return {
@@ -48,67 +129,128 @@ async def upload_document(
         # Catch anything unexpected
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-@router.get("/", response_model=List[dict])
-async def list_documents(
-    status: Optional[str] = None,
+@router.post("/batch", status_code=201, openapi_extra=BATCH_UPLOAD_REQUEST_BODY)
+async def upload_documents_batch(
+    request: Request,
+    response: Response,
+    user_id: int = Depends(current_user_id),
     db: Session = Depends(get_db)
 ):
     """
-    Get list of documents, optionally filter by status
+    Upload many files in one request (repeat the "files" field)
     
-    Can filter like: /documents?status=completed
+    - Every file is validated on its own - one bad file doesn't stop the rest
+    - All the new documents are saved in one transaction
+    - 201 if everything went in, 207 with per-file results if anything didn't
+    """
+    
+    try:
+        service = DocumentService(db)
+        await run_blocking(service.usage.check_quota, user_id, declared_file_size(request))
+        stream = MultipartFileStream(request.stream(), request.headers.get("content-type"))
+        results = await service.upload_documents_batch(user_id, stream.files())
+        if not results:
+            raise HTTPException(status_code=400, detail="No files provided")
+        
+        uploaded = sum(1 for result in results if result["status_code"] == 201)
+        if uploaded < len(results):
+            response.status_code = 207
+        
+        return {
+            "uploaded": uploaded,
+            "failed": len(results) - uploaded,
+            "results": results
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch upload failed: {str(e)}")
+
+class UploadSessionRequest(BaseModel):
+    """What a client tells us before sending the chunks"""
+    filename: str
+    content_type: str
+    total_size: int
+    chunk_size: Optional[int] = None
+
+@router.post("/uploads", status_code=201)
+async def create_upload_session(
+    body: UploadSessionRequest,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db)
+):
     """
+    Start a resumable upload for a big file
     
-    # Still using test user
-    test_user_id = 1
+    - Type and size are checked now, content once all the chunks are in
+    - Then PUT each chunk to /documents/uploads/{upload_id}/chunks/{index}
+    """
     
     try:
-        # Start with base query for this user
-        query = db.query(Document).filter(Document.user_id == test_user_id)
-        
-        # Add status filter if requested
-        if status:
-            query = query.filter(Document.status == status)
-        
-        documents = query.all()
-        
-        # Return clean list of document info
-        return [
-            {
-                "document_id": doc.id,
-                "filename": doc.filename,
-                "file_size": doc.file_size,
-                "mime_type": doc.mime_type,
-                "status": doc.status,
-                "uploaded_at": doc.uploaded_at,
-                "processed_at": doc.processed_at
-            }
-            for doc in documents
-        ]
+        service = ResumableUploadService(db)
+        session = await run_blocking(
+            service.create_session, user_id, body.filename, body.content_type, body.total_size, body.chunk_size
+        )
+        return await run_blocking(service.session_progress, user_id, session.id)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to list documents: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to start upload: {str(e)}")
 
-@router.get("/{document_id}")
-async def get_document(
-    document_id: int,
+@router.get("/uploads/{upload_id}")
+async def get_upload_session(
+    upload_id: str,
+    user_id: int = Depends(current_user_id),
     db: Session = Depends(get_db)
 ):
-    """Get details for a specific document"""
+    """Which chunks are stored and which are still missing - use it to resume"""
     
-    test_user_id = 1
+    try:
+        service = ResumableUploadService(db)
+        return await run_blocking(service.session_progress, user_id, upload_id)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get upload: {str(e)}")
+
+@router.put("/uploads/{upload_id}/chunks/{index}")
+async def upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    Store one chunk (raw bytes in the body)
+    
+    Chunks can come in any order and in parallel, and sending one again is harmless
+    """
     
     try:
-        # Look for document belonging to this user
-        document = db.query(Document).filter(
-            Document.id == document_id,
-            Document.user_id == test_user_id
-        ).first()
+        service = ResumableUploadService(db)
+        return await service.write_chunk(user_id, upload_id, index, request.stream())
         
-        if not document:
-            raise HTTPException(status_code=404, detail="Document not found")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Chunk upload failed: {str(e)}")
+
+@router.post("/uploads/{upload_id}/complete", status_code=201)
+async def complete_upload_session(
+    upload_id: str,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db)
+):
+    """All chunks sent - validate the file and turn it into a document"""
+    
+    try:
+        service = ResumableUploadService(db)
+        document = await run_blocking(service.complete_session, user_id, upload_id)
         
-        # Return all the document details
         return {
             "document_id": document.id,
             "filename": document.filename,
@@ -116,45 +258,236 @@ async def get_document(
             "mime_type": document.mime_type,
             "status": document.status,
             "uploaded_at": document.uploaded_at,
-            "processed_at": document.processed_at,
-            "file_path": document.file_path
+            "message": "Upload successful!"
         }
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload_session(
+    upload_id: str,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db)
+):
+    """Give up on an upload and throw away the chunks sent so far"""
+    
+    try:
+        service = ResumableUploadService(db)
+        await run_blocking(service.abort_session, user_id, upload_id)
+        return {"message": "Upload cancelled", "upload_id": upload_id}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to cancel upload: {str(e)}")
+
+@router.get("/", response_model=List[dict])
+async def list_documents(
+    response: Response,
+    status: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    Get a page of documents (newest first), optionally filter by status
+    
+    Can filter like: /documents?status=completed
+    If there are more, the X-Next-Cursor header holds the value to pass as ?cursor= for the next page
+    """
+    
+    try:
+        # Query runs on the I/O pool so a slow DB doesn't hold up the event loop (pages are cached)
+        service = DocumentService(db)
+        documents, next_cursor = await run_blocking(service.listing_page, user_id, status, limit, cursor)
+        
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        
+        return documents
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to list documents: {str(e)}")
+
+@router.get("/search")
+async def search_documents(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10_000),
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    Find documents by words in their name or extracted text
+    
+    Every word has to match. Best matches first, with a snippet showing the words
+    in context - pass next_offset back as ?offset= for the next page
+    """
+    
+    try:
+        return await run_blocking(search_index.search_documents, db, user_id, q, limit, offset)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+@router.get("/export")
+async def export_documents(
+    format: str = Query("zip", pattern="^(zip|tar)$"),
+    status: Optional[str] = None,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    Download all your documents as one ZIP or tar archive
+    
+    Can filter like: /documents/export?format=tar&status=completed
+    The archive is built while it's sent (chunked, nothing buffered or written to disk). Files are under
+    documents/ as "<id>_<name>", and manifest.json at the end describes each one (and any that were missing).
+    """
+    
+    try:
+        service = DocumentService(db)
+        load_page = functools.partial(service.export_page, user_id, status)
+        manifest_header = {
+            "user_id": user_id,
+            "status": status,
+            "exported_at": datetime.now(timezone.utc).isoformat()
+        }
+        return StreamingResponse(
+            export_archive(format, load_page, manifest_header),
+            media_type=EXPORT_FORMATS[format].media_type,
+            headers={"Content-Disposition": f'attachment; filename="{export_filename(format)}"'}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+
+@router.get("/{document_id}")
+async def get_document(
+    document_id: int,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db)
+):
+    """Get details for a specific document"""
+    
+    try:
+        # Look for document belonging to this user (404s if it isn't theirs) - cached
+        service = DocumentService(db)
+        return await run_blocking(service.document_details, user_id, document_id)
+        
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get document: {str(e)}")
 
-@router.delete("/{document_id}")
-async def delete_document(
+@router.get("/{document_id}/status")
+async def get_document_status(
     document_id: int,
+    wait: float = Query(0, ge=0, le=STATUS_LONG_POLL_MAX),
+    since: Optional[str] = None,
+    user_id: int = Depends(current_user_id),
     db: Session = Depends(get_db)
 ):
-    """Delete document and its file - cleans up properly"""
+    """
+    Where a document is in processing
     
-    test_user_id = 1
+    Long-poll: pass the status you last saw as ?since= and ?wait=<seconds>, and the
+    answer comes back as soon as it changes (or when the wait runs out)
+    """
     
     try:
-        # Find the document
-        document = db.query(Document).filter(
-            Document.id == document_id,
-            Document.user_id == test_user_id
-        ).first()
+        service = DocumentService(db)
+        load_status = functools.partial(service.document_status, user_id, document_id)
+        if since is None or wait == 0:
+            return await run_blocking(load_status)
+        return await wait_for_status_change(load_status, document_id, since, wait)
         
-        if not document:
-            raise HTTPException(status_code=404, detail="Document not found")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get document status: {str(e)}")
+
+@router.get("/{document_id}/events")
+async def document_events(
+    document_id: int,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    Server-Sent Events stream of status changes
+    
+    Sends the current status straight away, then an event for every change,
+    and closes once the document is completed or failed
+    """
+    
+    try:
+        service = DocumentService(db)
+        load_status = functools.partial(service.document_status, user_id, document_id)
+        # Read once up front so a missing document is a plain 404, not an empty stream
+        first = await run_blocking(load_status)
+        return StreamingResponse(
+            status_event_stream(load_status, document_id, first),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
         
-        # Remove actual file first
-        import os
-        if os.path.exists(document.file_path):
-            os.remove(document.file_path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to follow document: {str(e)}")
+
+@router.api_route("/{document_id}/content", methods=["GET", "HEAD"])
+async def download_document(
+    document_id: int,
+    request: Request,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db)
+):
+    """
+    Download the stored file
+    
+    - Range requests for partial reads (resuming, PDF viewers jumping to a page)
+    - ETag / If-None-Match and Last-Modified / If-Modified-Since - a cached copy gets a 304 without touching the disk
+    - The file is sent straight from disk, never loaded whole
+    - 409 for a 202 upload whose bytes haven't been checked and stored yet
+    """
+    
+    try:
+        service = DocumentService(db)
+        # Straight from the database, not the cache - the file's path changes when a 202 upload is ingested
+        document = await run_blocking(service.get_stored_document, user_id, document_id)
+        return await document_content_response(document, request.headers, request.method)
         
-        # Then remove database record
-        db.delete(document)
-        db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to download document: {str(e)}")
+
+@router.delete("/{document_id}")
+async def delete_document(
+    document_id: int,
+    user_id: int = Depends(current_user_id),
+    db: Session = Depends(get_db)
+):
+    """Delete document and its file - cleans up properly"""
+    
+    try:
+        # File removal and the DB commit both block, so they go to the I/O pool
+        service = DocumentService(db)
+        filename = await run_blocking(service.delete_document, user_id, document_id)
         
         return {
-            "message": f"Document {document.filename} deleted successfully",
+            "message": f"Document {filename} deleted successfully",
             "document_id": document_id
         }
         
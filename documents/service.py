@@ -1,15 +1,25 @@
+import asyncio
+import base64
+import json
 import os
-import shutil
-from pathlib import Path
-from datetime import datetime
-from typing import Optional
+from typing import AsyncIterator, List, Optional, Tuple
 from fastapi import UploadFile, HTTPException
+from sqlalchemy import String, and_, insert, or_, type_coerce
 from sqlalchemy.orm import Session
-from documents.models import Document
+from documents.models import Document, DocumentStatus, PendingUpload
+from documents.storage import StorageBackend, StreamingFileWriter, get_storage, lock_paths
+from documents.compression import choose_codec
+from documents.cleanup import wake_reaper
+from shared.cache import ReadThroughCache, get_cache
+from shared.utils import run_blocking, new_ulid
+from shared.metrics import span
+from shared.validators import SNIFF_SIZE, content_matches
+from processing.tasks import enqueue_document
+from search.index import get_search_index
+from users.service import UsageService
+from config import MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE, BATCH_MAX_FILES
 
-# File upload limits and allowed types
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB - for personal reasons
-UPLOAD_BASE_DIR = "./uploads"
+# File upload limits and allowed types (MAX_FILE_SIZE lives in config.py - 10MB for personal reasons)
 
 # Only allow document files - learnt this prevents loads of security problems
 ALLOWED_MIME_TYPES = {
@@ -21,30 +31,383 @@ ALLOWED_MIME_TYPES = {
     "text/csv": ".csv"
 }
 
+# Matches Document.filename's column length
+MAX_FILENAME_LENGTH = 100
+
+# Listing pages - default size and the hard cap on what a client can ask for
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# What a listing returns - selected as plain columns rather than whole Document objects
+LISTING_COLUMNS = (
+    Document.id,
+    Document.filename,
+    Document.file_size,
+    Document.mime_type,
+    Document.status,
+    Document.uploaded_at,
+    Document.processed_at,
+)
+
+def listing_entry(row) -> dict:
+    """What listings (and the start of a document's details) show for one document"""
+    return {
+        "document_id": row.id,
+        "filename": row.filename,
+        "file_size": row.file_size,
+        "mime_type": row.mime_type,
+        "status": row.status,
+        "uploaded_at": row.uploaded_at,
+        "processed_at": row.processed_at
+    }
+
+def file_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB"
+    )
+
 class DocumentService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, storage: Optional[StorageBackend] = None, cache: Optional[ReadThroughCache] = None):
         self.db = db
+        self.storage = storage or get_storage()
+        self.cache = cache or get_cache()
+        self.usage = UsageService(db)
     
     def upload_document(self, user_id: int, upload_file: UploadFile) -> Document:
         """Upload a document with your validation strategy"""
         
         # Check size first - quickest way to reject any massive files
-        file_size = self._validate_file_size(upload_file)
+        with span("upload.size_check"):
+            file_size = self._validate_file_size(upload_file)
+            self.usage.check_quota(user_id, file_size)
         
         # Make sure file type is allowed and not spoofed
-        self._validate_file_type(upload_file)
+        with span("upload.type_check"):
+            self._validate_file_type(upload_file)
+            self._validate_file_content(upload_file)
         
         # Create unique username to avoid any conflicts
         unique_filename = self._generate_unique_filename(upload_file.filename)
         
-        # Save to users own folder
-        file_path = self._save_file_to_storage(user_id, upload_file, unique_filename)
+        # Write it out to storage (not in place yet - that happens with the DB record)
+        with span("upload.disk_write"):
+            writer = self._save_file_to_storage(user_id, upload_file)
         
         # Create database record - (THIS TOOK ME AGES TO GET RIGHT)
-        document = self._create_document_record(user_id, upload_file, unique_filename, file_path, file_size)
+        document = self._create_document_record(user_id, upload_file.content_type, unique_filename, writer)
+        
+        return document
+    
+    async def upload_document_stream(
+        self,
+        user_id: int,
+        filename: str,
+        content_type: str,
+        chunks: AsyncIterator[bytes]
+    ) -> Document:
+        """
+        Single-pass upload straight off the request body
+
+        Type checks only need the filename and declared MIME type, so they run
+        before a single byte is read. The content is sniffed from the first
+        few KB before storage is touched. The size limit is enforced as chunks
+        arrive and the bytes land directly in storage, hashed on the way.
+        """
+        with span("upload.receive"):
+            writer = await self._receive_stream(user_id, filename, content_type, chunks)
+        with span("upload.fsync"):
+            await self._finish_writer(writer)
+        unique_filename = self._generate_unique_filename(filename)
+        return await run_blocking(self._create_document_record, user_id, content_type, unique_filename, writer)
+    
+    async def accept_document_stream(
+        self,
+        user_id: int,
+        filename: str,
+        content_type: str,
+        chunks: AsyncIterator[bytes]
+    ) -> Document:
+        """
+        Accept-fast upload (202): keep the raw bytes, check them later
+
+        Only the checks that need no content (type, extension, size) happen
+        here. The body goes to a temp file with no hashing and no fsync, the
+        row is committed as 'uploaded' and the request is done. The ingest
+        processing step then sniffs, hashes, syncs and places the file before
+        any other processing - a bad file shows up as a failed document.
+        """
+        self._check_file_type(content_type, filename)
+        writer = await run_blocking(self.storage.open_writer, user_id, max_size=MAX_FILE_SIZE, hashed=False)
+        with span("upload.receive"):
+            await self._write_chunks(writer, b"", chunks)
+        await run_blocking(writer.close)
+        unique_filename = self._generate_unique_filename(filename)
+        return await run_blocking(self._create_pending_record, user_id, content_type, unique_filename, writer)
+    
+    async def upload_documents_batch(self, user_id: int, parts: AsyncIterator) -> List[dict]:
+        """
+        Upload every file part of one request, returning a result per file in order
+
+        Each file is validated and streamed into storage as it arrives; one
+        that fails validation is skipped (and its bytes dropped) without
+        affecting the rest. The fsync of each file runs in the background
+        while the next one is read. All the rows then go in with one
+        multi-row insert and one commit.
+        """
+        results = []
+        received = []  # (result, content_type, writer, finishing task)
+        try:
+            async for part in parts:
+                result = {"original_filename": part.filename}
+                results.append(result)
+                if len(results) > BATCH_MAX_FILES:
+                    result.update(status_code=413, error=f"Too many files. A batch can hold at most {BATCH_MAX_FILES}")
+                    continue
+                try:
+                    writer = await self._receive_stream(user_id, part.filename, part.content_type, part.chunks())
+                except HTTPException as e:
+                    # Whatever's left of the part is skipped when the stream moves on
+                    result.update(status_code=e.status_code, error=e.detail)
+                    continue
+                finishing = asyncio.ensure_future(self._finish_writer(writer))
+                received.append((result, part.content_type, writer, finishing))
+        except BaseException:
+            # The body itself is broken (or the client went away) - nothing from this batch is kept
+            for _, _, writer, finishing in received:
+                await asyncio.gather(finishing, return_exceptions=True)
+                await run_blocking(writer.abort)
+            raise
+        
+        to_insert = []
+        for result, content_type, writer, finishing in received:
+            try:
+                await finishing
+            except HTTPException as e:
+                result.update(status_code=e.status_code, error=e.detail)
+                continue
+            to_insert.append((result, content_type, self._generate_unique_filename(result["original_filename"]), writer))
+        
+        if to_insert:
+            with span("upload.batch_commit"):
+                await run_blocking(self._create_document_records, user_id, to_insert)
+        return results
+    
+    async def _receive_stream(
+        self,
+        user_id: int,
+        filename: str,
+        content_type: str,
+        chunks: AsyncIterator[bytes]
+    ) -> StreamingFileWriter:
+        """Validate a streamed file and write it into a storage temp file (still needs finishing)"""
+        self._check_file_type(content_type, filename)
+        
+        # Hold back the first chunks until there's enough to sniff
+        chunks = chunks.__aiter__()
+        head = bytearray()
+        async for chunk in chunks:
+            head += chunk
+            if len(head) >= SNIFF_SIZE:
+                break
+        self._check_file_content(content_type, head)
+        
+        # Disk and DB work goes through the I/O pool - the event loop only shuffles chunks
+        codec = choose_codec(content_type, head)
+        writer = await run_blocking(self.storage.open_writer, user_id, max_size=MAX_FILE_SIZE, codec=codec)
+        return await self._write_chunks(writer, bytes(head), chunks)
+    
+    async def _write_chunks(self, writer: StreamingFileWriter, head: bytes, chunks: AsyncIterator[bytes]) -> StreamingFileWriter:
+        """Write head and then the rest of the stream, throwing the temp file away if anything goes wrong"""
+        # One write in flight at a time, so the next chunk is read off the socket while the last hits the disk
+        pending = asyncio.ensure_future(run_blocking(writer.write, head)) if head else None
+        try:
+            async for chunk in chunks:
+                if pending is not None:
+                    await pending
+                pending = asyncio.ensure_future(run_blocking(writer.write, chunk))
+            if pending is not None:
+                await pending
+            return writer
+        except BaseException as e:
+            if pending is not None:
+                # The write can't be cancelled once it's on a thread - let it finish before throwing the file away
+                await asyncio.gather(pending, return_exceptions=True)
+            await run_blocking(writer.abort)
+            if isinstance(e, Exception) and not isinstance(e, HTTPException):
+                raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
+            raise
+    
+    async def _finish_writer(self, writer: StreamingFileWriter):
+        try:
+            await run_blocking(writer.finish)
+        except Exception as e:
+            await run_blocking(writer.abort)
+            raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
+    
+    def list_documents_page(
+        self,
+        user_id: int,
+        status: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None
+    ) -> Tuple[list, Optional[str]]:
+        """
+        One page of a user's documents, newest first
+
+        Keyset pagination on (uploaded_at, id): each page starts where the
+        cursor left off, so page 1000 costs the same as page 1 and nothing
+        beyond `limit` rows is ever read. Only the listed columns are
+        selected, no ORM objects are built.
+        """
+        # The raw stored timestamp goes in the cursor - comparing against a re-formatted
+        # datetime can miss rows on SQLite, where timestamps are compared as text
+        raw_uploaded_at = type_coerce(Document.uploaded_at, String)
+        query = self.db.query(*LISTING_COLUMNS, raw_uploaded_at.label("cursor_uploaded_at")).filter(
+            Document.user_id == user_id
+        )
+        
+        # Add status filter if requested
+        if status:
+            query = query.filter(Document.status == status)
         
+        if cursor:
+            last_uploaded_at, last_id = self._decode_cursor(cursor)
+            query = query.filter(or_(
+                raw_uploaded_at < last_uploaded_at,
+                and_(raw_uploaded_at == last_uploaded_at, Document.id < last_id)
+            ))
+        
+        # Fetch one extra row to find out whether there's another page
+        rows = query.order_by(Document.uploaded_at.desc(), Document.id.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(rows[-1].cursor_uploaded_at, rows[-1].id)
+        
+        return rows, next_cursor
+    
+    def export_page(
+        self,
+        user_id: int,
+        status: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = MAX_PAGE_SIZE
+    ) -> Tuple[list, Optional[str]]:
+        """
+        A page of documents to export, with where their bytes are
+
+        Walks the same keyset as the listing, leaves out 202 uploads whose bytes
+        haven't been checked yet, and ends the read transaction so a long export
+        doesn't keep a connection checked out between pages.
+        """
+        rows, next_cursor = self.list_documents_page(user_id, status, limit, cursor)
+        files = {}
+        if rows:
+            files = {row.id: row for row in self.db.query(
+                Document.id, Document.file_path, Document.content_hash, Document.codec
+            ).outerjoin(
+                PendingUpload, PendingUpload.document_id == Document.id
+            ).filter(Document.id.in_([row.id for row in rows]), PendingUpload.document_id.is_(None))}
+        self.db.rollback()
+        return [(row, files[row.id]) for row in rows if row.id in files], next_cursor
+
+    def _encode_cursor(self, uploaded_at, document_id: int) -> str:
+        raw = json.dumps([str(uploaded_at), document_id]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+    
+    def _decode_cursor(self, cursor: str) -> Tuple[str, int]:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            uploaded_at, document_id = json.loads(raw)
+            return str(uploaded_at), int(document_id)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    def listing_page(
+        self,
+        user_id: int,
+        status: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """A listing page as the API returns it - from the cache when nothing has changed since"""
+        def load():
+            rows, next_cursor = self.list_documents_page(user_id, status, limit, cursor)
+            return [listing_entry(row) for row in rows], next_cursor
+        
+        documents, next_cursor = self.cache.get_or_load(
+            "listing", user_id, f"{status or ''}:{limit}:{cursor or ''}", load
+        )
+        return documents, next_cursor
+    
+    def document_details(self, user_id: int, document_id: int) -> dict:
+        """One document's details as the API returns them (cached) - 404s aren't cached"""
+        def load():
+            document = self.get_document(user_id, document_id)
+            return {
+                **listing_entry(document),
+                "processing_error": document.processing_error,
+                "file_path": document.file_path
+            }
+        
+        return self.cache.get_or_load("document", user_id, str(document_id), load)
+    
+    def get_document(self, user_id: int, document_id: int) -> Document:
+        """Fetch one of the user's documents or 404"""
+        document = self.db.query(Document).filter(
+            Document.id == document_id,
+            Document.user_id == user_id
+        ).first()
+        
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+        
+        return document
+    
+    def get_stored_document(self, user_id: int, document_id: int) -> Document:
+        """get_document for serving the file - 409 while a 202 upload's bytes are still unchecked"""
+        document = self.get_document(user_id, document_id)
+        pending = self.db.query(PendingUpload.document_id).filter(PendingUpload.document_id == document_id).first()
+        if pending is not None:
+            raise HTTPException(status_code=409, detail="Document is still being checked and stored - try again once it's processed")
         return document
     
+    def document_status(self, user_id: int, document_id: int) -> dict:
+        """Just the lifecycle fields - what status polling and events send"""
+        row = self.db.query(
+            Document.id, Document.status, Document.processing_error, Document.processed_at
+        ).filter(Document.id == document_id, Document.user_id == user_id).first()
+        # End the read transaction - long-polls and event streams call this over and over
+        # and shouldn't keep a pooled connection checked out in between
+        self.db.rollback()
+        if not row:
+            raise HTTPException(status_code=404, detail="Document not found")
+        return {
+            "document_id": row.id,
+            "status": row.status,
+            "processing_error": row.processing_error,
+            "processed_at": row.processed_at
+        }
+    
+    def delete_document(self, user_id: int, document_id: int) -> str:
+        """Delete document and its file, returns the deleted filename"""
+        document = self.get_document(user_id, document_id)
+        filename = document.filename
+        
+        # Remove the row first, then let storage drop the file if this was its last reference
+        get_search_index(self.db).remove(self.db, document.id)
+        self.db.delete(document)
+        self.db.flush()
+        self.usage.record_delete(user_id, document.status, document.file_size)
+        # The file is only tombstoned - the reaper unlinks it once this has committed
+        self.storage.release(self.db, document.file_path)
+        self.db.commit()
+        self.cache.invalidate_user(user_id)
+        wake_reaper()
+        
+        return filename
+    
     def _validate_file_size(self, upload_file: UploadFile):
         """Check file size before doing anything else - learned that this stops wasting processing time"""
         # Get file size by seeking to end and checking position
@@ -53,25 +416,26 @@ class DocumentService:
         upload_file.file.seek(0) # Reset position
         
         if file_size > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=413,
-                detail=f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB"
-            )
+            raise file_too_large()
         
         return file_size
     
     def _validate_file_type(self, upload_file: UploadFile):
         """Validate both MIME type and file extension"""
+        self._check_file_type(upload_file.content_type, upload_file.filename)
+    
+    def _check_file_type(self, content_type: str, filename: str):
+        """MIME type must be allowed and match the extension"""
         # First check if MIME type is allowed
-        if upload_file.content_type not in ALLOWED_MIME_TYPES:
+        if content_type not in ALLOWED_MIME_TYPES:
             allowed_types = ", ".join(ALLOWED_MIME_TYPES.values())
             raise HTTPException(
                 status_code=400,
                 detail=f"File type not supported. Allowed types: {allowed_types}"
             )
         # Then check extension matches MIME TYPE (security bit)
-        expected_extension = ALLOWED_MIME_TYPES[upload_file.content_type]
-        actual_extension = os.path.splitext(upload_file.filename)[1].lower()
+        expected_extension = ALLOWED_MIME_TYPES[content_type]
+        actual_extension = os.path.splitext(filename or "")[1].lower()
         
         if actual_extension != expected_extension:
             raise HTTPException(
@@ -79,6 +443,20 @@ class DocumentService:
                 detail=f"File extension '{actual_extension}' doesn't match file type. Expected '{expected_extension}'"
             )
     
+    def _validate_file_content(self, upload_file: UploadFile):
+        """Sniff the start of the file - peeks, then rewinds"""
+        head = upload_file.file.read(SNIFF_SIZE)
+        upload_file.file.seek(0)
+        self._check_file_content(upload_file.content_type, head)
+    
+    def _check_file_content(self, content_type: str, head: bytes):
+        """The bytes must actually be what the MIME type says - a renamed .exe is still an .exe"""
+        if not content_matches(content_type, head):
+            raise HTTPException(
+                status_code=400,
+                detail=f"File content doesn't match file type '{ALLOWED_MIME_TYPES[content_type]}'"
+            )
+    
     def _sanitize_filename(self, filename: str) -> str:
         """Clean filename of dangerous characters"""
         import re
@@ -94,61 +472,180 @@ class DocumentService:
         return safe_filename
     
     def _generate_unique_filename(self, original_filename: str) -> str:
-        """Generate unique filename with timestamp"""
+        """Generate unique filename with a time-ordered ID in front"""
         safe_filename = self._sanitize_filename(original_filename)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # ULID prefix - unique across processes without asking the DB, and sorts by upload time
+        unique_id = new_ulid()
         name, ext = os.path.splitext(safe_filename)
-        unique_filename = f"{name}_{timestamp}{ext}"
+        # Document.filename is 100 chars, so trim the name to leave room for the ID
+        name = name[:MAX_FILENAME_LENGTH - len(unique_id) - 1 - len(ext)]
+        unique_filename = f"{unique_id}_{name}{ext}"
         return unique_filename
     
-    def _save_file_to_storage(self, user_id: int, upload_file: UploadFile, unique_filename: str) -> str:
-        """Save file to user directory"""
-        # Create user directory if it does not exist
-        user_dir = Path(UPLOAD_BASE_DIR) / f"user_{user_id}"
-        user_dir.mkdir(parents=True, exist_ok=True)
-        file_path = user_dir / unique_filename
+    def _save_file_to_storage(self, user_id: int, upload_file: UploadFile) -> StreamingFileWriter:
+        """Copy the upload into a storage temp file, hashing (and maybe compressing) as it goes"""
+        chunk = upload_file.file.read(UPLOAD_CHUNK_SIZE)
+        writer = self.storage.open_writer(user_id, codec=choose_codec(upload_file.content_type, chunk))
         
-        # Automatically save the file
+        # Copy into a temp file first, so a failed copy never leaves a partial file behind
         try:
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(upload_file.file, buffer)
+            while chunk:
+                writer.write(chunk)
+                chunk = upload_file.file.read(UPLOAD_CHUNK_SIZE)
+            writer.finish()
+            return writer
         except Exception as e:
+            writer.abort()
             raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
+    
+    def _create_document_records(self, user_id: int, items: list):
+        """
+        Batch version of _create_document_record - one insert, one commit
+
+        items are (result, mime_type, unique_filename, writer); each result
+        dict is filled in with the new document or the error that stopped it.
+        A file that can't be moved into place loses its row but doesn't sink
+        the batch; a failed commit fails every item in it.
+        """
+        rows = []
+        final_paths = []
+        for result, mime_type, unique_filename, writer in items:
+            final_paths.append(self.storage.final_path(writer, user_id, unique_filename))
+            rows.append({
+                "user_id": user_id,
+                "filename": unique_filename,
+                "file_path": str(final_paths[-1]),
+                "file_size": writer.size,
+                "mime_type": mime_type,
+                "content_hash": writer.digest,
+                "codec": writer.codec,
+                "status": DocumentStatus.UPLOADED,
+            })
+        
+        placed = []
+        created = []
+        try:
+            self.db.execute(insert(Document), rows)
+            # Filenames are ULID-prefixed, so they're enough to find the new ids again
+            inserted = {
+                row.filename: row
+                for row in self.db.query(Document.id, Document.filename, Document.uploaded_at).filter(
+                    Document.user_id == user_id,
+                    Document.filename.in_([row["filename"] for row in rows])
+                )
+            }
+            # All at once, in order - placing one by one could deadlock against another batch or the reaper
+            lock_paths(self.db, final_paths)
+            
+            for (result, mime_type, unique_filename, writer), row, final_path in zip(items, rows, final_paths):
+                document = inserted[unique_filename]
+                try:
+                    self.storage.place(self.db, writer, final_path)
+                except Exception as e:
+                    writer.abort()
+                    self.db.query(Document).filter(Document.id == document.id).delete(synchronize_session=False)
+                    result.update(status_code=500, error=f"Failed to save file: {str(e)}")
+                    continue
+                placed.append((row, writer))
+                created.append((result, row, document))
+            
+            if created:
+                self.usage.record_upload(user_id, len(created), sum(row["file_size"] for _, row, _ in created))
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            for _, _, _, writer in items:
+                writer.abort()
+            for row, writer in placed:
+                self.storage.discard(self.db, row["file_path"])
+            for result, _, _, _ in items:
+                if isinstance(e, HTTPException):
+                    result.update(status_code=e.status_code, error=e.detail)
+                else:
+                    result.update(status_code=500, error=f"Failed to create document record: {str(e)}")
+            return
         
-        return str(file_path)
+        if created:
+            self.cache.invalidate_user(user_id)
+        for result, row, document in created:
+            # Same fields the single upload returns
+            result.update(
+                status_code=201,
+                document_id=document.id,
+                filename=row["filename"],
+                file_size=row["file_size"],
+                mime_type=row["mime_type"],
+                status=row["status"],
+                uploaded_at=document.uploaded_at,
+            )
+            enqueue_document(document.id)
     
-    def _create_document_record(self, user_id: int, upload_file: UploadFile, unique_filename: str, file_path: str, file_size: int) -> Document:
-        """Create database record"""
+    def _create_pending_record(self, user_id: int, mime_type: str, unique_filename: str, writer: StreamingFileWriter) -> Document:
+        """Row for an accepted upload - points at the temp file until ingest places it"""
         document = Document(
             user_id=user_id,
             filename=unique_filename,
-            file_path=file_path,
-            file_size=file_size,
-            mime_type=upload_file.content_type,
-            status="uploaded"
+            file_path=writer.temp_path,
+            file_size=writer.size,
+            mime_type=mime_type,
+            status=DocumentStatus.UPLOADED
+        )
+        try:
+            with span("upload.db_commit"):
+                self.db.add(document)
+                self.db.flush()
+                self.usage.record_upload(user_id, 1, writer.size)
+                self.db.add(PendingUpload(document_id=document.id))
+                self.db.commit()
+                self.db.refresh(document)
+        except Exception as e:
+            self.db.rollback()
+            writer.abort()
+            if isinstance(e, HTTPException):
+                raise
+            raise HTTPException(status_code=500, detail=f"Failed to create document record: {str(e)}")
+        
+        self.cache.invalidate_user(user_id)
+        enqueue_document(document.id)
+        return document
+    
+    def _create_document_record(self, user_id: int, mime_type: str, unique_filename: str, writer: StreamingFileWriter) -> Document:
+        """Create database record and move the file into place in the same transaction"""
+        file_path = self.storage.final_path(writer, user_id, unique_filename)
+        document = Document(
+            user_id=user_id,
+            filename=unique_filename,
+            file_path=str(file_path),
+            file_size=writer.size,
+            mime_type=mime_type,
+            content_hash=writer.digest,
+            codec=writer.codec,
+            status=DocumentStatus.UPLOADED
         )
         
         # Save to database with error handling
+        placed = False
         try:
-            self.db.add(document)
-            self.db.commit()
-            self.db.refresh(document)
-            return document
+            with span("upload.db_commit"):
+                self.db.add(document)
+                self.db.flush()
+                # Over quota fails here, before the file is put in place
+                self.usage.record_upload(user_id, 1, writer.size)
+                self.storage.place(self.db, writer, file_path)
+                placed = True
+                self.db.commit()
+                self.db.refresh(document)
         except Exception as e:
-            # Clean up file if database fails
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            # Clean up file if database fails (storage keeps it if another document shares it)
+            self.db.rollback()
+            writer.abort()
+            if placed:
+                self.storage.discard(self.db, str(file_path))
+            if isinstance(e, HTTPException):
+                raise
             raise HTTPException(status_code=500, detail=f"Failed to create document record: {str(e)}")
-
-
-
-
-
-
-
-
-
-
-
-
-
+        
+        # Row is committed, so workers can see it now
+        self.cache.invalidate_user(user_id)
+        enqueue_document(document.id)
+        return document
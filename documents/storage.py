@@ -0,0 +1,300 @@
+import functools
+import hashlib
+import logging
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterable, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from documents.models import DeletedFile
+from documents.compression import FILE_SUFFIXES, FrameWriter, choose_codec
+from config import UPLOAD_DIR, STORAGE_BACKEND
+
+logger = logging.getLogger(__name__)
+
+
+def _file_too_large(max_size: int):
+    # Imported here - processing workers and the cleanup CLI use storage too, and never need FastAPI
+    from fastapi import HTTPException
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum size is {max_size // (1024*1024)}MB"
+    )
+
+
+def lock_paths(db: Session, paths: Iterable):
+    """
+    Hold a lock on each stored file's path until db's transaction ends
+
+    Only needed on PostgreSQL: under READ COMMITTED an upload's uncommitted
+    row pointing at a CAS blob is invisible to the reaper, so both take the
+    blob path's advisory lock before looking at the file. SQLite has one
+    write lock for the whole database, which the upload (by flushing its row)
+    and the reaper (by deleting tombstones) already hold at that point.
+    Locked in sorted order so two batches can't deadlock.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    for path in sorted({os.path.abspath(str(path)) for path in paths}):
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:path))"), {"path": path})
+
+
+class StreamingFileWriter:
+    """
+    Write an upload straight into its final directory as the bytes arrive
+
+    Data goes into a hidden temp file next to the destination and is only
+    renamed into place on commit, so a half-received upload never shows up
+    under its real name and there's no second copy step. The SHA-256 of the
+    content is worked out on the way through (unless hashed=False - accept-fast
+    uploads leave that to the background, which re-reads the file anyway).
+    """
+
+    def __init__(self, directory: Path, max_size: Optional[int] = None, hashed: bool = True, codec: Optional[str] = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.size = 0
+        self.codec = codec
+        self._hash = hashlib.sha256() if hashed else None
+        fd, self.temp_path = tempfile.mkstemp(dir=self.directory, prefix=".upload-", suffix=".part")
+        os.fchmod(fd, 0o644)  # mkstemp is owner-only, keep the permissions plain open() used to give
+        self._file = os.fdopen(fd, "wb")
+        # size and the hash are always of the original bytes, whatever ends up on disk
+        self._frames = FrameWriter(self._file, codec) if codec else None
+
+    @classmethod
+    def adopt(cls, temp_path: str, max_size: Optional[int] = None, mime_type: Optional[str] = None) -> "StreamingFileWriter":
+        """
+        Take over a temp file that was filled some other way (resumable and 202 uploads)
+
+        The file is hashed in one streaming pass - never held in memory - and
+        can then be placed like any other upload. If it's worth compressing
+        (going by mime_type and its first block), the same pass writes a
+        compressed copy next to it, which takes the raw file's place.
+        """
+        writer = cls.__new__(cls)
+        writer.temp_path = temp_path
+        writer.directory = Path(temp_path).parent
+        writer.max_size = max_size
+        writer.size = 0
+        writer.codec = None
+        writer._frames = None
+        writer._hash = hashlib.sha256()
+        writer._file = source = open(temp_path, "r+b")
+        try:
+            while True:
+                block = source.read(1024 * 1024)
+                if not block:
+                    break
+                if writer.size == 0 and mime_type:
+                    writer._start_compressed_copy(choose_codec(mime_type, block))
+                writer.size += len(block)
+                writer._hash.update(block)
+                if writer._frames is not None:
+                    writer._frames.write(block)
+        except Exception:
+            source.close()
+            if writer._file is not source:
+                writer.abort()  # Just the copy - the raw file is left as it was
+            raise
+        if writer._file is not source:
+            # The compressed copy has it all now
+            source.close()
+            os.remove(temp_path)
+        if max_size is not None and writer.size > max_size:
+            writer.abort()
+            raise _file_too_large(max_size)
+        return writer
+
+    def _start_compressed_copy(self, codec: Optional[str]):
+        if codec is None:
+            return
+        fd, self.temp_path = tempfile.mkstemp(dir=self.directory, prefix=".upload-", suffix=".part")
+        os.fchmod(fd, 0o644)
+        self._file = os.fdopen(fd, "wb")
+        self._frames = FrameWriter(self._file, codec)
+        self.codec = codec
+
+    @property
+    def digest(self) -> str:
+        return self._hash.hexdigest()
+
+    def write(self, chunk: bytes):
+        """Append a chunk, bailing out as soon as the size limit is crossed"""
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            self.abort()
+            raise _file_too_large(self.max_size)
+        if self._hash is not None:
+            self._hash.update(chunk)
+        if self._frames is not None:
+            self._frames.write(chunk)
+        else:
+            self._file.write(chunk)
+
+    def close(self):
+        """Hand the data to the OS without waiting for the disk (whoever adopts the file syncs it)"""
+        if not self._file.closed:
+            if self._frames is not None:
+                self._frames.close()
+            self._file.close()
+
+    def finish(self):
+        """Make sure everything written so far is on disk"""
+        if not self._file.closed:
+            if self._frames is not None:
+                self._frames.close()
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def commit(self, final_path: Path) -> str:
+        """Flush and atomically move the temp file to its final name"""
+        self.finish()
+        os.replace(self.temp_path, final_path)
+        return str(final_path)
+
+    def abort(self):
+        """Throw away whatever was written so far - safe to call more than once"""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class StorageBackend(ABC):
+    """
+    Where uploaded bytes live on disk
+
+    The service drives every backend the same way: stream into
+    open_writer(), insert the Document row with final_path(), call place()
+    while that row is flushed but not committed, and call release() after a
+    row is deleted (again before the commit). A placed file that may already
+    be shared (a CAS blob) is placed under lock_paths(), which the reaper
+    takes too, so a duplicate upload and the unlink of the same blob can't
+    interleave.
+    """
+
+    @abstractmethod
+    def open_writer(self, user_id: int, max_size: Optional[int] = None, hashed: bool = True,
+                    codec: Optional[str] = None) -> StreamingFileWriter:
+        """Start a new upload (compressed with codec, if given)"""
+
+    @abstractmethod
+    def final_path(self, writer: StreamingFileWriter, user_id: int, filename: str) -> Path:
+        """Where a finished upload will end up"""
+
+    @abstractmethod
+    def place(self, db: Session, writer: StreamingFileWriter, final_path: Path):
+        """Move a finished upload into its final location, inside db's open transaction"""
+
+    def release(self, db: Session, file_path: str):
+        """
+        A document pointing at file_path has gone - tombstone the file
+
+        Nothing is unlinked here: the reaper (documents.cleanup) does that after
+        the commit, once it has checked no other document still needs the file.
+        """
+        db.add(DeletedFile(file_path=str(file_path)))
+
+    def discard(self, db: Session, file_path: str):
+        """release() for a placed file whose row never got committed - tombstoned in its own transaction"""
+        try:
+            self.release(db, file_path)
+            db.commit()
+        except Exception:
+            # The database is what went wrong - the garbage collector will find the file instead
+            db.rollback()
+            logger.exception("Couldn't tombstone %s", file_path)
+
+    def unlink(self, file_path: str) -> int:
+        """Remove a stored file, returns the bytes it took up (0 if it was already gone)"""
+        try:
+            size = os.stat(file_path).st_size
+            os.remove(file_path)
+        except FileNotFoundError:
+            return 0
+        return size
+
+
+class LocalFileStorage(StorageBackend):
+    """The original layout - one file per upload under uploads/user_<id>/"""
+
+    def __init__(self, base_dir: str):
+        self.base_dir = Path(base_dir)
+
+    def user_dir(self, user_id: int) -> Path:
+        return self.base_dir / f"user_{user_id}"
+
+    def open_writer(self, user_id: int, max_size: Optional[int] = None, hashed: bool = True,
+                    codec: Optional[str] = None) -> StreamingFileWriter:
+        # Writer creates the user directory if it does not exist
+        return StreamingFileWriter(self.user_dir(user_id), max_size=max_size, hashed=hashed, codec=codec)
+
+    def final_path(self, writer: StreamingFileWriter, user_id: int, filename: str) -> Path:
+        return self.user_dir(user_id) / filename
+
+    def place(self, db: Session, writer: StreamingFileWriter, final_path: Path):
+        # Names are unique per upload, so nothing else can be using this path - no lock needed.
+        # Claim the name with O_EXCL first so we can never replace someone else's file
+        fd = os.open(final_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        os.close(fd)
+        try:
+            writer.commit(final_path)
+        except Exception:
+            os.remove(final_path)
+            raise
+
+
+class ContentAddressedStorage(StorageBackend):
+    """
+    Store each distinct file once, named by its SHA-256
+
+    Blobs live under blobs/<2 hex>/<2 hex>/<hash> so no directory gets huge
+    (<hash>.zst or <hash>.zz when compressed). There's no separate blob
+    table - the reference count is just the number of Document rows pointing
+    at the blob, which the reaper checks before it unlinks one.
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir = Path(base_dir)
+        self.blob_dir = self.base_dir / "blobs"
+
+    def open_writer(self, user_id: int, max_size: Optional[int] = None, hashed: bool = True,
+                    codec: Optional[str] = None) -> StreamingFileWriter:
+        # Same filesystem as the blobs so place() is a rename, not a copy
+        return StreamingFileWriter(self.blob_dir / "incoming", max_size=max_size, hashed=hashed, codec=codec)
+
+    def blob_path(self, content_hash: str, codec: Optional[str] = None) -> Path:
+        # Compressed blobs get their own name, so a duplicate only ever lands on a blob stored the same way
+        name = content_hash + FILE_SUFFIXES[codec] if codec else content_hash
+        return self.blob_dir / content_hash[:2] / content_hash[2:4] / name
+
+    def final_path(self, writer: StreamingFileWriter, user_id: int, filename: str) -> Path:
+        return self.blob_path(writer.digest, writer.codec)
+
+    def place(self, db: Session, writer: StreamingFileWriter, final_path: Path):
+        # Until commit - the reaper can't unlink the blob between this check and our row becoming visible
+        lock_paths(db, [final_path])
+        if final_path.exists():
+            # Already have these bytes - the duplicate upload costs nothing on disk
+            writer.abort()
+            return
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+        writer.commit(final_path)
+
+
+STORAGE_BACKENDS = {
+    "local": LocalFileStorage,
+    "cas": ContentAddressedStorage,
+}
+
+@functools.lru_cache(maxsize=None)
+def get_storage(backend: str = STORAGE_BACKEND, base_dir: str = UPLOAD_DIR) -> StorageBackend:
+    """The configured storage backend (one instance per process)"""
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend '{backend}'. Options: {', '.join(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[backend](base_dir)
@@ -0,0 +1,163 @@
+from typing import AsyncIterator, Optional, Tuple
+from fastapi import HTTPException
+from multipart.multipart import parse_options_header
+
+# Part headers are tiny - anything bigger than this is junk or an attack
+MAX_PART_HEADER_SIZE = 16 * 1024
+
+
+class StreamedPart:
+    """One part of a multipart body whose data is read lazily off the request"""
+
+    def __init__(self, stream: "MultipartFileStream", headers: dict):
+        self._stream = stream
+        self._done = False
+        self.content_type = headers.get(b"content-type", b"").decode("latin-1")
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        self.name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        self.filename = filename.decode("utf-8", "replace") if filename is not None else None
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yield the part's bytes as they come off the socket"""
+        while not self._done:
+            chunk, self._done = await self._stream._read_part_data()
+            if chunk:
+                yield chunk
+
+    async def drain(self):
+        """Skip whatever is left of this part"""
+        async for _ in self.chunks():
+            pass
+
+
+class MultipartFileStream:
+    """
+    Incremental multipart/form-data reader on top of the request stream
+
+    Starlette's form parser spools every file into a SpooledTemporaryFile
+    before the route even runs, and python-multipart walks the data a byte
+    at a time in Python. This one hands out each part as it arrives and only
+    uses bytes.find to look for the boundary, so the caller can stop reading
+    the moment something is wrong and big files cost next to nothing to parse.
+    """
+
+    def __init__(self, body: AsyncIterator[bytes], content_type_header: str):
+        content_type, options = parse_options_header(content_type_header or "")
+        boundary = options.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+        self._body = body.__aiter__()
+        self._buffer = b""
+        self._eof = False
+        self._finished = False
+        self._first_boundary = b"--" + boundary
+        # Inside a part the boundary is always preceded by CRLF
+        self._delimiter = b"\r\n--" + boundary
+        self._started = False
+        self._current: Optional[StreamedPart] = None
+
+    async def _fill(self) -> bool:
+        """Pull the next chunk off the request, returns False once the body is done"""
+        if self._eof:
+            return False
+        try:
+            chunk = await self._body.__anext__()
+        except StopAsyncIteration:
+            self._eof = True
+            return False
+        self._buffer += chunk
+        return True
+
+    def _malformed(self, reason: str) -> HTTPException:
+        return HTTPException(status_code=400, detail=f"Malformed multipart body: {reason}")
+
+    async def _read_part_data(self) -> Tuple[bytes, bool]:
+        """Next slice of the current part's data, plus whether the part has ended"""
+        while True:
+            index = self._buffer.find(self._delimiter)
+            if index != -1:
+                data = self._buffer[:index]
+                self._buffer = self._buffer[index + len(self._delimiter):]
+                await self._after_boundary()
+                return data, True
+
+            # Everything except a possible partial delimiter at the end is safe to hand out
+            safe = len(self._buffer) - len(self._delimiter) + 1
+            if safe > 0:
+                data = self._buffer[:safe]
+                self._buffer = self._buffer[safe:]
+                return data, False
+            if not await self._fill():
+                raise self._malformed("body ended inside a part")
+
+    async def _after_boundary(self):
+        """Work out whether a boundary was the closing one"""
+        while len(self._buffer) < 2:
+            if not await self._fill():
+                raise self._malformed("body ended after a boundary")
+        if self._buffer[:2] == b"--":
+            self._finished = True
+            self._buffer = b""
+        elif self._buffer[:2] == b"\r\n":
+            self._buffer = self._buffer[2:]
+        else:
+            raise self._malformed("bad boundary line")
+
+    async def _read_headers(self) -> dict:
+        while True:
+            index = self._buffer.find(b"\r\n\r\n")
+            if index != -1:
+                break
+            if len(self._buffer) > MAX_PART_HEADER_SIZE:
+                raise self._malformed("part headers too large")
+            if not await self._fill():
+                raise self._malformed("body ended inside part headers")
+
+        raw_headers = self._buffer[:index]
+        self._buffer = self._buffer[index + 4:]
+        headers = {}
+        for line in raw_headers.split(b"\r\n"):
+            name, sep, value = line.partition(b":")
+            if not sep:
+                raise self._malformed("bad part header")
+            headers[name.strip().lower()] = value.strip()
+        return headers
+
+    async def _skip_preamble(self):
+        while True:
+            index = self._buffer.find(self._first_boundary)
+            if index != -1:
+                self._buffer = self._buffer[index + len(self._first_boundary):]
+                await self._after_boundary()
+                return
+            # Keep just enough of the buffer to spot a boundary split across chunks
+            self._buffer = self._buffer[-len(self._first_boundary):]
+            if not await self._fill():
+                raise self._malformed("no boundary found")
+
+    async def next_file(self) -> Optional[StreamedPart]:
+        """Move on to the next part that carries a file, skipping plain form fields"""
+        if not self._started:
+            self._started = True
+            await self._skip_preamble()
+        elif self._current is not None:
+            await self._current.drain()
+
+        while not self._finished:
+            part = StreamedPart(self, await self._read_headers())
+            self._current = part
+            if part.filename is None:
+                await part.drain()
+                continue
+            return part
+        return None
+
+    async def files(self) -> AsyncIterator[StreamedPart]:
+        """Every file part in turn - each is drained before moving on, whether or not it was read"""
+        while True:
+            part = await self.next_file()
+            if part is None:
+                return
+            yield part
@@ -1,19 +1,45 @@
+import asyncio
+import os
+import time
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
-from shared.database import init_database
+from shared.database import engine, init_database
+from shared.health import is_draining, readiness
+from shared.utils import shutdown_blocking_executor
+from shared.metrics import REGISTRY, MetricsMiddleware
+from shared.cache import get_cache
 from documents.routes import router as documents_router
+from users.routes import router as users_router
+from auth.routes import router as auth_router
+from processing.tasks import start_in_process_workers
+from processing.extractor import shutdown_extraction_pool
+from documents.cleanup import start_reaper
+from config import PROCESSING_WORKERS_IN_PROCESS, DB_CREATE_SCHEMA, UPLOAD_DIR
+import auth.models  # noqa: F401 - documents.user_id points at users, so the table must be registered before create_all
 
 # Modern FastAPI lifespan handler
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    init_database()
+    # Startup - serve.py creates the schema once before forking, so its workers skip this
+    if app.state.create_schema:
+        init_database()
+    workers = start_in_process_workers(PROCESSING_WORKERS_IN_PROCESS)
+    reaper = start_reaper()  # Unlinks the files of deleted documents
     print("🚀 DocFlow API is ready!")
     print("📚 Your upload validation is active!")
     print("🔗 API docs at: http://localhost:8000/docs")
+    app.state.startup_ms = round((time.perf_counter() - app.state.started_at) * 1000, 1)
     yield
-    # Shutdown (if needed)
+    # Shutdown - stop picking up new documents and let any queued file/DB work finish
+    for worker in workers:
+        worker.stop()
+    reaper.stop()
+    # Both wait for running work - off the event loop, so in-flight requests can still finish
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, shutdown_extraction_pool)
+    await loop.run_in_executor(None, shutdown_blocking_executor)
 
 # Create FastAPI app with modern lifespan
 app = FastAPI(
@@ -22,6 +48,9 @@ app = FastAPI(
     version="1.0.0",
     lifespan=lifespan
 )
+app.state.create_schema = DB_CREATE_SCHEMA
+app.state.started_at = time.perf_counter()  # serve.py resets this in each worker it forks
+app.state.startup_ms = None
 
 # Add CORS middleware
 app.add_middleware(
@@ -30,6 +59,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Id"],
+)
+
+# Request timing, query counts and Server-Timing headers (outermost, so it times everything)
+app.add_middleware(MetricsMiddleware)
+
+# Accounts and tokens
+app.include_router(
+    auth_router,
+    prefix="/auth",
+    tags=["Auth"]
 )
 
 # Include document routes
@@ -39,6 +79,13 @@ app.include_router(
     tags=["Documents"]
 )
 
+# The signed-in user's own endpoints (usage and quota)
+app.include_router(
+    users_router,
+    prefix="/users",
+    tags=["Users"]
+)
+
 # Health check endpoint
 @app.get("/")
 async def root():
@@ -57,13 +104,38 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {
-        "status": "healthy",
+    checks = await readiness(engine, UPLOAD_DIR)
+    healthy = all(check["ok"] for check in checks.values())
+    return JSONResponse({
+        "status": "healthy" if healthy else "unhealthy",
         "validation": "active", 
         "upload_limit": "10MB",
-        "supported_types": ["PDF", "Word", "Excel", "CSV"]
-    }
+        "supported_types": ["PDF", "Word", "Excel", "CSV"],
+        "checks": checks,
+        "cache": get_cache().stats()
+    }, status_code=200 if healthy else 503)
+
+@app.get("/health/live")
+async def liveness():
+    """The process is up and its event loop answers - restart it if this fails"""
+    return {"status": "alive", "pid": os.getpid(), "startup_ms": app.state.startup_ms}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Database and storage both usable and not shutting down - send traffic here only if this is 200"""
+    checks = await readiness(engine, UPLOAD_DIR)
+    if is_draining():
+        status = "draining"
+    else:
+        status = "ready" if all(check["ok"] for check in checks.values()) else "unavailable"
+    return JSONResponse({"status": status, "checks": checks}, status_code=200 if status == "ready" else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint - request/stage/query latency histograms"""
+    return PlainTextResponse(REGISTRY.exposition(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
+    # Dev server - `python serve.py` runs the production setup
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
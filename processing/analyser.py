@@ -0,0 +1,528 @@
+"""
+One-pass column profiling for CSV and Excel documents
+
+Rows are read in chunks of PROFILE_CHUNK_ROWS and turned into columns, and
+each column keeps a fixed-size summary - running mean/variance, min/max,
+a HyperLogLog sketch for distinct values and a random sample for quantiles.
+Memory depends on the number of columns, never on the number of rows.
+NumPy is used for the number crunching when it's installed.
+"""
+import csv
+import heapq
+import io
+import math
+import random
+import re
+import struct
+import zipfile
+from itertools import chain, filterfalse, islice, repeat, zip_longest
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+from xml.etree.ElementTree import iterparse
+from sqlalchemy.orm import Session
+from processing.models import DocumentProfile, ProcessingJob
+from processing.workflow import find_result_for_same_content, register_handler
+from documents.compression import open_stored
+from shared.lazy import optional_import
+from config import PROFILE_CHUNK_ROWS, PROFILE_QUANTILE_SAMPLE
+
+# Optional - the pure Python path gives the same answers, just slower. Only imported
+# once a profile actually needs it, so processes that never profile don't pay for it
+np = optional_import("numpy")
+
+XLSX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Cells that count as missing. Matched exactly - normalising every cell would cost more than the rest of the profile
+NULL_VALUES = frozenset({"", "NA", "N/A", "na", "n/a", "NaN", "nan", "NULL", "null", "None", "none", "-"})
+TRUE_VALUES = frozenset({"true", "True", "TRUE", "yes", "Yes"})
+BOOLEAN_VALUES = TRUE_VALUES | {"false", "False", "FALSE", "no", "No"}
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?)?$")
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Types a column can settle into. Integers widen to floats, any other mix is a string column.
+INTEGER, FLOAT, BOOLEAN, DATE, STRING = "integer", "float", "boolean", "date", "string"
+
+_MASK64 = (1 << 64) - 1
+_DOUBLE = struct.Struct("<d")
+
+
+def _number_hash(number: float) -> int:
+    """splitmix64 of a float's bits - the same hash HyperLogLog.add_numbers gives an array"""
+    z = int.from_bytes(_DOUBLE.pack(number + 0.0), "little")
+    z = (z + 0x9E3779B97F4A7C15) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+
+class HyperLogLog:
+    """Approximate distinct count in 2**precision bytes (about 1.6% error at the default 12)"""
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+        self._shift = 64 - precision
+        self._low_mask = (1 << self._shift) - 1
+        # Numpy view over the same bytes, so both paths update one set of registers
+        self._array = np.frombuffer(self.registers, dtype=np.uint8) if np is not None else None
+
+    def add_hashes(self, hashes: Sequence[int]):
+        """Add 64-bit hashes (Python's hash() of each value - SipHash for strings, so well mixed)"""
+        if self._array is not None and len(hashes) > 64:
+            self._add_array(np.fromiter(hashes, dtype=np.int64, count=len(hashes)).view(np.uint64))
+            return
+
+        registers, shift, low_mask = self.registers, self._shift, self._low_mask
+        for h in hashes:
+            h &= _MASK64
+            index = h >> shift
+            rank = shift - (h & low_mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def add_numbers(self, numbers):
+        """Add floats by value, mixing the bits with splitmix64 (vectorised for a numpy array)"""
+        if np is None or not isinstance(numbers, np.ndarray):
+            self.add_hashes(list(map(_number_hash, numbers)))
+            return
+        z = (numbers + 0.0).view(np.uint64)  # + 0.0 folds -0.0 into 0.0
+        z = z + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        self._add_array(z ^ (z >> np.uint64(31)))
+
+    def _add_array(self, h):
+        index = (h >> np.uint64(self._shift)).astype(np.intp)
+        rest = (h & np.uint64(self._low_mask)).astype(np.float64)  # <= 52 bits, exact as a float
+        # frexp's exponent is the bit length; rank = leading zeros in the low bits + 1
+        rank = (self._shift + 1 - np.frexp(rest)[1]).astype(np.uint8)
+        np.maximum.at(self._array, index, rank)
+
+    def count(self) -> int:
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small cardinalities - linear counting is much more accurate there
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class QuantileSample:
+    """
+    Uniform random sample of a stream (bottom-k by random key)
+
+    Keeping the k values with the smallest random keys gives a uniform sample
+    whatever order chunks arrive in, and quantiles of a 4096-value sample are
+    within a percentile or two of the exact ones.
+    """
+
+    def __init__(self, size: int = PROFILE_QUANTILE_SAMPLE, seed: int = 0):
+        self.size = size
+        self._random = random.Random(seed)
+        self._rng = None
+        self._keys = None
+        self._values = None
+        self._heap: List[Tuple[float, float]] = []  # (-key, value) - max-heap on key, pure Python path
+
+    def add(self, values):
+        if np is not None and isinstance(values, np.ndarray):
+            keys = self._numpy_rng().random(len(values))
+            if self._keys is not None:
+                keys = np.concatenate((self._keys, keys))
+                values = np.concatenate((self._values, values))
+            if len(keys) > self.size:
+                keep = np.argpartition(keys, self.size)[:self.size]
+                keys, values = keys[keep], values[keep]
+            self._keys, self._values = keys, values
+            return
+
+        heap, size, rand = self._heap, self.size, self._random.random
+        for value in values:
+            key = rand()
+            if len(heap) < size:
+                heapq.heappush(heap, (-key, value))
+            elif key < -heap[0][0]:
+                heapq.heapreplace(heap, (-key, value))
+
+    def _numpy_rng(self):
+        if self._rng is None:
+            self._rng = np.random.default_rng(self._random.randrange(2 ** 32))
+        return self._rng
+
+    def quantiles(self, points: Sequence[float] = QUANTILES) -> Optional[dict]:
+        sample = sorted(value for _, value in self._heap)
+        if self._values is not None:
+            sample = sorted(sample + self._values.tolist())
+        if not sample:
+            return None
+        # Linear interpolation between closest ranks, same as numpy's default
+        result = {}
+        for q in points:
+            position = q * (len(sample) - 1)
+            low = math.floor(position)
+            high = min(low + 1, len(sample) - 1)
+            result[f"p{round(q * 100)}"] = sample[low] + (sample[high] - sample[low]) * (position - low)
+        return result
+
+
+class ColumnProfile:
+    """Running statistics for one column"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.kind: Optional[str] = None  # None until a non-null value turns up
+        self.count = 0
+        self.null_count = 0
+        self.distinct = HyperLogLog()
+        self._distinct_by_value = False  # Numbers have gone into the sketch by value, not as text
+        self.sample = QuantileSample()
+        # Numeric columns - Welford running mean and sum of squared differences
+        self._numeric_seen = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.numeric_min = None
+        self.numeric_max = None
+        # Text columns (dates included, ISO dates sort correctly as text)
+        self.text_min = None
+        self.text_max = None
+        self.true_count = 0
+
+    def update(self, values: Sequence[str]):
+        """Fold in one chunk of raw cell values"""
+        self.count += len(values)
+        present = list(filterfalse(NULL_VALUES.__contains__, values))
+        self.null_count += len(values) - len(present)
+        if not present:
+            return
+
+        smallest, largest = min(present), max(present)
+        self.text_min = smallest if self.text_min is None or smallest < self.text_min else self.text_min
+        self.text_max = largest if self.text_max is None or largest > self.text_max else self.text_max
+
+        kind, numbers = self._classify(present) if self.kind != STRING else (STRING, None)
+        self._settle(kind)
+        if numbers is not None and self.kind in (INTEGER, FLOAT):
+            self._add_numbers(numbers)
+        elif self.kind == BOOLEAN:
+            self.true_count += sum(map(TRUE_VALUES.__contains__, present))
+
+        self._add_distinct(present, numbers)
+
+    def _add_distinct(self, present: List[str], numbers):
+        # Numbers are counted by value ("1.0" and "1" are one value), and stay that way if the column
+        # turns into text later - otherwise "5" before and "5" after would land in two hash spaces
+        if numbers is not None:
+            self._distinct_by_value = True
+            self.distinct.add_numbers(numbers)
+            return
+        if not self._distinct_by_value:
+            self.distinct.add_hashes(list(map(hash, present)))
+            return
+
+        parsed, text = [], []
+        for value in present:
+            try:
+                number = float(value)
+            except ValueError:
+                text.append(value)
+                continue
+            if math.isfinite(number):
+                parsed.append(number)
+            else:
+                text.append(value)
+        if parsed:
+            self.distinct.add_numbers(np.array(parsed, dtype=np.float64) if np is not None else parsed)
+        if text:
+            self.distinct.add_hashes(list(map(hash, text)))
+
+    def _classify(self, present: List[str]):
+        """Kind of a chunk of non-null values, plus the parsed numbers if it's numeric"""
+        # Only try what could still keep the column's current kind - anything else makes it a string column
+        kind = self.kind
+        if kind in (None, INTEGER, FLOAT):
+            numbers = self._parse_numbers(present, integers=kind != FLOAT)
+            if numbers is not None:
+                return numbers
+            if kind is not None:
+                return STRING, None
+        if kind in (None, BOOLEAN) and BOOLEAN_VALUES.issuperset(present):
+            return BOOLEAN, None
+        if kind in (None, DATE) and all(map(DATE_PATTERN.match, present)):
+            return DATE, None
+        return STRING, None
+
+    @staticmethod
+    def _parse_numbers(present: List[str], integers: bool):
+        if np is not None:
+            if integers:
+                try:
+                    return INTEGER, np.array(present, dtype=np.int64).astype(np.float64)
+                except (ValueError, OverflowError):
+                    pass
+            try:
+                numbers = np.array(present, dtype=np.float64)
+                # numpy happily parses 'inf'/'nan' - those aren't data
+                if np.isfinite(numbers).all():
+                    return FLOAT, numbers
+            except ValueError:
+                pass
+            return None
+
+        if integers:
+            try:
+                return INTEGER, [float(int(value)) for value in present]
+            except ValueError:
+                pass
+        try:
+            numbers = [float(value) for value in present]
+            if all(math.isfinite(number) for number in numbers):
+                return FLOAT, numbers
+        except ValueError:
+            pass
+        return None
+
+    def _settle(self, kind: str):
+        if self.kind is None or self.kind == kind:
+            self.kind = kind
+        elif {self.kind, kind} == {INTEGER, FLOAT}:
+            self.kind = FLOAT
+        else:
+            self.kind = STRING
+
+    def _add_numbers(self, numbers):
+        # Chan et al. parallel update - merge this chunk's mean/M2 into the running totals
+        if np is not None:
+            numbers = np.asarray(numbers, dtype=np.float64)
+            n = len(numbers)
+            chunk_mean = float(numbers.mean())
+            chunk_m2 = float(((numbers - chunk_mean) ** 2).sum())
+            chunk_min, chunk_max = float(numbers.min()), float(numbers.max())
+        else:
+            n = len(numbers)
+            chunk_mean = math.fsum(numbers) / n
+            chunk_m2 = math.fsum((x - chunk_mean) ** 2 for x in numbers)
+            chunk_min, chunk_max = min(numbers), max(numbers)
+
+        seen = self._numeric_seen
+        total = seen + n
+        delta = chunk_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += chunk_m2 + delta * delta * seen * n / total
+        self._numeric_seen = total
+        self.numeric_min = chunk_min if self.numeric_min is None else min(self.numeric_min, chunk_min)
+        self.numeric_max = chunk_max if self.numeric_max is None else max(self.numeric_max, chunk_max)
+        self.sample.add(numbers)
+
+    def summary(self) -> dict:
+        result = {
+            "name": self.name,
+            "type": self.kind or STRING,
+            "count": self.count,
+            "null_count": self.null_count,
+            "distinct_approx": min(self.distinct.count(), self.count - self.null_count),
+            "min": None,
+            "max": None,
+        }
+        if self.kind in (INTEGER, FLOAT):
+            numeric = self._numeric_seen
+            variance = self.m2 / (numeric - 1) if numeric > 1 else 0.0
+            as_type = int if self.kind == INTEGER else float
+            result.update({
+                "min": as_type(self.numeric_min),
+                "max": as_type(self.numeric_max),
+                "mean": self.mean,
+                "variance": variance,
+                "stddev": math.sqrt(variance),
+                "quantiles": self.sample.quantiles(),
+            })
+        elif self.kind == BOOLEAN:
+            result["true_count"] = self.true_count
+        else:
+            result.update({"min": self.text_min, "max": self.text_max})
+        return result
+
+
+def profile_columns(header: Optional[Sequence[str]], chunks: Iterable[List[Sequence[str]]]) -> dict:
+    """Profile a table given its header row and chunks of columns (all the same length within a chunk)"""
+    columns = [ColumnProfile(name) for name in (header or [])]
+    row_count = 0
+
+    for chunk in chunks:
+        rows = len(chunk[0]) if chunk else 0
+        if not rows:
+            continue
+        row_count += rows
+        # A ragged row can add a column part way through - it was missing from every earlier row
+        while len(columns) < len(chunk):
+            column = ColumnProfile(f"column_{len(columns) + 1}")
+            column.count = column.null_count = row_count - rows
+            columns.append(column)
+        for column, values in zip(columns, chunk):
+            column.update(values)
+        for column in columns[len(chunk):]:
+            column.update([""] * rows)
+
+    return {
+        "row_count": row_count,
+        "column_count": len(columns),
+        "columns": [column.summary() for column in columns],
+    }
+
+
+def _rows_to_columns(rows: List[Sequence[str]]) -> List[Sequence[str]]:
+    # Short rows are padded with nulls
+    return list(zip_longest(*rows, fillvalue=""))
+
+def _row_chunks(rows: Iterator[Sequence[str]], size: int) -> Iterator[List[Sequence[str]]]:
+    """Group a row iterator into column chunks of up to size rows"""
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield _rows_to_columns(chunk)
+
+def _split_lines(lines: List[str], delimiter: str) -> List[Sequence[str]]:
+    # When every line has the same number of fields the whole chunk can be split at once
+    # and each column sliced out of the result - no per-row lists, no transpose
+    widths = set(map(str.count, lines, repeat(delimiter)))
+    if len(widths) == 1:
+        width = widths.pop() + 1
+        cells = delimiter.join(lines).split(delimiter)
+        return [cells[i::width] for i in range(width)]
+    return _rows_to_columns([line.split(delimiter) for line in lines])
+
+
+CSV_READ_SIZE = 1024 * 1024
+
+def iter_csv_chunks(path: str, chunk_rows: int = PROFILE_CHUNK_ROWS, codec: Optional[str] = None) -> Iterator[List[Sequence[str]]]:
+    """
+    A CSV as column chunks of up to chunk_rows rows, header included
+
+    csv.reader is most of the cost of a profile, and most files never quote
+    anything - so blocks without a quote character are just split on lines
+    and the delimiter. From the first quote on, csv.reader takes over for
+    the rest of the file (a quoted field can hold newlines, so there's no
+    going back to the fast path safely).
+    """
+    raw = io.BufferedReader(open_stored(path, codec), CSV_READ_SIZE)
+    with io.TextIOWrapper(raw, encoding="utf-8-sig", errors="replace", newline="") as f:
+        # Semicolon and tab separated files are common enough to be worth a guess
+        try:
+            dialect = csv.Sniffer().sniff(f.read(64 * 1024), delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel
+        f.seek(0)
+
+        delimiter = dialect.delimiter
+        leftover = ""
+        while True:
+            block = f.read(CSV_READ_SIZE)
+            if not block:
+                if leftover.strip():
+                    yield _split_lines([leftover.rstrip("\r\n")], delimiter)
+                return
+            block = leftover + block
+            if '"' in block:
+                # StringIO with newline="" hands csv.reader lines the way the file itself would
+                rows = csv.reader(chain(io.StringIO(block, newline=""), f), dialect)
+                yield from _row_chunks(rows, chunk_rows)
+                return
+            # Hold back the last partial line for the next block
+            cut = block.rfind("\n") + 1
+            block, leftover = block[:cut], block[cut:]
+            # Not splitlines() - that also breaks on \x0c, \x85, \u2028 and friends, which CSV keeps in the field
+            lines = [line[:-1] if line.endswith("\r") else line for line in block.split("\n")]
+            lines = list(filter(None, lines))
+            for start in range(0, len(lines), chunk_rows):
+                yield _split_lines(lines[start:start + chunk_rows], delimiter)
+
+
+SPREADSHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_CELL_COLUMN = re.compile(r"[A-Z]+")
+
+def _column_index(reference: str) -> int:
+    index = 0
+    for letter in _CELL_COLUMN.match(reference).group():
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+def _shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as f:
+        for _, element in iterparse(f):
+            if element.tag == SPREADSHEET_NS + "si":
+                # Rich text splits a string over several <t> runs
+                strings.append("".join(t.text or "" for t in element.iter(SPREADSHEET_NS + "t")))
+                element.clear()
+    return strings
+
+def iter_xlsx_rows(path: str, codec: Optional[str] = None) -> Iterator[List[str]]:
+    """Rows of the first worksheet as strings, streamed from the zip without building the sheet in memory"""
+    with open_stored(path, codec) as stored, zipfile.ZipFile(stored) as archive:
+        sheets = sorted(name for name in archive.namelist()
+                        if name.startswith("xl/worksheets/sheet") and name.endswith(".xml"))
+        if not sheets:
+            return
+        strings = _shared_strings(archive)
+        sheet = "xl/worksheets/sheet1.xml" if "xl/worksheets/sheet1.xml" in sheets else sheets[0]
+        with archive.open(sheet) as f:
+            for _, element in iterparse(f):
+                if element.tag != SPREADSHEET_NS + "row":
+                    continue
+                row = []
+                for cell in element.iter(SPREADSHEET_NS + "c"):
+                    reference = cell.get("r")
+                    if reference:
+                        # Empty cells are left out of the XML, so place by reference
+                        index = _column_index(reference)
+                        row.extend([""] * (index - len(row)))
+                    cell_type = cell.get("t")
+                    if cell_type == "inlineStr":
+                        value = "".join(t.text or "" for t in cell.iter(SPREADSHEET_NS + "t"))
+                    else:
+                        value = cell.findtext(SPREADSHEET_NS + "v") or ""
+                        if cell_type == "s" and value:
+                            value = strings[int(value)]
+                        elif cell_type == "b":
+                            value = "true" if value == "1" else "false"
+                    row.append(value)
+                element.clear()
+                yield row
+
+
+def profile_file(path: str, mime_type: str, chunk_rows: int = PROFILE_CHUNK_ROWS, codec: Optional[str] = None) -> dict:
+    """Profile a CSV or .xlsx file - the first row is taken as the header (codec is Document.codec)"""
+    if mime_type == XLSX_MIME_TYPE:
+        chunks = _row_chunks(iter_xlsx_rows(path, codec), chunk_rows)
+    else:
+        chunks = iter_csv_chunks(path, chunk_rows, codec)
+
+    header = None
+    for first in chunks:
+        # Header is the first value of each column in the first chunk
+        header = [column[0] for column in first]
+        chunks = chain([[column[1:] for column in first]], chunks)
+        break
+    return profile_columns(header, chunks)
+
+
+# Old binary .xls isn't handled - there's no stdlib reader for it
+@register_handler("text/csv", XLSX_MIME_TYPE)
+def profile_step(db: Session, job: ProcessingJob):
+    """Processing step: store column statistics, reusing an earlier profile of the same bytes"""
+    if db.query(DocumentProfile.document_id).filter(DocumentProfile.document_id == job.document_id).first():
+        return
+
+    existing = find_result_for_same_content(db, DocumentProfile, job)
+    if existing is not None:
+        profile = {"row_count": existing.row_count, "column_count": existing.column_count, "columns": existing.columns}
+    else:
+        profile = profile_file(job.file_path, job.mime_type, codec=job.codec)
+
+    db.add(DocumentProfile(document_id=job.document_id, **profile))
+    db.commit()
@@ -0,0 +1,123 @@
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional
+from sqlalchemy.orm import Session
+from processing.models import DocumentText, ProcessingJob
+from processing.workflow import find_result_for_same_content, register_handler
+from shared.lazy import lazy_import
+from config import (
+    EXTRACTION_PROCESSES, EXTRACTION_PARALLEL_MIN_PAGES, EXTRACTION_PAGES_PER_TASK, MAX_EXTRACTED_CHARS
+)
+
+# Shared across documents - starting processes per PDF would cost more than the extraction
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork - the API process has threads, and forking those isn't safe
+            _pool = ProcessPoolExecutor(
+                max_workers=EXTRACTION_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+def shutdown_extraction_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+# Loaded on first use - it's a good chunk of startup time for processes that never see a PDF
+PyPDF2 = lazy_import("PyPDF2")
+
+# Readers are always given an open file - handed a path, PyPDF2 reads the whole PDF into memory first
+
+def count_pages(path: str) -> int:
+    with open(path, "rb") as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+def extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop) - runs in a pool process, which opens the file itself"""
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        return [reader.pages[i].extract_text() or "" for i in range(start, min(stop, len(reader.pages)))]
+
+def iter_pdf_pages(path: str, page_count: Optional[int] = None) -> Iterator[str]:
+    """
+    Yield a PDF's text one page at a time, in order
+
+    Small PDFs are read right here. Big ones are split into page ranges that
+    run on the process pool, with only a couple of ranges per process in
+    flight at once - so memory stays bounded however long the document is,
+    and the consumer can stop early without the rest being extracted.
+    """
+    if page_count is None:
+        page_count = count_pages(path)
+
+    if page_count < EXTRACTION_PARALLEL_MIN_PAGES or EXTRACTION_PROCESSES <= 1:
+        with open(path, "rb") as f:
+            for page in PyPDF2.PdfReader(f).pages:
+                yield page.extract_text() or ""
+        return
+
+    pool = _get_pool()
+    ranges = deque(range(0, page_count, EXTRACTION_PAGES_PER_TASK))
+    in_flight = deque()
+    max_in_flight = EXTRACTION_PROCESSES * 2
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < max_in_flight:
+                start = ranges.popleft()
+                in_flight.append(pool.submit(extract_page_range, path, start, start + EXTRACTION_PAGES_PER_TASK))
+            # Oldest range first so pages come out in order
+            for text in in_flight.popleft().result():
+                yield text
+    finally:
+        # Consumer stopped early (or something failed) - don't leave work queued
+        for future in in_flight:
+            future.cancel()
+
+def extract_pdf_text(path: str, max_chars: int = MAX_EXTRACTED_CHARS):
+    """Whole-document text capped at max_chars. Returns (text, page_count, truncated)."""
+    page_count = count_pages(path)
+    parts = []
+    total = 0
+    truncated = False
+    for text in iter_pdf_pages(path, page_count):
+        if total + len(text) > max_chars:
+            parts.append(text[:max_chars - total])
+            truncated = True
+            break
+        parts.append(text)
+        total += len(text)
+    return "\n\n".join(parts), page_count, truncated
+
+
+@register_handler("application/pdf")
+def extract_text_step(db: Session, job: ProcessingJob):
+    """Processing step: store the PDF's text, reusing earlier results where possible"""
+    if db.query(DocumentText.document_id).filter(DocumentText.document_id == job.document_id).first():
+        return
+
+    # Same bytes were uploaded before - copy their text over
+    existing = find_result_for_same_content(db, DocumentText, job)
+
+    if existing is not None:
+        content, page_count, truncated = existing.content, existing.page_count, existing.truncated
+    else:
+        content, page_count, truncated = extract_pdf_text(job.file_path)
+
+    db.add(DocumentText(
+        document_id=job.document_id,
+        content=content,
+        page_count=page_count,
+        truncated=truncated
+    ))
+    db.commit()
@@ -0,0 +1,11 @@
+from sqlalchemy.orm import Session
+from processing.models import ProcessingJob
+from processing.workflow import register_final_handler
+from search.index import index_document
+
+
+@register_final_handler
+def index_step(db: Session, job: ProcessingJob):
+    """Processing step: make the document searchable by name and by whatever text the earlier steps pulled out"""
+    index_document(db, job.document_id)
+    db.commit()
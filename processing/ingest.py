@@ -0,0 +1,70 @@
+import os
+from sqlalchemy.orm import Session
+from documents.models import Document, PendingUpload
+from documents.storage import StreamingFileWriter, get_storage
+from processing.models import ProcessingJob
+from processing.workflow import register_handler
+from shared.cache import get_cache
+from shared.validators import SNIFF_SIZE, content_matches
+from config import MAX_FILE_SIZE
+
+
+def _reject(db: Session, pending: PendingUpload, message: str, cleanup):
+    # No longer waiting on ingest - the document is just failed (the workflow's rollback would undo this, so commit now)
+    db.delete(pending)
+    db.commit()
+    cleanup()
+    raise ValueError(message)
+
+
+@register_handler("*")
+def ingest_step(db: Session, job: ProcessingJob):
+    """
+    Finish an upload that was accepted with 202
+
+    The content sniff, hash and fsync that a normal upload does before
+    answering happen here instead, then the file is placed in storage
+    exactly as it would have been. Later steps see the final path.
+    """
+    pending = db.query(PendingUpload).filter(PendingUpload.document_id == job.document_id).first()
+    if pending is None:
+        return
+
+    with open(job.file_path, "rb") as f:
+        head = f.read(SNIFF_SIZE)
+    if not content_matches(job.mime_type, head):
+        # Not keeping bytes we'd have refused outright on the normal upload path
+        _reject(db, pending, f"File content doesn't match file type {job.mime_type}", lambda: os.remove(job.file_path))
+
+    writer = StreamingFileWriter.adopt(job.file_path, max_size=MAX_FILE_SIZE, mime_type=job.mime_type)
+    if writer.size != job.file_size:
+        # The data never made it to disk (the server went down before it was synced)
+        _reject(db, pending, "Upload was lost before it was saved - please upload it again", writer.abort)
+    writer.finish()
+
+    storage = get_storage()
+    filename = db.query(Document.filename).filter(Document.id == job.document_id).scalar()
+    final_path = storage.final_path(writer, job.user_id, filename)
+    placed = False
+    try:
+        db.query(Document).filter(Document.id == job.document_id).update({
+            Document.file_path: str(final_path),
+            Document.content_hash: writer.digest,
+            Document.codec: writer.codec,
+        }, synchronize_session=False)
+        db.delete(pending)
+        db.flush()
+        storage.place(db, writer, final_path)
+        placed = True
+        db.commit()
+    except Exception:
+        db.rollback()
+        writer.abort()
+        if placed:
+            storage.discard(db, str(final_path))
+        raise
+
+    get_cache().invalidate_user(job.user_id)  # Its details show the file path
+    job.file_path = str(final_path)
+    job.content_hash = writer.digest
+    job.codec = writer.codec
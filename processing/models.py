@@ -0,0 +1,50 @@
+from dataclasses import dataclass
+from typing import Optional
+from sqlalchemy import Column, Integer, Text, Boolean, DateTime, ForeignKey, JSON
+from sqlalchemy.sql import func
+from shared.database import Base
+
+
+@dataclass
+class ProcessingJob:
+    """
+    A claimed document, detached from the session that claimed it
+
+    Handlers get this rather than the ORM object so they can run for as long
+    as they need without holding a session (or a DB lock) open.
+    """
+    document_id: int
+    user_id: int
+    file_path: str
+    file_size: int
+    mime_type: str
+    content_hash: Optional[str] = None
+    codec: Optional[str] = None  # Read the file through documents.compression.open_stored
+
+
+class DocumentText(Base):
+    """Text pulled out of a document, kept so it's only ever extracted once"""
+    __tablename__ = "document_texts"
+    
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    content = Column(Text, nullable=False)
+    page_count = Column(Integer, nullable=False)
+    truncated = Column(Boolean, nullable=False, default=False)  # Hit MAX_EXTRACTED_CHARS
+    extracted_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    def __repr__(self):
+        return f"<DocumentText(document_id={self.document_id}, pages={self.page_count}, chars={len(self.content)})>"
+
+
+class DocumentProfile(Base):
+    """Per-column statistics for a CSV/Excel document"""
+    __tablename__ = "document_profiles"
+    
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    row_count = Column(Integer, nullable=False)
+    column_count = Column(Integer, nullable=False)
+    columns = Column(JSON, nullable=False)  # One dict of stats per column, in file order
+    profiled_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    def __repr__(self):
+        return f"<DocumentProfile(document_id={self.document_id}, rows={self.row_count}, columns={self.column_count})>"
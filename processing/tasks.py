@@ -0,0 +1,216 @@
+"""
+Processing queue backends and workers
+
+    python -m processing.tasks --workers 4        # drain the database queue with 4 processes
+    celery -A processing.tasks:celery_app worker  # when PROCESSING_QUEUE=celery
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Optional
+from shared.database import SessionLocal, engine
+from processing.workflow import claim_next_document, process_document, requeue_stale_documents, run_job
+from processing.extractor import shutdown_extraction_pool
+import processing.ingest  # noqa: F401 - registers the step that finishes accept-fast (202) uploads
+import processing.analyser  # noqa: F401 - registers the CSV/Excel profiling step
+import processing.indexing  # noqa: F401 - registers the search indexing step
+from config import (
+    PROCESSING_QUEUE, CELERY_BROKER_URL, PROCESSING_POLL_INTERVAL, PROCESSING_STALE_AFTER
+)
+
+logger = logging.getLogger(__name__)
+
+
+class QueueBackend(ABC):
+    """Tells workers that a freshly uploaded document is waiting"""
+
+    @abstractmethod
+    def enqueue(self, document_id: int):
+        """Called once the document's row is committed"""
+
+
+class DatabaseQueue(QueueBackend):
+    """
+    The documents table is the queue - 'uploaded' rows are pending work
+
+    Nothing to send anywhere, enqueue just wakes up any workers in this
+    process so they don't wait out their poll interval. Workers in other
+    processes find the row on their next poll.
+    """
+
+    def __init__(self):
+        self.wakeup = threading.Event()
+
+    def enqueue(self, document_id: int):
+        self.wakeup.set()
+
+
+class CeleryQueue(QueueBackend):
+    """Send each document to Celery workers for scale-out"""
+
+    def enqueue(self, document_id: int):
+        get_celery_app().send_task(PROCESS_DOCUMENT_TASK, args=[document_id])
+
+
+QUEUE_BACKENDS = {
+    "database": DatabaseQueue,
+    "celery": CeleryQueue,
+}
+
+_queue: Optional[QueueBackend] = None
+
+def get_queue() -> QueueBackend:
+    """The configured queue backend (one per process)"""
+    global _queue
+    if _queue is None:
+        if PROCESSING_QUEUE not in QUEUE_BACKENDS:
+            raise ValueError(f"Unknown processing queue '{PROCESSING_QUEUE}'. Options: {', '.join(QUEUE_BACKENDS)}")
+        _queue = QUEUE_BACKENDS[PROCESSING_QUEUE]()
+    return _queue
+
+def enqueue_document(document_id: int):
+    """Queue a document for processing - never fails the upload that called it"""
+    try:
+        get_queue().enqueue(document_id)
+    except Exception:
+        # The row is still 'uploaded', so a database worker or a re-enqueue will pick it up
+        logger.exception("Failed to enqueue document %s for processing", document_id)
+
+
+# Celery is only set up when something actually asks for it
+PROCESS_DOCUMENT_TASK = "docflow.process_document"
+_celery_app = None
+
+def get_celery_app():
+    global _celery_app
+    if _celery_app is None:
+        from celery import Celery
+        app = Celery("docflow", broker=CELERY_BROKER_URL)
+        # Only ack once the task has run, so a worker crash puts it back on the broker
+        app.conf.task_acks_late = True
+        app.conf.worker_prefetch_multiplier = 1
+        app.task(name=PROCESS_DOCUMENT_TASK)(process_document_task)
+        _celery_app = app
+    return _celery_app
+
+def process_document_task(document_id: int) -> Optional[str]:
+    """Celery entry point - claiming is atomic, so duplicate deliveries are harmless"""
+    db = SessionLocal()
+    try:
+        return process_document(db, document_id)
+    finally:
+        db.close()
+
+def __getattr__(name):
+    # Lets `celery -A processing.tasks:celery_app` work without importing Celery for everyone else
+    if name == "celery_app":
+        return get_celery_app()
+    raise AttributeError(name)
+
+
+class Worker:
+    """Claims and processes documents from the database queue until told to stop"""
+
+    def __init__(self, queue: Optional[DatabaseQueue] = None, session_factory=SessionLocal,
+                 poll_interval: float = PROCESSING_POLL_INTERVAL):
+        self.queue = queue if queue is not None else DatabaseQueue()
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+
+    def run_once(self) -> bool:
+        """Process one document if there is one waiting. Returns False when the queue was empty."""
+        db = self.session_factory()
+        try:
+            job = claim_next_document(db)
+            if job is None:
+                return False
+            status = run_job(db, job)
+            logger.info("Document %s %s", job.document_id, status)
+            return True
+        finally:
+            db.close()
+
+    def run(self, max_jobs: Optional[int] = None):
+        processed = 0
+        while not self.stop_event.is_set():
+            try:
+                did_work = self.run_once()
+            except Exception:
+                # DB hiccup (locked, connection dropped) - back off and try again
+                logger.exception("Processing worker error")
+                did_work = False
+            if did_work:
+                processed += 1
+                if max_jobs is not None and processed >= max_jobs:
+                    return
+                continue
+            # Queue empty - sleep until the poll interval passes or an upload wakes us
+            self.queue.wakeup.wait(self.poll_interval)
+            self.queue.wakeup.clear()
+
+    def stop(self):
+        self.stop_event.set()
+        self.queue.wakeup.set()
+
+
+def start_in_process_workers(count: int) -> List[Worker]:
+    """Background worker threads inside the API process (database queue only)"""
+    queue = get_queue()
+    if count <= 0 or not isinstance(queue, DatabaseQueue):
+        return []
+
+    db = SessionLocal()
+    try:
+        requeue_stale_documents(db, PROCESSING_STALE_AFTER)
+    finally:
+        db.close()
+
+    workers = [Worker(queue) for _ in range(count)]
+    for n, worker in enumerate(workers):
+        threading.Thread(target=worker.run, name=f"docflow-processing-{n}", daemon=True).start()
+    return workers
+
+
+def _worker_process():
+    # Don't reuse connections inherited from the parent across the fork
+    engine.dispose()
+    worker = Worker()
+    # The parent turns Ctrl-C into SIGTERM, which lets the current job finish first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    worker.run()
+    shutdown_extraction_pool()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run DocFlow processing workers against the database queue")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes to start")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(message)s")
+
+    db = SessionLocal()
+    try:
+        requeued = requeue_stale_documents(db, PROCESSING_STALE_AFTER)
+        if requeued:
+            logger.info("Requeued %s documents left in processing by a dead worker", requeued)
+    finally:
+        db.close()
+
+    processes = [multiprocessing.Process(target=_worker_process, name=f"worker-{n}") for n in range(args.workers)]
+    for process in processes:
+        process.start()
+
+    def shutdown(*_):
+        for process in processes:
+            process.terminate()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for process in processes:
+        process.join()
+
+if __name__ == "__main__":
+    main()
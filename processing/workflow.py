@@ -0,0 +1,168 @@
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+from documents.models import Document, DocumentStatus
+from documents.events import notify_status
+from processing.models import ProcessingJob
+from shared.cache import get_cache
+from users.service import UsageService
+
+# mime type -> steps to run, in order. "*" steps run for every document first.
+Handler = Callable[[Session, ProcessingJob], None]
+HANDLERS: Dict[str, List[Handler]] = {}
+
+def register_handler(*mime_types: str):
+    """Decorator to add a processing step for one or more MIME types"""
+    def decorator(handler: Handler) -> Handler:
+        for mime_type in mime_types:
+            HANDLERS.setdefault(mime_type, []).append(handler)
+        return handler
+    return decorator
+
+# Steps that run after all the others, whatever the type - e.g. indexing what they produced
+FINAL_HANDLERS: List[Handler] = []
+
+def register_final_handler(handler: Handler) -> Handler:
+    FINAL_HANDLERS.append(handler)
+    return handler
+
+def handlers_for(mime_type: str) -> List[Handler]:
+    return HANDLERS.get("*", []) + HANDLERS.get(mime_type, []) + FINAL_HANDLERS
+
+@register_handler("*")
+def check_stored_file(db: Session, job: ProcessingJob):
+    """Make sure the bytes we're about to process are actually there"""
+    if not os.path.exists(job.file_path):
+        raise FileNotFoundError("Stored file is missing")
+
+
+def find_result_for_same_content(db: Session, model, job: ProcessingJob):
+    """
+    A stored result (model row keyed by document_id) for another document with the same bytes
+
+    With content-addressed storage, re-uploads are common - there's no point
+    parsing the same file twice.
+    """
+    if not job.content_hash:
+        return None
+    return db.query(model).join(Document, Document.id == model.document_id).filter(
+        Document.content_hash == job.content_hash
+    ).first()
+
+
+def claim_document(db: Session, document_id: int) -> Optional[ProcessingJob]:
+    """
+    Atomically move one document from uploaded to processing
+
+    The UPDATE only matches while the row is still 'uploaded', so when several
+    workers go for the same document exactly one of them gets rowcount 1.
+    """
+    claimed = db.query(Document).filter(
+        Document.id == document_id,
+        Document.status == DocumentStatus.UPLOADED
+    ).update({
+        Document.status: DocumentStatus.PROCESSING,
+        Document.processing_started_at: func.now(),
+        Document.processing_error: None,
+    }, synchronize_session=False)
+    if claimed:
+        user_id = db.query(Document.user_id).filter(Document.id == document_id).scalar()
+        UsageService(db).record_status_change(user_id, DocumentStatus.UPLOADED, DocumentStatus.PROCESSING)
+    db.commit()
+    
+    if not claimed:
+        return None
+    notify_status(document_id)
+    
+    row = db.query(
+        Document.id, Document.user_id, Document.file_path, Document.file_size,
+        Document.mime_type, Document.content_hash, Document.codec
+    ).filter(Document.id == document_id).first()
+    get_cache().invalidate_user(row.user_id)
+    return ProcessingJob(
+        document_id=row.id,
+        user_id=row.user_id,
+        file_path=row.file_path,
+        file_size=row.file_size,
+        mime_type=row.mime_type,
+        content_hash=row.content_hash,
+        codec=row.codec
+    )
+
+def claim_next_document(db: Session, batch_size: int = 8) -> Optional[ProcessingJob]:
+    """Claim one of the oldest waiting documents, or None if the queue is empty"""
+    candidates = [row.id for row in db.query(Document.id).filter(
+        Document.status == DocumentStatus.UPLOADED
+    ).order_by(Document.id).limit(batch_size)]
+    
+    # Shuffle so parallel workers don't all fight over the same oldest row
+    random.shuffle(candidates)
+    for document_id in candidates:
+        job = claim_document(db, document_id)
+        if job:
+            return job
+    return None
+
+def run_job(db: Session, job: ProcessingJob) -> str:
+    """Run every step for a claimed document and record how it went"""
+    try:
+        for handler in handlers_for(job.mime_type):
+            handler(db, job)
+    except Exception as e:
+        db.rollback()
+        finish_document(db, job.document_id, DocumentStatus.FAILED, error=str(e) or type(e).__name__)
+        return DocumentStatus.FAILED
+    
+    finish_document(db, job.document_id, DocumentStatus.COMPLETED)
+    return DocumentStatus.COMPLETED
+
+def finish_document(db: Session, document_id: int, status: str, error: Optional[str] = None):
+    """processing → completed/failed, stamping processed_at"""
+    finished = db.query(Document).filter(
+        Document.id == document_id,
+        Document.status == DocumentStatus.PROCESSING
+    ).update({
+        Document.status: status,
+        Document.processed_at: func.now(),
+        Document.processing_error: error[:500] if error else None,
+    }, synchronize_session=False)
+    user_id = db.query(Document.user_id).filter(Document.id == document_id).scalar()
+    if finished:
+        UsageService(db).record_status_change(user_id, DocumentStatus.PROCESSING, status)
+    db.commit()
+    notify_status(document_id)
+    if user_id is not None:
+        get_cache().invalidate_user(user_id)
+
+def process_document(db: Session, document_id: int) -> Optional[str]:
+    """Claim and process one specific document (what queued tasks call)"""
+    job = claim_document(db, document_id)
+    if job is None:
+        # Someone else has it, or it's already been done
+        return None
+    return run_job(db, job)
+
+def requeue_stale_documents(db: Session, stale_after_seconds: int) -> int:
+    """Put documents whose worker died mid-job back on the queue"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=stale_after_seconds)
+    stale = db.query(Document).filter(
+        Document.status == DocumentStatus.PROCESSING,
+        Document.processing_started_at < cutoff
+    )
+    user_ids = {row.user_id for row in stale.with_entities(Document.user_id).distinct()}
+    # One user at a time, so each user's counts move by exactly what was requeued
+    usage = UsageService(db)
+    requeued = 0
+    for user_id in user_ids:
+        count = stale.filter(Document.user_id == user_id).update(
+            {Document.status: DocumentStatus.UPLOADED}, synchronize_session=False
+        )
+        usage.record_status_change(user_id, DocumentStatus.PROCESSING, DocumentStatus.UPLOADED, count)
+        requeued += count
+    db.commit()
+    for user_id in user_ids:
+        get_cache().invalidate_user(user_id)
+    return requeued
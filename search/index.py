@@ -0,0 +1,308 @@
+"""
+Full-text search over document names and extracted text
+
+    python -m search.index --rebuild    # (re)index every completed document
+
+SQLite with FTS5 gets a virtual table; anything else (or SEARCH_BACKEND=inverted)
+gets a plain inverted index in two ordinary tables, ranked with the same BM25.
+Either way a query reads only index entries - never files, never document_texts
+beyond the page of results it's showing snippets for.
+"""
+import argparse
+import math
+import re
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import case, func, insert, text
+from sqlalchemy.orm import Session
+from documents.models import Document, DocumentStatus
+from processing.models import DocumentText
+from search.models import SearchDocument, SearchPosting
+from shared.utils import original_filename
+from config import SEARCH_BACKEND
+
+# Most distinct words a query may have - each one is a separate index lookup
+MAX_QUERY_TERMS = 16
+
+# Longer "words" are almost always junk (base64, hashes) and would blow the term column
+MAX_TERM_LENGTH = 64
+
+_WORD = re.compile(r"[^\W_]+")  # Letters and digits - "_" splits words, as in FTS5
+
+# (document_id, score, snippet) - best first
+SearchHit = Tuple[int, float, Optional[str]]
+
+
+def tokenize(value: str) -> List[str]:
+    """Lower-cased words with accents dropped (like FTS5's remove_diacritics) - the same for documents and queries"""
+    value = unicodedata.normalize("NFKD", value.lower())
+    if not value.isascii():
+        value = "".join(char for char in value if not unicodedata.combining(char))
+    return [word for word in _WORD.findall(value) if 1 < len(word) <= MAX_TERM_LENGTH]
+
+
+def _fold(content: str) -> Tuple[str, Optional[List[int]]]:
+    """
+    content folded the way tokenize() folds words, plus where each folded character came from
+
+    So a query's terms can be found in the text, and the hit mapped back to
+    the original for the snippet. The offsets are None when nothing moved
+    (plain ASCII - lower-casing keeps every character where it was).
+    """
+    if content.isascii():
+        return content.lower(), None
+    folded, origins = [], []
+    for index, char in enumerate(content):
+        for part in unicodedata.normalize("NFKD", char.lower()):
+            if not unicodedata.combining(part):
+                folded.append(part)
+                origins.append(index)
+    return "".join(folded), origins
+
+
+def query_terms(query: str) -> List[str]:
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        from fastapi import HTTPException  # Here rather than at the top - the indexing step runs in workers
+        raise HTTPException(status_code=400, detail="Search needs at least one word of two or more characters")
+    return terms
+
+
+class SearchIndex(ABC):
+    """Both backends index a document's filename and text, and match every query word (AND)"""
+
+    @abstractmethod
+    def add(self, db: Session, document_id: int, user_id: int, filename: str, body: str):
+        """Index a document, replacing anything indexed for it before (caller commits)"""
+
+    @abstractmethod
+    def remove(self, db: Session, document_id: int):
+        """Drop a document from the index (caller commits)"""
+
+    @abstractmethod
+    def search(self, db: Session, user_id: int, terms: List[str], limit: int, offset: int) -> List[SearchHit]:
+        """One page of a user's matching documents, best first"""
+
+
+class Fts5Index(SearchIndex):
+    """
+    SQLite FTS5 - the rowid is the document id
+
+    An "owner" column holds u<user_id> so a query can AND it in and FTS5
+    intersects posting lists rather than filtering other users' hits.
+    """
+
+    def __init__(self, db: Session):
+        db.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS document_search "
+            "USING fts5(owner, filename, body, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        db.commit()
+
+    def add(self, db: Session, document_id: int, user_id: int, filename: str, body: str):
+        self.remove(db, document_id)
+        db.execute(
+            text("INSERT INTO document_search (rowid, owner, filename, body) VALUES (:id, :owner, :filename, :body)"),
+            {"id": document_id, "owner": f"u{user_id}", "filename": filename, "body": body}
+        )
+
+    def remove(self, db: Session, document_id: int):
+        db.execute(text("DELETE FROM document_search WHERE rowid = :id"), {"id": document_id})
+
+    def search(self, db: Session, user_id: int, terms: List[str], limit: int, offset: int) -> List[SearchHit]:
+        # Quoted so query words are never read as FTS5 operators
+        words = " AND ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        match = f"owner:u{user_id} AND {{filename body}} : ({words})"
+        rows = db.execute(text(
+            "SELECT rowid, bm25(document_search, 0.0, 2.0, 1.0) AS rank "
+            "FROM document_search WHERE document_search MATCH :match "
+            "ORDER BY rank, rowid DESC LIMIT :limit OFFSET :offset"
+        ), {"match": match, "limit": limit, "offset": offset}).all()
+        if not rows:
+            return []
+        # Snippets in a second query - in the first, SQLite would build one for every match before sorting.
+        # FTS5 only narrows its scan on rowid ranges (an IN list means matching everything again).
+        page = [int(row[0]) for row in rows]
+        snippets = dict(db.execute(text(
+            "SELECT rowid, snippet(document_search, 2, '**', '**', '…', 16) "
+            "FROM document_search WHERE document_search MATCH :match "
+            f"AND rowid BETWEEN :low AND :high AND rowid IN ({', '.join(map(str, page))})"
+        ), {"match": match, "low": min(page), "high": max(page)}).all())
+        # bm25() is "lower is better", so flip it to a score
+        return [(row[0], round(-row[1], 4), snippets.get(row[0]) or None) for row in rows]
+
+
+class InvertedIndex(SearchIndex):
+    """
+    Postings in ordinary tables, ranked with BM25 in SQL
+
+    Works on any database. Statistics (document count, average length,
+    document frequency) are per user, since a user only ever searches
+    their own documents.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def add(self, db: Session, document_id: int, user_id: int, filename: str, body: str):
+        self.remove(db, document_id)
+        # Filename words count double - a match in the name is a strong hint
+        words = tokenize(filename) * 2 + tokenize(body)
+        counts = Counter(words)
+        db.add(SearchDocument(document_id=document_id, user_id=user_id, length=len(words)))
+        if counts:
+            db.execute(insert(SearchPosting), [
+                {"term": term, "user_id": user_id, "document_id": document_id, "tf": tf}
+                for term, tf in counts.items()
+            ])
+
+    def remove(self, db: Session, document_id: int):
+        db.query(SearchPosting).filter(SearchPosting.document_id == document_id).delete(synchronize_session=False)
+        db.query(SearchDocument).filter(SearchDocument.document_id == document_id).delete(synchronize_session=False)
+
+    def search(self, db: Session, user_id: int, terms: List[str], limit: int, offset: int) -> List[SearchHit]:
+        document_count, average_length = db.query(
+            func.count(SearchDocument.document_id), func.avg(SearchDocument.length)
+        ).filter(SearchDocument.user_id == user_id).one()
+        frequencies = dict(db.query(SearchPosting.term, func.count()).filter(
+            SearchPosting.term.in_(terms),
+            SearchPosting.user_id == user_id
+        ).group_by(SearchPosting.term))
+        if len(frequencies) < len(terms):
+            return []  # Some word appears nowhere, so nothing has all of them
+
+        idf = {term: math.log(1 + (document_count - df + 0.5) / (df + 0.5)) for term, df in frequencies.items()}
+        tf = SearchPosting.tf
+        norm = self.K1 * (1 - self.B + self.B * SearchDocument.length / max(float(average_length or 1), 1.0))
+        score = func.sum(case(idf, value=SearchPosting.term) * tf * (self.K1 + 1) / (tf + norm)).label("score")
+        rows = db.query(SearchPosting.document_id, score).join(
+            SearchDocument, SearchDocument.document_id == SearchPosting.document_id
+        ).filter(
+            SearchPosting.term.in_(terms),
+            SearchPosting.user_id == user_id
+        ).group_by(SearchPosting.document_id).having(
+            func.count() == len(terms)
+        ).order_by(score.desc(), SearchPosting.document_id.desc()).limit(limit).offset(offset).all()
+
+        snippets = self._snippets(db, [row.document_id for row in rows], terms)
+        return [(row.document_id, round(row.score, 4), snippets.get(row.document_id)) for row in rows]
+
+    def _snippets(self, db: Session, document_ids: List[int], terms: List[str]) -> Dict[int, str]:
+        # Only for the page being shown - the text is never read for ranking
+        if not document_ids:
+            return {}
+        # Terms are folded (no accents), so they're matched against folded text and mapped back - "cafe" finds "café"
+        pattern = re.compile(r"\b(?:" + "|".join(re.escape(term) for term in terms) + r")\b")
+        snippets = {}
+        for document_id, content in db.query(DocumentText.document_id, DocumentText.content).filter(
+            DocumentText.document_id.in_(document_ids)
+        ):
+            folded, origins = _fold(content)
+            first = pattern.search(folded)
+            if not first:
+                continue
+            raw_start = (lambda i: origins[i]) if origins else (lambda i: i)
+            raw_end = (lambda i: origins[i - 1] + 1) if origins else (lambda i: i)
+            start = max(0, raw_start(first.start()) - 60)
+            end = min(len(content), raw_end(first.end()) + 60)
+            pieces, position = [], start
+            for match in pattern.finditer(folded, first.start()):
+                match_start, match_end = raw_start(match.start()), raw_end(match.end())
+                if match_end > end:
+                    break
+                pieces += [content[position:match_start], "**", content[match_start:match_end], "**"]
+                position = match_end
+            pieces.append(content[position:end])
+            window = "".join(pieces)
+            snippets[document_id] = ("…" if start else "") + " ".join(window.split()) + ("…" if end < len(content) else "")
+        return snippets
+
+
+_indexes: Dict[str, SearchIndex] = {}
+_indexes_lock = threading.Lock()
+
+def _fts5_available(db: Session) -> bool:
+    if db.get_bind().dialect.name != "sqlite":
+        return False
+    return any(row[0] == "ENABLE_FTS5" for row in db.execute(text("PRAGMA compile_options")))
+
+def get_search_index(db: Session) -> SearchIndex:
+    """The index for this session's database - worked out once per engine"""
+    bind = db.get_bind()
+    with _indexes_lock:
+        index = _indexes.get(str(bind.url))
+        if index is None:
+            if SEARCH_BACKEND not in ("auto", "fts5", "inverted"):
+                raise ValueError(f"Unknown search backend '{SEARCH_BACKEND}'. Options: auto, fts5, inverted")
+            use_fts5 = SEARCH_BACKEND == "fts5" or (SEARCH_BACKEND == "auto" and _fts5_available(db))
+            index = Fts5Index(db) if use_fts5 else InvertedIndex()
+            _indexes[str(bind.url)] = index
+        return index
+
+
+def index_document(db: Session, document_id: int):
+    """(Re)index one document from its row and extracted text - caller commits"""
+    document = db.query(Document.id, Document.user_id, Document.filename).filter(Document.id == document_id).first()
+    if document is None:
+        return
+    content = db.query(DocumentText.content).filter(DocumentText.document_id == document_id).scalar()
+    get_search_index(db).add(db, document.id, document.user_id, original_filename(document.filename), content or "")
+
+
+def search_documents(db: Session, user_id: int, query: str, limit: int, offset: int = 0) -> dict:
+    """Ranked page of a user's documents matching every word of the query"""
+    terms = query_terms(query)
+    hits = get_search_index(db).search(db, user_id, terms, limit + 1, offset)
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+
+    # Owner checked here, not in SQL - with user_id in the WHERE, SQLite walks the user's
+    # whole (user_id, uploaded_at) index instead of looking up a page of primary keys
+    rows = {row.id: row for row in db.query(
+        Document.id, Document.user_id, Document.filename, Document.file_size, Document.mime_type,
+        Document.status, Document.uploaded_at
+    ).filter(Document.id.in_([hit[0] for hit in hits])) if row.user_id == user_id}
+    results = [
+        {
+            "document_id": document_id,
+            "filename": rows[document_id].filename,
+            "file_size": rows[document_id].file_size,
+            "mime_type": rows[document_id].mime_type,
+            "status": rows[document_id].status,
+            "uploaded_at": rows[document_id].uploaded_at,
+            "score": score,
+            "snippet": snippet,
+        }
+        for document_id, score, snippet in hits
+        if document_id in rows
+    ]
+    return {"query": query, "results": results, "next_offset": offset + limit if has_more else None}
+
+
+def rebuild(db: Session) -> int:
+    """Index every completed document from scratch (for data from before search existed)"""
+    document_ids = [row.id for row in db.query(Document.id).filter(Document.status == DocumentStatus.COMPLETED)]
+    for count, document_id in enumerate(document_ids, 1):
+        index_document(db, document_id)
+        if count % 500 == 0:
+            db.commit()
+    db.commit()
+    return len(document_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="index every completed document")
+    args = parser.parse_args()
+    if args.rebuild:
+        from shared.database import SessionLocal, init_database
+        init_database()
+        with SessionLocal() as db:
+            print(f"Indexed {rebuild(db)} documents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
+from shared.database import Base
+
+
+class SearchDocument(Base):
+    """One indexed document for the built-in inverted index (used where FTS5 isn't available)"""
+    __tablename__ = "search_documents"
+    
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)  # Ranking stats are per user
+    length = Column(Integer, nullable=False)  # Tokens indexed, for BM25's length normalisation
+
+
+class SearchPosting(Base):
+    """How often a term appears in a document"""
+    __tablename__ = "search_postings"
+    
+    # (term, user_id) first, so a query reads one contiguous range per term - never other users' postings
+    term = Column(String(64), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    tf = Column(Integer, nullable=False)
+    
+    __table_args__ = (
+        # Removing a document finds its postings through this
+        Index("ix_search_postings_document", "document_id"),
+    )
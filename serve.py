@@ -0,0 +1,151 @@
+"""
+Production server - several uvicorn worker processes sharing one listening socket
+
+    python serve.py --workers 4 --port 8000 --init-db
+
+The app is imported once, here in the parent, and the workers are forked
+from it. Each one starts with every module already loaded (and those pages
+shared copy-on-write), so a worker's cold start is just the lifespan hook -
+/health/live reports it as startup_ms. The schema is only created when
+--init-db is given, once, before any worker exists.
+
+On SIGTERM (or Ctrl-C) every worker starts failing /health/ready, keeps
+serving for --drain-delay seconds so the load balancer can take it out,
+then stops accepting connections and gives in-flight requests - uploads
+included - up to --graceful-timeout seconds to finish. Workers that die
+are restarted.
+"""
+import argparse
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import uvicorn
+from shared.health import is_draining, start_draining
+from config import SERVE_WORKERS, SERVE_DRAIN_DELAY, SERVE_GRACEFUL_TIMEOUT, CACHE_ENABLED, CACHE_REDIS_URL
+
+logger = logging.getLogger("docflow.serve")
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn Server that fails readiness first and only shuts down after the drain delay"""
+
+    def __init__(self, config: uvicorn.Config, drain_delay: float = 0):
+        super().__init__(config)
+        self.drain_delay = drain_delay
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        app = self.config.app
+        logger.info("Worker %s ready in %.1f ms", os.getpid(), app.state.startup_ms or 0)
+
+    def handle_exit(self, sig, frame):
+        if is_draining() or self.drain_delay <= 0:
+            # No delay wanted, or a second signal - stop now
+            start_draining()
+            super().handle_exit(sig, frame)
+            return
+        start_draining()
+        threading.Timer(self.drain_delay, super().handle_exit, (sig, frame)).start()
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _worker(app, sock: socket.socket, args):
+    # The parent's handlers came across with the fork - uvicorn installs its own once it's running
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    app.state.started_at = time.perf_counter()
+    config = uvicorn.Config(
+        app,
+        log_level=args.log_level,
+        access_log=args.access_log,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+    DrainingServer(config, drain_delay=args.drain_delay).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the DocFlow API with several worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="worker processes to fork")
+    parser.add_argument("--init-db", action="store_true", help="create missing tables before starting the workers")
+    parser.add_argument("--drain-delay", type=float, default=SERVE_DRAIN_DELAY,
+                        help="seconds to keep serving with readiness failing after SIGTERM")
+    parser.add_argument("--graceful-timeout", type=float, default=SERVE_GRACEFUL_TIMEOUT,
+                        help="seconds in-flight requests get to finish once accepting stops")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--access-log", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(processName)s %(message)s")
+    if CACHE_ENABLED and not CACHE_REDIS_URL and args.workers > 1:
+        logger.warning("CACHE_ENABLED without CACHE_REDIS_URL - each worker only sees its own changes, "
+                       "so the others serve stale listings for up to CACHE_TTL")
+
+    started = time.perf_counter()
+    from main import app
+    from shared.database import engine, init_database
+    from shared.lazy import load_all
+    load_all()  # Lazy imports too - once here rather than on each worker's first request
+    app.state.create_schema = False
+    if args.init_db:
+        init_database()
+    # No pooled connections or objects the workers would have to collect carried across the fork
+    engine.dispose()
+    gc.collect()
+    gc.freeze()
+    logger.info("App loaded in %.1f ms", (time.perf_counter() - started) * 1000)
+
+    sock = bind_socket(args.host, args.port)
+    context = multiprocessing.get_context("fork")
+    workers = {}
+
+    def spawn(n: int):
+        process = context.Process(target=_worker, args=(app, sock, args), name=f"web-{n}")
+        process.start()
+        workers[n] = process
+
+    stopping = threading.Event()
+
+    def shutdown(*_):
+        stopping.set()
+        for process in workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for n in range(args.workers):
+        spawn(n)
+    logger.info("Serving on %s:%s with %s workers", args.host, args.port, args.workers)
+
+    while not stopping.wait(1.0):
+        for n, process in list(workers.items()):
+            if not process.is_alive() and not stopping.is_set():
+                logger.warning("Worker %s (pid %s) exited with %s - starting a new one", n, process.pid, process.exitcode)
+                spawn(n)
+
+    deadline = time.monotonic() + args.drain_delay + args.graceful_timeout + 5
+    for process in workers.values():
+        process.join(max(0, deadline - time.monotonic()))
+        if process.is_alive():
+            logger.warning("Worker pid %s didn't stop in time - killing it", process.pid)
+            process.kill()
+            process.join()
+    sock.close()
+
+if __name__ == "__main__":
+    main()
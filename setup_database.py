@@ -1,12 +1,12 @@
 from shared.database import init_database, SessionLocal, engine
 from auth.models import User
 from documents.models import Document
-from werkzeug.security import generate_password_hash
 
 def setup_complete_database():
     """Set up complete database with all tables and test data"""
     
     print("🗄️ Setting up DocFlow database...")
+    from werkzeug.security import generate_password_hash  # Only needed here - keeps the script's startup quick
     
     try:
         # Create all tables (this ensures proper order)
@@ -0,0 +1,222 @@
+"""
+Read-through cache for document details and listing pages
+
+Two tiers: a bounded in-process LRU in front of an optional Redis shared by
+every API and worker process. Entries are JSON, so both tiers hand back the
+same thing the database load would have produced.
+
+Invalidation is per user. Every key carries the user's current generation
+token, and a change to any of their documents swaps in a new token - one
+write, and every cached page and detail for that user is unreachable (the
+orphans age out on their TTL). The token is read before the database is,
+so a load racing a change can only ever be stored under the old token.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+from shared.metrics import CACHE_EVICTIONS, CACHE_REQUESTS
+from shared.utils import new_ulid
+from config import CACHE_ENABLED, CACHE_MAX_ENTRIES, CACHE_TTL, CACHE_REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+# Generation tokens outlive any entry made under them - losing one early only costs misses
+GENERATION_TTL = 24 * 60 * 60
+
+
+class LocalCache:
+    """In-process LRU with a TTL per entry - thread-safe, never holds more than max_entries"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            CACHE_EVICTIONS.inc(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class LocalRedis:
+    """
+    Stand-in for a Redis client - the few commands the cache uses, in memory
+
+    For tests and single-process setups that want to exercise the Redis tier
+    without running a server. Values come back as bytes, like redis-py.
+    """
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[Optional[float], bytes]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._values.get(name)
+            if entry is None or (entry[0] is not None and entry[0] <= time.monotonic()):
+                self._values.pop(name, None)
+                return None
+            return entry[1]
+
+    def set(self, name: str, value, ex: Optional[int] = None, nx: bool = False) -> Optional[bool]:
+        if isinstance(value, str):
+            value = value.encode()
+        with self._lock:
+            if nx and name in self._values and (self._values[name][0] is None or self._values[name][0] > time.monotonic()):
+                return None  # What redis-py gives back when nx stops the write
+            self._values[name] = (time.monotonic() + ex if ex else None, value)
+            return True
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(self._values.pop(name, None) is not None for name in names)
+
+
+def _encode(value: Any) -> str:
+    # Datetimes go out the way FastAPI would send them anyway
+    return json.dumps(value, separators=(",", ":"), default=lambda v: v.isoformat() if isinstance(v, (date, datetime)) else str(v))
+
+
+class ReadThroughCache:
+    """Per-user cached values, loaded from the database on a miss"""
+
+    def __init__(self, local: Optional[LocalCache] = None, redis=None, enabled: bool = True):
+        self.local = local if local is not None else LocalCache(CACHE_MAX_ENTRIES, CACHE_TTL)
+        self.redis = redis
+        self.enabled = enabled
+        self.ttl = int(self.local.ttl)
+        self.hits = 0
+        self.misses = 0
+        # Only used without Redis - one short token per user, so it isn't bounded like the entries
+        self._generations: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, cache: str, user_id: int, key: str, load: Callable[[], Any]) -> Any:
+        """The cached value for (user, key), or load() stored for next time"""
+        if not self.enabled:
+            return json.loads(_encode(load()))
+        generation = self._generation(user_id)
+        if generation is None:
+            # Redis is down - without the token there's no telling what's still valid
+            self._count(cache, "miss")
+            return json.loads(_encode(load()))
+
+        full_key = f"docflow:{cache}:{user_id}:{generation}:{key}"
+        value = self.local.get(full_key)
+        if value is not None:
+            self._count(cache, "local")
+            return json.loads(value)
+        if self.redis is not None:
+            value = self._redis_call("get", full_key)
+            if value is not None:
+                value = value.decode()
+                self.local.set(full_key, value)
+                self._count(cache, "redis")
+                return json.loads(value)
+
+        self._count(cache, "miss")
+        value = _encode(load())
+        self.local.set(full_key, value)
+        if self.redis is not None:
+            self._redis_call("set", full_key, value, ex=self.ttl)
+        return json.loads(value)
+
+    def invalidate_user(self, user_id: int):
+        """Forget everything cached for this user - call after the change is committed"""
+        if not self.enabled:
+            return
+        token = new_ulid()
+        if self.redis is not None:
+            self._redis_call("set", self._generation_key(user_id), token, ex=GENERATION_TTL)
+        else:
+            with self._lock:
+                self._generations[user_id] = token
+
+    def stats(self) -> dict:
+        """For sizing - a low hit rate with entries at max_entries means it's too small"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "redis": self.redis is not None,
+            "entries": len(self.local),
+            "max_entries": self.local.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+    def _generation(self, user_id: int) -> Optional[str]:
+        if self.redis is None:
+            with self._lock:
+                return self._generations.setdefault(user_id, new_ulid())
+        key = self._generation_key(user_id)
+        token = self._redis_call("get", key)
+        if token is None:
+            # First look at this user (or the token expired) - if two processes race, nx keeps one
+            self._redis_call("set", key, new_ulid(), ex=GENERATION_TTL, nx=True)
+            token = self._redis_call("get", key)
+        return token.decode() if token is not None else None
+
+    def _generation_key(self, user_id: int) -> str:
+        return f"docflow:generation:{user_id}"
+
+    def _redis_call(self, command: str, *args, **kwargs):
+        # A cache outage makes requests slower, never makes them fail
+        try:
+            return getattr(self.redis, command)(*args, **kwargs)
+        except Exception as e:
+            logger.warning("Cache: Redis %s failed: %s", command, e)
+            return None
+
+    def _count(self, cache: str, result: str):
+        with self._lock:
+            if result == "miss":
+                self.misses += 1
+            else:
+                self.hits += 1
+        CACHE_REQUESTS.inc(cache=cache, result=result)
+
+
+_cache: Optional[ReadThroughCache] = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> ReadThroughCache:
+    """The configured cache (one per process)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            redis = None
+            if CACHE_ENABLED and CACHE_REDIS_URL:
+                import redis as redis_client
+                redis = redis_client.Redis.from_url(CACHE_REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+            _cache = ReadThroughCache(redis=redis, enabled=CACHE_ENABLED)
+        return _cache
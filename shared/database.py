@@ -1,23 +1,80 @@
-from sqlalchemy import create_engine
+from typing import List, Optional
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy import event
-import os
+from shared.metrics import instrument_engine
+from config import (
+    METRICS_ENABLED, DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_STATEMENT_TIMEOUT_MS,
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE_KB
+)
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./docflow.db")
+# Run on every new SQLite connection. journal_mode sticks to the file, the rest are per connection.
+SQLITE_PRAGMAS = {
+    "foreign_keys": "ON",
+    "journal_mode": SQLITE_JOURNAL_MODE,
+    "synchronous": SQLITE_SYNCHRONOUS,
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    "mmap_size": SQLITE_MMAP_SIZE,
+    "cache_size": -SQLITE_CACHE_SIZE_KB,  # Negative means KiB rather than pages
+    "temp_store": "MEMORY",
+}
 
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
+def engine_options(url: str) -> dict:
+    """create_engine() arguments for a database URL - the tuning lives here, per backend"""
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        if make_url(url).database in (None, "", ":memory:"):
+            # Every connection to :memory: is a different database, so share just the one
+            return {"connect_args": {"check_same_thread": False}, "poolclass": StaticPool}
+        return {
+            # Sessions move between the event loop and the I/O pool threads
+            "connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+            # SQLAlchemy 1.4 opens a new SQLite connection per checkout by default - reuse them instead
+            "poolclass": QueuePool,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+        }
+
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        # Cheap check on checkout, so a restarted database server doesn't surface as request errors
+        "pool_pre_ping": True,
+    }
+    if backend == "postgresql":
+        options["connect_args"] = {
+            "application_name": "docflow",
+            "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+        }
+    return options
+
+def create_database_engine(url: str = DATABASE_URL, pragmas: Optional[dict] = None, **overrides) -> Engine:
+    """Engine with this app's pool settings, and SQLite pragmas applied to each new connection"""
+    options = engine_options(url)
+    options.update(overrides)
+    engine = create_engine(url, **options)
+
+    if make_url(url).get_backend_name() == "sqlite":
+        pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
 
-# Enable foreign key constraints for SQLite
-if "sqlite" in DATABASE_URL:
-    @event.listens_for(engine, "connect")
-    def set_sqlite_pragma(dbapi_connection, connection_record):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
-        cursor.close()
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    if METRICS_ENABLED:
+        instrument_engine(engine)
+    return engine
+
+engine = create_database_engine()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -30,7 +87,45 @@ def get_db():
         db.close()
 
 def init_database():
+    # Every model module has to be imported so its tables are registered on Base
+    import auth.models, documents.models, processing.models, search.models, users.models  # noqa: F401
     Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+
+def upgrade_schema(bind: Engine) -> List[str]:
+    """
+    Add the columns and indexes an older database is missing - returns what was added
+
+    create_all() only makes tables that don't exist yet, so a database from
+    before content_hash, codec etc. would otherwise fail on the first query.
+    Existing rows get NULL, or the column's server default if it's required.
+    """
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+    added = []
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                definition = f"{column.name} {column.type.compile(dialect=bind.dialect)}"
+                if not column.nullable:
+                    # Only possible with a default for the existing rows to take
+                    if column.server_default is None or not isinstance(column.server_default.arg, str):
+                        raise RuntimeError(f"{table.name}.{column.name} is required and existing rows have no value - migrate it by hand")
+                    default = column.server_default.arg.replace("'", "''")
+                    definition += f" NOT NULL DEFAULT '{default}'"
+                connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {definition}")
+                added.append(f"{table.name}.{column.name}")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+                    added.append(index.name)
+    return added
 
 def drop_database():
     Base.metadata.drop_all(bind=engine)
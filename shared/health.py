@@ -0,0 +1,62 @@
+"""
+Liveness and readiness checks
+
+/health/live only says the process is up and its event loop is answering.
+/health/ready actually touches what a request needs - a SELECT 1 on a pooled
+connection and a write in the storage directory - and fails while the
+process is draining, so a load balancer takes it out before it goes away.
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Dict
+from sqlalchemy import text
+from shared.utils import run_blocking
+from config import HEALTH_CHECK_TIMEOUT
+
+_draining = threading.Event()
+
+def start_draining():
+    """The process has been told to stop - readiness fails from now on"""
+    _draining.set()
+
+def is_draining() -> bool:
+    return _draining.is_set()
+
+
+def check_database(engine) -> dict:
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    return {}
+
+def check_storage(directory: str) -> dict:
+    # A real write - exists() is still true on a full or read-only disk
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=".health-"):
+        pass
+    return {"free_bytes": shutil.disk_usage(directory).free}
+
+
+async def _run_check(check: Callable[..., dict], *args) -> dict:
+    started = time.perf_counter()
+    try:
+        details = await asyncio.wait_for(run_blocking(check, *args), HEALTH_CHECK_TIMEOUT)
+        result = {"ok": True, **details}
+    except asyncio.TimeoutError:
+        result = {"ok": False, "error": f"timed out after {HEALTH_CHECK_TIMEOUT}s"}
+    except Exception as e:
+        result = {"ok": False, "error": str(e) or type(e).__name__}
+    result["ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+async def readiness(engine, upload_dir: str) -> Dict[str, dict]:
+    """Run the dependency checks side by side - returns {name: {"ok": ..., "ms": ...}}"""
+    database, storage = await asyncio.gather(
+        _run_check(check_database, engine),
+        _run_check(check_storage, upload_dir),
+    )
+    return {"database": database, "storage": storage}
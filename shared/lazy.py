@@ -0,0 +1,66 @@
+"""
+Deferred imports for heavy optional packages
+
+    np = optional_import("numpy")   # None if numpy isn't installed, else a stand-in
+    PyPDF2 = lazy_import("PyPDF2")  # Required - an ImportError would surface at first use
+
+Whether the package is installed is checked straight away (find_spec only
+looks at the path, it doesn't import anything), so `np is not None` works as
+before. The import itself waits for the first attribute looked up, which
+keeps NumPy & co. out of processes that never use them - the API's startup,
+CLI scripts and workers that only handle PDFs.
+"""
+import importlib
+import importlib.util
+from types import ModuleType
+from typing import List, Optional
+
+# Every stand-in made so far, for load_all()
+_lazy_modules: List["LazyModule"] = []
+
+
+class LazyModule(ModuleType):
+    """Stand-in that imports the real module the first time it's used"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._module = None
+        _lazy_modules.append(self)
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            self._module = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attribute: str):
+        # Only called for what ModuleType itself doesn't have
+        return getattr(self._load(), attribute)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded yet"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def load_all():
+    """
+    Import everything that's been deferred so far
+
+    For serve.py: workers forked after this share the pages instead of each
+    importing NumPy & co. on its first request.
+    """
+    for module in _lazy_modules:
+        module._load()
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def optional_import(name: str) -> Optional[LazyModule]:
+    """A lazily imported module, or None if it isn't installed"""
+    try:
+        if importlib.util.find_spec(name) is None:
+            return None
+    except (ImportError, ValueError):
+        return None
+    return LazyModule(name)
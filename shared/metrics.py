@@ -0,0 +1,320 @@
+import bisect
+import contextvars
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from shared.utils import run_blocking
+from config import METRICS_ENABLED, PROFILE_REQUESTS, PROFILE_SAMPLE_RATE, PROFILE_MIN_DURATION_MS, PROFILE_DIR
+
+# Seconds. Uploads run from a few ms (tiny CSV) to seconds (big PDF on a slow disk)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class Counter:
+    """A Prometheus counter, optionally split by labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """A Prometheus histogram - cumulative buckets, sum and count per label set"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: [count in each bucket (+Inf last), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def exposition(self) -> str:
+        """Everything in the Prometheus text format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "docflow_http_request_duration_seconds", "Time to handle a request, by route",
+    ("method", "route", "status")
+))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "docflow_stage_duration_seconds", "Time spent in each instrumented stage (upload.size_check, upload.db_commit, ...)",
+    ("stage",)
+))
+DB_QUERY_LATENCY = REGISTRY.register(Histogram(
+    "docflow_db_query_duration_seconds", "Time for one SQL statement"
+))
+DB_QUERIES_PER_REQUEST = REGISTRY.register(Histogram(
+    "docflow_db_queries_per_request", "SQL statements run while handling one request", ("route",),
+    buckets=QUERY_COUNT_BUCKETS
+))
+PROFILES_WRITTEN = REGISTRY.register(Counter(
+    "docflow_profiles_written_total", "Request profiles dumped to PROFILE_DIR"
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "docflow_cache_requests_total", "Cache lookups by what they found - result is local, redis or miss",
+    ("cache", "result")
+))
+CACHE_EVICTIONS = REGISTRY.register(Counter(
+    "docflow_cache_evictions_total", "Entries pushed out of the in-process cache to stay under CACHE_MAX_ENTRIES"
+))
+
+
+class RequestMetrics:
+    """What one request has spent its time on, shared with the I/O pool threads it uses"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.query_count = 0
+        self.query_time = 0.0
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_query(self, seconds: float):
+        with self._lock:
+            self.query_count += 1
+            self.query_time += seconds
+
+    def server_timing(self, total: float) -> str:
+        """Server-Timing header value - browsers' dev tools draw it next to the request"""
+        entries = [f"total;dur={total * 1000:.1f}",
+                   f'db;dur={self.query_time * 1000:.1f};desc="{self.query_count} queries"']
+        for stage, seconds in self.stages.items():
+            entries.append(f"{stage.replace('.', '-')};dur={seconds * 1000:.1f}")
+        return ", ".join(entries)
+
+
+# Set by the middleware for the length of a request. run_blocking copies the context
+# into the I/O pool, so spans and queries on those threads land on the right request.
+_current_request: contextvars.ContextVar[Optional[RequestMetrics]] = contextvars.ContextVar("request_metrics", default=None)
+
+
+def current_request_metrics() -> Optional[RequestMetrics]:
+    return _current_request.get()
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block - goes into the stage histogram and the current request's Server-Timing"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+        request = _current_request.get()
+        if request is not None:
+            request.add_stage(stage, elapsed)
+
+
+def instrument_engine(engine: Engine):
+    """Count and time every statement the engine runs"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_QUERY_LATENCY.observe(elapsed)
+        request = _current_request.get()
+        if request is not None:
+            request.add_query(elapsed)
+
+    # A failed statement never gets to after_cursor_execute
+    @event.listens_for(engine, "handle_error")
+    def drop_query_timer(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+_profiling = threading.Lock()  # cProfile can only watch one request at a time
+# Requests this process is handling now, and how many others shared the loop with the one being profiled
+_in_flight = 0
+_profile_overlap = 0
+
+
+def _should_profile(headers: Dict[bytes, bytes]) -> bool:
+    if PROFILE_REQUESTS == "off":
+        return False
+    if headers.get(b"x-profile") == b"1":
+        return True
+    return PROFILE_REQUESTS == "sample" and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _route_label(scope) -> str:
+    # FastAPI puts the matched route in the scope - use its template so /documents/1 and /documents/2 share a series
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Times every request and fills in its RequestMetrics
+
+    Adds a Server-Timing header (total, DB time and query count, and each
+    span) and, when profiling is switched on, runs the request under
+    cProfile and dumps it to PROFILE_DIR if it was slow enough.
+
+    The profile is of the event loop thread for as long as the request
+    runs, not of the request alone: every other request the loop served in
+    that window is in it too. <id>.json next to the .prof says how many
+    there were (concurrent_requests), so a busy profile isn't pinned on
+    the one slow request. Time on the I/O pool shows up as the awaits that
+    waited for it - the spans cover that part.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        global _in_flight, _profile_overlap
+        metrics = RequestMetrics()
+        token = _current_request.set(metrics)
+        headers = dict(scope.get("headers") or [])
+        profiler = profile_id = None
+        _in_flight += 1
+        if _profiling.locked():
+            _profile_overlap += 1  # Will show up in someone else's profile
+        elif _should_profile(headers) and _profiling.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profile_id = f"{int(time.time() * 1000)}-{os.getpid()}-{random.getrandbits(32):08x}"
+            _profile_overlap = _in_flight - 1  # Already running when this one started
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                extra = [(b"server-timing", metrics.server_timing(time.perf_counter() - started).encode())]
+                if profile_id is not None:
+                    extra.append((b"x-profile-id", profile_id.encode()))
+                message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        try:
+            if profiler is not None:
+                profiler.enable()
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _in_flight -= 1
+            elapsed = time.perf_counter() - started
+            _current_request.reset(token)
+            route = _route_label(scope)
+            REQUEST_LATENCY.observe(elapsed, method=scope["method"], route=route, status=status)
+            DB_QUERIES_PER_REQUEST.observe(metrics.query_count, route=route)
+            if profiler is not None:
+                profiler.disable()
+                details = {
+                    "method": scope["method"],
+                    "route": route,
+                    "status": status,
+                    "duration_ms": round(elapsed * 1000, 2),
+                    "concurrent_requests": _profile_overlap,
+                }
+                _profiling.release()
+                if elapsed * 1000 >= PROFILE_MIN_DURATION_MS:
+                    await run_blocking(_dump_profile, profiler, profile_id, details)
+
+
+def _dump_profile(profiler: cProfile.Profile, profile_id: str, details: dict):
+    # Read with: python -m pstats <file>, or snakeviz
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), "w") as f:
+        json.dump(details, f)
+    PROFILES_WRITTEN.inc()
@@ -0,0 +1,63 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from config import BLOCKING_IO_WORKERS
+
+# One shared pool for all blocking calls made from async handlers.
+# Bounded on purpose - if the disk or DB falls behind, requests queue here
+# instead of piling up an unbounded number of threads.
+# Made on first use, and again after a shutdown, so the app can start more than once in a process.
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _get_blocking_executor() -> ThreadPoolExecutor:
+    global _blocking_executor
+    with _executor_lock:
+        if _blocking_executor is None:
+            _blocking_executor = ThreadPoolExecutor(
+                max_workers=BLOCKING_IO_WORKERS,
+                thread_name_prefix="docflow-io"
+            )
+        return _blocking_executor
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking function on the I/O pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context vars over (per-request metrics), like asyncio.to_thread does
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_get_blocking_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+def shutdown_blocking_executor():
+    """Wait for queued blocking work to finish - called on app shutdown, blocks until it has"""
+    global _blocking_executor
+    with _executor_lock:
+        executor, _blocking_executor = _blocking_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+# Crockford's base32 - no I, L, O or U, so IDs are easy to read back
+_ULID_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+def new_ulid() -> str:
+    """
+    Unique, time-ordered ID (ULID): 48-bit millisecond timestamp + 80 random bits
+
+    Needs no coordination between processes or machines and no DB round-trip,
+    and sorts lexically by creation time (to the millisecond).
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), "big")
+    chars = []
+    for _ in range(26):
+        chars.append(_ULID_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+def original_filename(stored_filename: str) -> str:
+    # Stored names are "<26 char ULID>_<name>" - give the client back just the name
+    prefix, sep, name = stored_filename.partition("_")
+    return name if sep and len(prefix) == 26 and name else stored_filename
@@ -0,0 +1,169 @@
+"""
+Content sniffing - what an upload's first few KB say it really is
+
+Only a bounded prefix is ever looked at, through a memoryview, so checking
+costs microseconds whatever the file size and nothing gets copied.
+"""
+import re
+import struct
+import zlib
+from typing import FrozenSet, List, Optional, Tuple
+
+# How much of the upload the sniffers get to see
+SNIFF_SIZE = 8 * 1024
+
+PDF = "application/pdf"
+DOC = "application/msword"
+XLS = "application/vnd.ms-excel"
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV = "text/csv"
+
+# Readers accept junk before the header, so look in the first 1KB like Acrobat does
+_PDF_HEADER = re.compile(rb"%PDF-")
+PDF_HEADER_WINDOW = 1024
+
+OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"  # Old Office (.doc/.xls) compound file
+
+ZIP_LOCAL_HEADER = b"PK\x03\x04"
+_ZIP_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")  # Fixed 30 bytes before the entry name
+_ZIP_CENTRAL_HEADER = struct.Struct("<4s6H3I5H2I")  # Central directory entry, 46 bytes before the name
+_ZIP_END = struct.Struct("<4s4H2IH")                 # End of central directory record, 22 bytes
+_ZIP_END_SIGNATURE = re.compile(rb"PK\x05\x06")
+_ZIP_CENTRAL_SIGNATURE = b"PK\x01\x02"
+_ZIP_DATA_DESCRIPTOR = b"PK\x07\x08"
+_ZIP_DATA_DESCRIPTOR_FLAG = 0x08
+
+# Part-name prefixes and [Content_Types].xml markers that give away which Office format a zip is
+_OOXML_PARTS = ((b"word/", DOCX), (b"xl/", XLSX))
+_OOXML_CONTENT_TYPES = ((b"wordprocessingml", DOCX), (b"spreadsheetml", XLSX))
+_BOTH_OOXML = frozenset({DOCX, XLSX})
+
+_NUL = re.compile(rb"\x00")
+
+
+def _part_type(name: bytes) -> Optional[str]:
+    for prefix, mime_type in _OOXML_PARTS:
+        if name.startswith(prefix):
+            return mime_type
+    return None
+
+
+def _content_types_type(data: memoryview, method: int) -> Optional[str]:
+    """The main part's format from [Content_Types].xml (Office writes it first)"""
+    try:
+        # Raw deflate; a truncated stream still gives us what's there
+        text = zlib.decompressobj(-15).decompress(data, SNIFF_SIZE) if method == 8 else data.tobytes()
+    except zlib.error:
+        return None
+    for marker, mime_type in _OOXML_CONTENT_TYPES:
+        if marker in text:
+            return mime_type
+    return None
+
+
+def _central_directory(head: memoryview) -> Optional[List[Tuple[bytes, int]]]:
+    """(name, local header offset) for every entry, if the whole zip fits in the prefix"""
+    ends = list(_ZIP_END_SIGNATURE.finditer(head))
+    if not ends or ends[-1].start() + _ZIP_END.size > len(head):
+        return None
+    _, _, _, _, count, size, offset, _ = _ZIP_END.unpack_from(head, ends[-1].start())
+    if offset + size > len(head):
+        return None
+
+    entries = []
+    for _ in range(count):
+        if offset + _ZIP_CENTRAL_HEADER.size > len(head):
+            return None
+        fields = _ZIP_CENTRAL_HEADER.unpack_from(head, offset)
+        if fields[0] != _ZIP_CENTRAL_SIGNATURE:
+            return None
+        name_length, extra_length, comment_length = fields[10:13]
+        name_start = offset + _ZIP_CENTRAL_HEADER.size
+        entries.append((head[name_start:name_start + name_length].tobytes(), fields[16]))
+        offset = name_start + name_length + extra_length + comment_length
+    return entries
+
+
+def _local_entry(head: memoryview, offset: int):
+    """(flags, method, compressed size, name, data start) of the local header at offset"""
+    (_, _, flags, method, _, _, _, compressed_size, _,
+     name_length, extra_length) = _ZIP_LOCAL_HEADER.unpack_from(head, offset)
+    name_start = offset + _ZIP_LOCAL_HEADER.size
+    name = head[name_start:name_start + name_length].tobytes()
+    return flags, method, compressed_size, name, name_start + name_length + extra_length
+
+
+def _ooxml_types(head: memoryview) -> FrozenSet[str]:
+    """
+    Which Office Open XML formats a zip prefix could be
+
+    A small zip is all in view, central directory included, so its entry list
+    settles it. Otherwise walk the local file headers: entry names usually give
+    it away, failing that [Content_Types].xml lists the main part's content
+    type. Reaching the central directory means every entry has been seen, so
+    a zip with none of Office's parts is no Office file. Only when the prefix
+    runs out mid-entry (or at a streamed entry) do both stay possible.
+    """
+    entries = _central_directory(head)
+    if entries is not None:
+        for name, _ in entries:
+            mime_type = _part_type(name)
+            if mime_type:
+                return frozenset({mime_type})
+        for name, offset in entries:
+            if name == b"[Content_Types].xml" and offset + _ZIP_LOCAL_HEADER.size <= len(head) \
+                    and head[offset:offset + 4] == ZIP_LOCAL_HEADER:
+                _, method, compressed_size, _, data_start = _local_entry(head, offset)
+                mime_type = _content_types_type(head[data_start:data_start + compressed_size], method)
+                if mime_type:
+                    return frozenset({mime_type})
+        return frozenset()
+
+    offset = 0
+    while offset + _ZIP_LOCAL_HEADER.size <= len(head):
+        signature = head[offset:offset + 4].tobytes()
+        if signature != ZIP_LOCAL_HEADER:
+            # The central directory after the last entry, or something that isn't a zip at all
+            return frozenset()
+        flags, method, compressed_size, name, data_start = _local_entry(head, offset)
+        mime_type = _part_type(name)
+        if mime_type:
+            return frozenset({mime_type})
+        if name == b"[Content_Types].xml":
+            data = head[data_start:data_start + compressed_size] if compressed_size else head[data_start:]
+            mime_type = _content_types_type(data, method)
+            if mime_type:
+                return frozenset({mime_type})
+
+        offset = data_start + compressed_size
+        if flags & _ZIP_DATA_DESCRIPTOR_FLAG:
+            if not compressed_size:
+                # Streamed zips put sizes after the data - no way to find the next header from here
+                return _BOTH_OOXML
+            # CRC and sizes follow the data, with or without their own signature
+            offset += 16 if head[offset:offset + 4] == _ZIP_DATA_DESCRIPTOR else 12
+
+    return _BOTH_OOXML
+
+
+def sniff_content_types(head) -> FrozenSet[str]:
+    """Every allowed MIME type the bytes could be (empty if none)"""
+    head = memoryview(head)[:SNIFF_SIZE]
+
+    if head[:len(OLE2_MAGIC)] == OLE2_MAGIC:
+        # Telling .doc from .xls means reading the compound file's directory - not worth it here
+        return frozenset({DOC, XLS})
+    if head[:len(ZIP_LOCAL_HEADER)] == ZIP_LOCAL_HEADER:
+        return _ooxml_types(head)
+    if _PDF_HEADER.search(head, 0, PDF_HEADER_WINDOW):
+        return frozenset({PDF})
+    # Anything with NUL bytes is binary, not CSV
+    if not _NUL.search(head):
+        return frozenset({CSV})
+    return frozenset()
+
+
+def content_matches(content_type: str, head) -> bool:
+    """Do the first bytes of an upload fit its declared type"""
+    return content_type in sniff_content_types(head)
@@ -0,0 +1,181 @@
+import os
+import statistics
+import tempfile
+import zipfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from shared.database import Base
+from auth.models import User
+from documents.models import Document
+from processing.models import DocumentProfile, ProcessingJob
+import processing.analyser as analyser
+
+def make_xlsx(path, rows):
+    """Bare-bones .xlsx - first sheet only, strings shared, numbers and booleans inline"""
+    strings, sheet_rows = [], []
+    for r, row in enumerate(rows, start=1):
+        cells = []
+        for c, value in enumerate(row):
+            ref = f"{chr(65 + c)}{r}"
+            if value is None:
+                continue  # Excel leaves empty cells out
+            if isinstance(value, bool):
+                cells.append(f'<c r="{ref}" t="b"><v>{int(value)}</v></c>')
+            elif isinstance(value, (int, float)):
+                cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+            else:
+                strings.append(value)
+                cells.append(f'<c r="{ref}" t="s"><v>{len(strings) - 1}</v></c>')
+        sheet_rows.append(f'<row r="{r}">{"".join(cells)}</row>')
+
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("xl/sharedStrings.xml",
+                         f'<sst {ns}>' + "".join(f"<si><t>{s}</t></si>" for s in strings) + "</sst>")
+        archive.writestr("xl/worksheets/sheet1.xml",
+                         f'<worksheet {ns}><sheetData>{"".join(sheet_rows)}</sheetData></worksheet>')
+
+def check_csv_profile():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "people.csv")
+        ages = [20 + (i * 7) % 50 for i in range(1000)]
+        with open(path, "w") as f:
+            f.write("age,score,name,active,joined\n")
+            for i, age in enumerate(ages):
+                score = "" if i % 10 == 0 else f"{i / 3:.3f}"
+                f.write(f"{age},{score},person {i % 100},{'true' if i % 4 else 'false'},2024-02-{i % 28 + 1:02d}\n")
+
+        # Small chunks so the running stats get merged many times
+        profile = analyser.profile_file(path, "text/csv", chunk_rows=64)
+        columns = {column["name"]: column for column in profile["columns"]}
+        assert profile["row_count"] == 1000 and profile["column_count"] == 5
+
+        age = columns["age"]
+        assert age["type"] == "integer" and age["min"] == min(ages) and age["max"] == max(ages)
+        assert abs(age["mean"] - statistics.mean(ages)) < 1e-9
+        assert abs(age["variance"] - statistics.variance(ages)) < 1e-6
+        assert abs(age["distinct_approx"] - 50) <= 3
+        assert age["quantiles"]["p5"] <= age["quantiles"]["p50"] <= age["quantiles"]["p95"]
+
+        score = columns["score"]
+        assert score["type"] == "float" and score["null_count"] == 100
+
+        assert columns["name"]["type"] == "string" and abs(columns["name"]["distinct_approx"] - 100) <= 6
+        assert columns["active"]["type"] == "boolean" and columns["active"]["true_count"] == 750
+        assert columns["joined"]["type"] == "date" and columns["joined"]["max"] == "2024-02-28"
+        return profile
+
+def test_csv_profile():
+    """Types, nulls and statistics match exact values, with and without numpy"""
+
+    # Test 1: whichever path is installed
+    with_numpy = check_csv_profile()
+    print("✅ CSV profile matches exact statistics")
+
+    # Test 2: pure Python path gives the same answers
+    saved = analyser.np
+    analyser.np = None
+    try:
+        without_numpy = check_csv_profile()
+    finally:
+        analyser.np = saved
+    assert with_numpy["row_count"] == without_numpy["row_count"]
+    print("✅ Pure Python path agrees")
+
+    # Test 3: a column that starts numeric and turns into text counts each value once
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "mixed.csv")
+        with open(path, "w") as f:
+            f.write("code\n")
+            f.write("".join(f"{i}\n" for i in range(500)))
+            f.write("".join(f"{i}\nx{i}\n" for i in range(500)))  # Same numbers again, now next to text
+        for numpy_module in (saved, None):
+            analyser.np = numpy_module
+            try:
+                code = analyser.profile_file(path, "text/csv", chunk_rows=100)["columns"][0]
+            finally:
+                analyser.np = saved
+            assert code["type"] == "string" and abs(code["distinct_approx"] - 1000) <= 40, code
+    print("✅ Numeric-then-text column isn't double counted")
+
+def test_quoted_and_ragged_csv():
+    """Quoted fields (csv.reader path), ragged rows and odd delimiters"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Test 1: a quoted field with a newline in it, and a row with an extra column
+        path = os.path.join(tmp, "notes.csv")
+        with open(path, "w") as f:
+            f.write("id,note\n1,plain\n2,\"two\nlines, with a comma\"\n3,last,extra\n4\n")
+        profile = analyser.profile_file(path, "text/csv")
+        assert profile["row_count"] == 4 and profile["column_count"] == 3
+        note = profile["columns"][1]
+        assert note["null_count"] == 1 and note["max"] == "two\nlines, with a comma"
+        assert profile["columns"][2]["null_count"] == 3
+        print("✅ Quoted newlines and ragged rows handled")
+
+        # Test 2: semicolon separated
+        path = os.path.join(tmp, "semi.csv")
+        with open(path, "w") as f:
+            f.write("a;b\n1;x\n2;y\n")
+        profile = analyser.profile_file(path, "text/csv")
+        assert [c["type"] for c in profile["columns"]] == ["integer", "string"]
+        print("✅ Delimiter detected")
+
+        # Test 3: line separators other than \n and \r\n are field content, quoted or not
+        for quote in ("", '"'):
+            path = os.path.join(tmp, "separators.csv")
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                f.write(f"name,note\r\nalice,{quote}a\u2028b{quote}\nbob,c\x0cd\nzed,e\x85f\x1cg\n")
+            profile = analyser.profile_file(path, "text/csv")
+            assert profile["row_count"] == 3 and profile["column_count"] == 2, profile
+            assert profile["columns"][1]["min"] == "a\u2028b" and profile["columns"][0]["max"] == "zed"
+        print("✅ Only \\n and \\r\\n end a row")
+
+def test_xlsx_profile_and_processing_step():
+    """Excel sheets profile like CSVs, and the processing step stores and reuses profiles"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sheet.xlsx")
+        make_xlsx(path, [["item", "qty", "paid"]] + [[f"item {i}", i, i % 2 == 0] for i in range(1, 11)]
+                  + [["missing qty", None, False]])
+
+        # Test 1: shared strings, numbers, booleans and gaps
+        profile = analyser.profile_file(path, analyser.XLSX_MIME_TYPE)
+        item, qty, paid = profile["columns"]
+        assert profile["row_count"] == 11
+        assert item["type"] == "string" and qty["type"] == "integer" and paid["type"] == "boolean"
+        assert qty["null_count"] == 1 and qty["max"] == 10 and qty["mean"] == 5.5
+        print("✅ XLSX profiled from the first sheet")
+
+        # Test 2: stored by the processing step, reused for identical content
+        engine = create_engine(f"sqlite:///{tmp}/test.db")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        try:
+            user = User(username="analyst", email="analyst@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            first, second = [
+                Document(user_id=user.id, filename=name, file_path=path, file_size=1,
+                         mime_type=analyser.XLSX_MIME_TYPE, content_hash="def456")
+                for name in ("a.xlsx", "b.xlsx")
+            ]
+            db.add_all([first, second])
+            db.commit()
+
+            analyser.profile_step(db, ProcessingJob(first.id, user.id, path, 1, analyser.XLSX_MIME_TYPE, "def456"))
+            missing = os.path.join(tmp, "not-there.xlsx")
+            analyser.profile_step(db, ProcessingJob(second.id, user.id, missing, 1, analyser.XLSX_MIME_TYPE, "def456"))
+
+            stored = {row.document_id: row for row in db.query(DocumentProfile)}
+            assert stored[first.id].row_count == stored[second.id].row_count == 11
+            assert stored[second.id].columns == stored[first.id].columns
+            print("✅ Profile stored and reused for identical content")
+        finally:
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_csv_profile()
+    test_quoted_and_ragged_csv()
+    test_xlsx_profile_and_processing_step()
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import tempfile
+import time
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from shared.database import Base
+from auth.models import User
+from documents.models import Document, DocumentStatus, PendingUpload
+from documents.service import DocumentService
+from documents.storage import ContentAddressedStorage
+from documents.compression import open_stored
+from documents.events import status_event_stream, wait_for_status_change
+from processing.workflow import process_document
+import processing.ingest
+import processing.tasks  # noqa: F401 - registers every processing step
+from test_streaming_upload import body_in_chunks
+
+def test_async_upload():
+    """202 uploads: stored raw, checked in the background, followed by long-poll and SSE"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        storage = ContentAddressedStorage(os.path.join(tmp, "uploads"))
+        get_storage = processing.ingest.get_storage
+        processing.ingest.get_storage = lambda: storage
+
+        def process_elsewhere(document_id):
+            # What a worker does, on its own session and thread
+            with Session() as worker_db:
+                return process_document(worker_db, document_id)
+
+        try:
+            user = User(username="hasty", email="hasty@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            service = DocumentService(db, storage=storage)
+            content = b"city,population\n" + b"".join(f"town{i},{i * 37}\n".encode() for i in range(2000))
+
+            def accept(filename, content_type, data):
+                return asyncio.run(service.accept_document_stream(user.id, filename, content_type, body_in_chunks(data, 4096)))
+
+            # Test 1: accepted as-is - temp file, no hash yet, waiting for ingest
+            document = accept("towns.csv", "text/csv", content)
+            assert document.status == DocumentStatus.UPLOADED and document.content_hash is None
+            assert document.file_path.endswith(".part") and os.path.getsize(document.file_path) == len(content)
+            assert db.query(PendingUpload).filter(PendingUpload.document_id == document.id).count() == 1
+            try:
+                service.get_stored_document(user.id, document.id)
+                assert False, "unchecked bytes were served"
+            except HTTPException as e:
+                assert e.status_code == 409
+            db.rollback()
+            print(f"✅ Accepted document {document.id} without checking or placing it, not downloadable yet")
+
+            # Test 2: a long-poll waiting on 'uploaded' wakes up when processing moves it on
+            async def poll_while_processing():
+                load = lambda: service.document_status(user.id, document.id)
+                waiter = asyncio.ensure_future(wait_for_status_change(load, document.id, DocumentStatus.UPLOADED, 30))
+                await asyncio.sleep(0.1)
+                started = time.perf_counter()
+                await asyncio.get_running_loop().run_in_executor(None, process_elsewhere, document.id)
+                status = await waiter
+                return status, time.perf_counter() - started
+            status, elapsed = asyncio.run(poll_while_processing())
+            assert status["status"] != DocumentStatus.UPLOADED and elapsed < 5
+            print(f"✅ Long-poll answered with '{status['status']}' {elapsed:.2f}s after processing started")
+
+            # Test 3: ingest placed the file in storage, hashed it, and the rest of processing ran
+            db.expire_all()
+            document = db.query(Document).get(document.id)
+            assert document.status == DocumentStatus.COMPLETED, document.processing_error
+            assert document.content_hash and document.file_path == str(storage.blob_path(document.content_hash, document.codec))
+            with open_stored(document.file_path, document.codec) as f:
+                assert f.read() == content
+            assert db.query(PendingUpload).count() == 0
+            assert service.get_stored_document(user.id, document.id).file_path == document.file_path
+            print("✅ Ingest sniffed, hashed and placed the file, then processing completed")
+
+            # Test 4: a spoofed file is accepted, then fails in the background and its bytes are dropped
+            spoofed = accept("invoice.pdf", "application/pdf", b"MZ\x90\x00" + os.urandom(4000))
+            temp_path = spoofed.file_path
+
+            async def follow():
+                load = lambda: service.document_status(user.id, spoofed.id)
+                stream = status_event_stream(load, spoofed.id, load())
+                worker = asyncio.get_running_loop().run_in_executor(None, process_elsewhere, spoofed.id)
+                events = [event async for event in stream]
+                await worker
+                return events
+            events = asyncio.run(follow())
+            assert events[0].startswith("event: status\n") and '"uploaded"' in events[0]
+            assert '"failed"' in events[-1] and "doesn't match" in events[-1]
+            assert not os.path.exists(temp_path)
+            db.expire_all()
+            assert db.query(PendingUpload).count() == 0
+            assert db.query(Document).get(spoofed.id).status == DocumentStatus.FAILED
+            print(f"✅ Event stream sent {len(events)} events, ending with the spoofed file failing")
+        finally:
+            processing.ingest.get_storage = get_storage
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_async_upload()
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import tempfile
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import auth.service
+from auth.service import create_access_token
+from shared.database import Base, get_db
+from main import app
+
+def request(method, path, body=None, token=None):
+    """One request through the whole app, returns (status, parsed JSON body)"""
+    messages = []
+    payload = json.dumps(body).encode() if body is not None else b""
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+    if token:
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+
+    async def receive():
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "root_path": "", "headers": headers, "client": ("127.0.0.1", 1234), "server": ("testserver", 80)}
+    asyncio.run(app(scope, receive, send))
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return messages[0]["status"], json.loads(body) if body else None
+
+def test_auth():
+    """Register, log in, use the token - and a repeat token is never verified twice"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+
+        def test_db():
+            db = Session()
+            try:
+                yield db
+            finally:
+                db.close()
+        app.dependency_overrides[get_db] = test_db
+
+        try:
+            # Test 1: register and log in - wrong passwords and unknown users get the same 401
+            status, user = request("POST", "/auth/register", {"username": "alice", "email": "alice@example.com", "password": "correct horse"})
+            assert status == 201, user
+            assert request("POST", "/auth/register", {"username": "alice", "email": "a2@example.com", "password": "whatever1"})[0] == 409
+            status, wrong = request("POST", "/auth/token", {"username": "alice", "password": "wrong password"})
+            status_unknown, unknown = request("POST", "/auth/token", {"username": "nobody", "password": "wrong password"})
+            assert status == status_unknown == 401 and wrong == unknown
+            status, login = request("POST", "/auth/token", {"username": "alice", "password": "correct horse"})
+            assert status == 200 and login["token_type"] == "bearer"
+            token = login["access_token"]
+            print(f"✅ Registered and logged in as user {user['user_id']}, bad logins all look alike")
+
+            # Test 2: routes need the token and see the right user
+            assert request("GET", "/documents/")[0] == 401
+            assert request("GET", "/documents/", token=token + "x")[0] == 401
+            assert request("GET", "/documents/", token=create_access_token(user["user_id"], ttl=-10)[0])[0] == 401
+            status, me = request("GET", "/auth/me", token=token)
+            assert status == 200 and me["username"] == "alice"
+            assert request("GET", "/users/me/usage", token=token)[1]["user_id"] == user["user_id"]
+            print("✅ Missing, tampered and expired tokens rejected; valid token reaches the user's routes")
+
+            # Test 3: a token already seen skips the signature check and the user query
+            decodes = []
+            decode = auth.service.jwt.decode
+            auth.service.jwt.decode = lambda *args, **kwargs: decodes.append(1) or decode(*args, **kwargs)
+            try:
+                for _ in range(5):
+                    assert request("GET", "/auth/me", token=token)[0] == 200
+            finally:
+                auth.service.jwt.decode = decode
+            assert decodes == []
+            print("✅ 5 requests with a known token, 0 signature checks")
+
+            # Test 4: password hashing happens on its own pool, not the event loop
+            threads = []
+            check = auth.service.check_password_hash
+            auth.service.check_password_hash = lambda *args: threads.append(threading.current_thread().name) or check(*args)
+            try:
+                request("POST", "/auth/token", {"username": "alice", "password": "correct horse"})
+            finally:
+                auth.service.check_password_hash = check
+            assert threads and all(name.startswith("docflow-hash") for name in threads)
+            print(f"✅ Password checked on {threads[0]}")
+        finally:
+            app.dependency_overrides.pop(get_db, None)
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_auth()
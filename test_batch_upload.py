@@ -0,0 +1,102 @@
+import asyncio
+import os
+import tempfile
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from fastapi import HTTPException
+from shared.database import Base
+from auth.models import User
+from documents.models import Document
+from documents.service import DocumentService, MAX_FILE_SIZE
+from documents.storage import ContentAddressedStorage
+from documents.streaming import MultipartFileStream
+from test_streaming_upload import body_in_chunks
+
+def make_batch_body(boundary: str, files) -> bytes:
+    """Multipart body with one "files" part per (filename, content_type, content)"""
+    body = b""
+    for filename, content_type, content in files:
+        body += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode() + content + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+def leftover_temp_files(root):
+    return [name for _, _, names in os.walk(root) for name in names if name.endswith(".part")]
+
+def test_batch_upload():
+    """Many files in one request - good ones stored together, bad ones reported and cleaned up"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        uploads = os.path.join(tmp, "uploads")
+        storage = ContentAddressedStorage(uploads)
+
+        try:
+            user = User(username="batcher", email="batch@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            service = DocumentService(db, storage=storage)
+
+            async def upload(body: bytes):
+                stream = MultipartFileStream(body_in_chunks(body, 4096), "multipart/form-data; boundary=xyz")
+                return await service.upload_documents_batch(user.id, stream.files())
+
+            report = b"%PDF-1.4\n" + os.urandom(20000)
+            files = [
+                ("report.pdf", "application/pdf", report),
+                ("notes.csv", "text/csv", b"a,b\n1,2\n"),
+                ("virus.pdf", "application/pdf", b"MZ\x90\x00" + os.urandom(5000)),
+                ("huge.pdf", "application/pdf", b"%PDF-1.4\n" + b"x" * MAX_FILE_SIZE),
+                ("run.exe", "application/x-msdownload", b"MZ"),
+                ("report again.pdf", "application/pdf", report),
+            ]
+
+            # Test 1: per-file results in request order
+            results = asyncio.run(upload(make_batch_body("xyz", files)))
+            assert [r["original_filename"] for r in results] == [name for name, _, _ in files]
+            assert [r["status_code"] for r in results] == [201, 201, 400, 413, 400, 201]
+            assert all("error" in r for r in results if r["status_code"] != 201)
+            print("✅ Per-file results: " + ", ".join(f"{r['original_filename']}={r['status_code']}" for r in results))
+
+            # Test 2: the good ones are in the DB and on disk, the bad ones left nothing behind
+            documents = db.query(Document).filter(Document.user_id == user.id).all()
+            assert sorted(doc.id for doc in documents) == sorted(r["document_id"] for r in results if r["status_code"] == 201)
+            for doc in documents:
+                with open(doc.file_path, "rb") as f:
+                    assert len(f.read()) == doc.file_size
+            assert leftover_temp_files(uploads) == []
+            # Same content twice is stored once
+            assert len({doc.file_path for doc in documents}) == 2
+            print("✅ Accepted files stored, rejected ones cleaned up")
+
+            # Test 3: a body that breaks half way keeps nothing from the batch
+            body = make_batch_body("xyz", files[:2])
+            try:
+                asyncio.run(upload(body[:len(body) - 40]))
+                assert False, "Truncated body accepted!"
+            except HTTPException as e:
+                assert e.status_code == 400
+            assert db.query(Document).count() == len(documents)
+            assert leftover_temp_files(uploads) == []
+            print("✅ Truncated body rejected without leaving files behind")
+
+            # Test 4: a folder's worth of small files, one insert and one commit
+            many = [(f"page_{i}.csv", "text/csv", f"n,v\n{i},{i * i}\n".encode()) for i in range(200)]
+            start = time.perf_counter()
+            results = asyncio.run(upload(make_batch_body("xyz", many)))
+            elapsed = time.perf_counter() - start
+            assert all(r["status_code"] == 201 for r in results)
+            assert len({r["document_id"] for r in results}) == 200
+            print(f"✅ 200 files in one batch in {elapsed:.2f}s")
+        finally:
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_batch_upload()
@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from benchmarks.compare import compare
+from benchmarks.payloads import PAYLOADS, make_payload
+from shared.validators import sniff_content_types
+
+def test_benchmark_suite():
+    """Synthetic uploads look real, a small run reports every phase, and compare spots a regression"""
+
+    # Test 1: payloads pass sniffing, come out near the size asked for, and differ by seed
+    for kind in PAYLOADS:
+        for size in (4 * 1024, 256 * 1024):
+            filename, content_type, content = make_payload(kind, size, seed=1)
+            assert content_type in sniff_content_types(content), (kind, size)
+            assert filename.endswith(PAYLOADS[kind][0])
+            assert 0.8 * size <= len(content) <= 1.2 * size, (kind, size, len(content))
+        assert make_payload(kind, 4096, seed=1) == make_payload(kind, 4096, seed=1)
+        assert make_payload(kind, 4096, seed=1)[2] != make_payload(kind, 4096, seed=2)[2]
+    print(f"✅ {', '.join(PAYLOADS)} payloads sniff as what they claim and hit their sizes")
+
+    # Test 2: a tiny in-process run covers every phase with no errors
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "report.json")
+        subprocess.run([sys.executable, "-m", "benchmarks.api_load", "--modes", "inprocess", "--concurrency", "1", "3",
+                        "--requests", "6", "--sizes-kb", "4", "64", "--output", output],
+                       check=True, capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        with open(output) as f:
+            report = json.load(f)
+    assert report["benchmark"] == "api_load" and "commit" in report
+    levels = report["results"]["inprocess"]
+    assert set(levels) == {"concurrency_1", "concurrency_3"}
+    for phases in levels.values():
+        assert set(phases) == {"upload", "list", "get", "delete"}
+        for phase in phases.values():
+            assert phase["errors"] == 0 and phase["count"] == 6, phase
+            assert phase["throughput_rps"] > 0 and phase["p50_ms"] <= phase["p95_ms"] <= phase["p99_ms"]
+    print(f"✅ Small run: upload p50 {levels['concurrency_3']['upload']['p50_ms']}ms at 3 clients")
+
+    # Test 3: compare flags slower, not faster, and ignores sub-millisecond noise
+    before = {"results": {"upload": {"p95_ms": 20.0, "throughput_rps": 100.0}, "get": {"p50_ms": 1.0}}}
+    after = {"results": {"upload": {"p95_ms": 30.0, "throughput_rps": 150.0}, "get": {"p50_ms": 1.3}}}
+    changes, regressions = compare(before, after, threshold=10)
+    assert len(changes) == 3
+    assert [change["figure"] for change in regressions] == ["upload.p95_ms"]
+    assert compare(after, before, threshold=10)[1][0]["figure"] == "upload.throughput_rps"
+    print("✅ compare reports 1 regression out of 3 changes")
+
+if __name__ == "__main__":
+    test_benchmark_suite()
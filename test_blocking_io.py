@@ -0,0 +1,36 @@
+import asyncio
+import threading
+import time
+from main import app
+from shared.utils import run_blocking
+
+def test_pool_survives_restart():
+    """Blocking work runs on the I/O pool, and the pool comes back when the app starts again"""
+
+    async def run():
+        for attempt in (1, 2):
+            async with app.router.lifespan_context(app):
+                # Test 1: handlers' blocking calls land on the pool's threads
+                name = await run_blocking(lambda: threading.current_thread().name)
+                assert name.startswith("docflow-io"), name
+
+                # Test 2: shutdown waits for queued work without stalling the event loop
+                slow = asyncio.ensure_future(run_blocking(time.sleep, 0.3))
+                await asyncio.sleep(0)
+                ticks = 0
+
+                async def heartbeat():
+                    nonlocal ticks
+                    while not slow.done():
+                        ticks += 1
+                        await asyncio.sleep(0.01)
+                beat = asyncio.ensure_future(heartbeat())
+            assert slow.done() and slow.exception() is None
+            await beat
+            assert ticks >= 10, ticks
+            print(f"✅ Lifespan {attempt}: work ran on {name}, loop kept ticking ({ticks}) through shutdown")
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_pool_survives_restart()
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+import shared.cache
+from shared.cache import LocalCache, LocalRedis, ReadThroughCache
+from shared.database import Base
+from auth.models import User
+from documents.models import DocumentStatus
+from documents.service import DocumentService
+from documents.storage import ContentAddressedStorage
+from processing.workflow import process_document
+import processing.tasks  # noqa: F401 - registers every processing step
+from test_streaming_upload import body_in_chunks
+
+def test_local_cache_bounds():
+    """The in-process tier never holds more than max_entries, and entries expire"""
+    local = LocalCache(max_entries=3, ttl=0.2)
+    for key in "abcd":
+        local.set(key, key.upper())
+    assert len(local) == 3 and local.get("a") is None  # Oldest pushed out
+
+    local.get("b")  # Touching b makes c the least recently used
+    local.set("e", "E")
+    assert local.get("c") is None and local.get("b") == "B"
+
+    time.sleep(0.25)
+    assert local.get("b") is None and local.get("e") is None
+    print("✅ LRU evicts the least recently used entry and TTL expires the rest")
+
+def test_read_through_cache():
+    """Details and listings come from the cache until an upload, a status change or a delete"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        queries = []
+        event.listen(engine, "before_cursor_execute", lambda *args: queries.append(1))
+
+        cache = ReadThroughCache(LocalCache(max_entries=100, ttl=60))
+        global_cache = shared.cache._cache
+        shared.cache._cache = cache  # What processing invalidates
+
+        try:
+            user = User(username="cached", email="cached@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            storage = ContentAddressedStorage(os.path.join(tmp, "uploads"))
+            service = DocumentService(db, storage=storage, cache=cache)
+
+            def upload(name):
+                return asyncio.run(service.upload_document_stream(
+                    user.id, name, "text/csv", body_in_chunks(f"name,value\n{name},1\n".encode(), 1024)
+                ))
+
+            first = upload("first.csv")
+
+            # Test 1: second read is a hit and runs no SQL at all
+            listed, _ = service.listing_page(user.id)
+            details = service.document_details(user.id, first.id)
+            queries.clear()
+            assert service.listing_page(user.id)[0] == listed
+            assert service.document_details(user.id, first.id) == details
+            assert queries == [] and cache.hits == 2 and cache.misses == 2
+            print(f"✅ Repeat reads served from cache with no queries: {cache.stats()}")
+
+            # Test 2: an upload shows up in the next listing
+            second = upload("second.csv")
+            assert [d["document_id"] for d in service.listing_page(user.id)[0]] == [second.id, first.id]
+            print("✅ Upload invalidated the cached listing")
+
+            # Test 3: processing moves the status on and the cached details follow
+            assert service.document_details(user.id, first.id)["status"] == DocumentStatus.UPLOADED
+            assert process_document(db, first.id) == DocumentStatus.COMPLETED
+            assert service.document_details(user.id, first.id)["status"] == DocumentStatus.COMPLETED
+            print("✅ Status change in processing invalidated the cached details")
+
+            # Test 4: deleted documents drop out
+            service.delete_document(user.id, second.id)
+            assert [d["document_id"] for d in service.listing_page(user.id)[0]] == [first.id]
+            print("✅ Delete invalidated the cached listing")
+        finally:
+            shared.cache._cache = global_cache
+            db.close()
+            engine.dispose()
+
+def test_redis_tier():
+    """Processes sharing Redis see each other's entries and invalidations, and survive Redis going away"""
+    redis = LocalRedis()
+    api = ReadThroughCache(LocalCache(max_entries=100, ttl=60), redis=redis)
+    worker = ReadThroughCache(LocalCache(max_entries=100, ttl=60), redis=redis)
+    loads = []
+
+    def load(value):
+        return lambda: loads.append(value) or {"status": value}
+
+    assert api.get_or_load("document", 1, "7", load("uploaded")) == {"status": "uploaded"}
+    assert worker.get_or_load("document", 1, "7", load("uploaded")) == {"status": "uploaded"}
+    assert loads == ["uploaded"]  # The worker got the API's entry from Redis
+    print("✅ Second process hit the shared Redis tier")
+
+    # The worker changes the document - the API's local copy must not survive that
+    worker.invalidate_user(1)
+    assert api.get_or_load("document", 1, "7", load("completed")) == {"status": "completed"}
+    print("✅ Invalidation in one process reached the other's local tier")
+
+    class DownRedis:
+        def __getattr__(self, name):
+            def fail(*args, **kwargs):
+                raise ConnectionError("Redis is down")
+            return fail
+    broken = ReadThroughCache(LocalCache(max_entries=100, ttl=60), redis=DownRedis())
+    assert broken.get_or_load("document", 1, "7", load("completed")) == {"status": "completed"}
+    broken.invalidate_user(1)
+    print("✅ Redis outage falls back to the database instead of failing")
+
+def test_enabled_only_with_shared_invalidation():
+    """Without Redis another process's changes can't reach this one, so the cache defaults to off"""
+    def enabled(**env) -> bool:
+        environment = {k: v for k, v in os.environ.items() if not k.startswith("CACHE_")}
+        environment.update(env)
+        result = subprocess.run([sys.executable, "-c", "import config; print(config.CACHE_ENABLED)"],
+                                env=environment, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip() == "True"
+
+    assert not enabled()
+    assert enabled(CACHE_REDIS_URL="redis://localhost:6379/1")
+    assert enabled(CACHE_ENABLED="true") and not enabled(CACHE_ENABLED="false", CACHE_REDIS_URL="redis://x")
+    print("✅ Cache on by default only with Redis, CACHE_ENABLED still overrides")
+
+if __name__ == "__main__":
+    test_local_cache_bounds()
+    test_read_through_cache()
+    test_redis_tier()
+    test_enabled_only_with_shared_invalidation()
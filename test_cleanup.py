@@ -0,0 +1,161 @@
+import os
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from shared.database import Base
+from auth.models import User
+from documents.models import DeletedFile
+from documents.service import DocumentService
+from documents.storage import ContentAddressedStorage, LocalFileStorage, lock_paths
+from documents.cleanup import Reaper, collect_garbage, reap_deleted_files
+from test_upload_service import MockUploadFile
+
+def pdf(seed: int, size: int = 50 * 1024) -> bytes:
+    return b"%PDF-1.4\n" + bytes([seed]) * size
+
+def make_old(path: str, age: float = 2 * 60 * 60):
+    then = time.time() - age
+    os.utime(path, (then, then))
+
+def stray_file(path: str, content: bytes) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+def test_tombstoned_delete():
+    """Deletes only tombstone the file - the reaper unlinks it, unless it's needed again"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+
+        try:
+            user = User(username="deleter", email="deleter@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            storage = ContentAddressedStorage(os.path.join(tmp, "uploads"))
+            service = DocumentService(db, storage=storage)
+
+            # Test 1: the row goes, the file waits for the reaper
+            content = pdf(1)
+            document = service.upload_document(user.id, MockUploadFile("one.pdf", content, "application/pdf"))
+            path = document.file_path
+            service.delete_document(user.id, document.id)
+            assert os.path.exists(path) and db.query(DeletedFile).count() == 1
+            assert reap_deleted_files(db, storage) == (1, len(content))
+            assert not os.path.exists(path) and db.query(DeletedFile).count() == 0
+            print(f"✅ Delete tombstoned the file, reaper freed {len(content)} bytes")
+
+            # Test 2: the same bytes uploaded again before the reaper runs keep the blob
+            document = service.upload_document(user.id, MockUploadFile("two.pdf", pdf(2), "application/pdf"))
+            service.delete_document(user.id, document.id)
+            again = service.upload_document(user.id, MockUploadFile("two again.pdf", pdf(2), "application/pdf"))
+            assert again.file_path == document.file_path
+            assert reap_deleted_files(db, storage) == (0, 0)
+            assert os.path.exists(again.file_path) and db.query(DeletedFile).count() == 0
+            print("✅ Blob taken back by a re-upload survives the reaper")
+
+            # Test 3: the background reaper runs as soon as a delete wakes it
+            reaper = Reaper(Session, storage, interval=60)
+            thread = threading.Thread(target=reaper.run, daemon=True)
+            thread.start()
+            try:
+                service.delete_document(user.id, again.id)
+                deadline = time.time() + 5
+                while os.path.exists(again.file_path) and time.time() < deadline:
+                    time.sleep(0.02)
+                assert not os.path.exists(again.file_path)
+            finally:
+                reaper.stop()
+                thread.join(5)
+            assert not thread.is_alive()
+            print("✅ Background reaper woken by the delete")
+        finally:
+            db.close()
+            engine.dispose()
+
+class RecordingSession:
+    """Just enough of a Session to see what lock_paths sends to a PostgreSQL database"""
+
+    def __init__(self, dialect: str):
+        self.dialect = dialect
+        self.statements = []
+
+    def get_bind(self):
+        return type("Bind", (), {"dialect": type("Dialect", (), {"name": self.dialect})})
+
+    def execute(self, statement, params):
+        self.statements.append((str(statement), params["path"]))
+
+def test_blob_path_locks():
+    """On PostgreSQL uploads and the reaper take the blob path's advisory lock; SQLite needs none"""
+
+    postgres = RecordingSession("postgresql")
+    lock_paths(postgres, ["/data/blobs/bb/2", "/data/blobs/aa/1", "/data/blobs/bb/2"])
+    assert [path for _, path in postgres.statements] == ["/data/blobs/aa/1", "/data/blobs/bb/2"]
+    assert all("pg_advisory_xact_lock" in statement for statement, _ in postgres.statements)
+
+    sqlite = RecordingSession("sqlite")
+    lock_paths(sqlite, ["/data/blobs/aa/1"])
+    assert sqlite.statements == []
+    print("✅ Blob paths locked once each, in order, on PostgreSQL only")
+
+def test_garbage_collection():
+    """The GC finds files the database doesn't know about, and rows whose file is gone"""
+
+    for backend in (ContentAddressedStorage, LocalFileStorage):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+            Base.metadata.create_all(bind=engine)
+            db = sessionmaker(bind=engine)()
+
+            try:
+                user = User(username="collector", email="collector@example.com", password_hash="x")
+                db.add(user)
+                db.commit()
+                storage = backend(os.path.join(tmp, "uploads"))
+                service = DocumentService(db, storage=storage)
+                kept = [service.upload_document(user.id, MockUploadFile(f"kept {n}.pdf", pdf(10 + n), "application/pdf"))
+                        for n in range(5)]
+                for document in kept:
+                    make_old(document.file_path)
+
+                # What a crash between placing and committing leaves behind, plus an abandoned temp file
+                orphans = [
+                    stray_file(os.path.join(tmp, "uploads", "blobs", "ab", "cd", "ab" + "0" * 62), b"x" * 1000),
+                    stray_file(os.path.join(tmp, "uploads", "user_1", "01ORPHAN_lost.pdf"), b"y" * 2000),
+                    stray_file(os.path.join(tmp, "uploads", "blobs", "incoming", ".upload-dead.part"), b"z" * 500),
+                ]
+                for path in orphans:
+                    make_old(path)
+                young = stray_file(os.path.join(tmp, "uploads", "user_1", "01INFLIGHT_new.pdf"), b"n" * 300)
+                os.remove(kept[0].file_path)
+
+                # Test 1: dry run reports without touching anything
+                report = collect_garbage(db, storage, batch_size=2, dry_run=True)
+                assert report.orphans == 3 and report.orphan_bytes == 3500 and report.bytes_reclaimed == 0
+                assert report.files_scanned == 8 and all(os.path.exists(path) for path in orphans)
+                assert report.missing_files == 1 and report.missing_document_ids == [kept[0].id]
+
+                # Test 2: the real run removes just the old orphans
+                report = collect_garbage(db, storage, batch_size=2)
+                assert report.files_removed == 3 and report.bytes_reclaimed == 3500
+                assert not any(os.path.exists(path) for path in orphans)
+                assert os.path.exists(young) and all(os.path.exists(document.file_path) for document in kept[1:])
+                assert db.query(DeletedFile).count() == 0
+                assert collect_garbage(db, storage).orphans == 0
+                print(f"✅ {backend.__name__}: GC reclaimed {report.bytes_reclaimed} bytes from 3 orphans, "
+                      f"flagged document {kept[0].id} as missing its file")
+            finally:
+                db.close()
+                engine.dispose()
+
+if __name__ == "__main__":
+    test_tombstoned_delete()
+    test_blob_path_locks()
+    test_garbage_collection()
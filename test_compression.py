@@ -0,0 +1,153 @@
+import asyncio
+import os
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from shared.database import Base
+from auth.models import User
+from documents.service import DocumentService
+from documents.storage import ContentAddressedStorage, StreamingFileWriter
+from documents.compression import FrameWriter, ZLIB, choose_codec, default_codec, open_stored
+from documents.cleanup import reap_deleted_files
+from processing.analyser import profile_file
+from benchmarks.payloads import make_payload
+from test_download import fetch
+from test_streaming_upload import body_in_chunks
+from test_upload_service import MockUploadFile
+
+def test_frames():
+    """Seekable frames read back byte for byte, from anywhere"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        content = b"".join(f"{i},row {i},{i * 0.5}\n".encode() for i in range(200000))
+        path = os.path.join(tmp, "data.zz")
+        with open(path, "wb") as f:
+            frames = FrameWriter(f, ZLIB, frame_size=64 * 1024)
+            for start in range(0, len(content), 10000):
+                frames.write(content[start:start + 10000])
+            frames.close()
+            frames.close()  # Second close is a no-op
+        assert os.path.getsize(path) == frames.stored_size < len(content) // 3
+
+        with open_stored(path, ZLIB) as stored:
+            assert stored.size == len(content)
+            assert stored.pread(len(content) + 100, 0) == content
+            # Reads that straddle frame boundaries, and ones past the end
+            for offset, size in ((0, 1), (65535, 2), (64 * 1024 * 3 - 10, 200000), (len(content) - 5, 100), (len(content), 10)):
+                assert stored.pread(size, offset) == content[offset:offset + size], (offset, size)
+            stored.seek(-6, os.SEEK_END)
+            assert stored.read() == content[-6:]
+        print(f"✅ {len(content)} bytes in {frames.stored_size} - random-access reads match")
+
+        # An empty file still gets a frame and a seek table
+        with open(path, "wb") as f:
+            FrameWriter(f, ZLIB).close()
+        with open_stored(path, ZLIB) as stored:
+            assert stored.size == 0 and stored.read() == b""
+        print("✅ Empty file round trips")
+
+def test_codec_choice():
+    """Only compressible types that actually compress get a codec"""
+    _, _, csv_content = make_payload("csv", 256 * 1024, seed=1)
+    _, _, pdf_content = make_payload("pdf", 256 * 1024, seed=1)
+    assert choose_codec("text/csv", csv_content) == default_codec()
+    assert choose_codec("application/pdf", pdf_content) is None
+    assert choose_codec("text/csv", os.urandom(64 * 1024)) is None  # Doesn't shrink enough to bother
+    assert choose_codec("text/csv", b"") is None
+    print(f"✅ CSV gets {default_codec()}, PDFs and incompressible data are stored raw")
+
+def test_compressed_documents():
+    """Uploads are compressed on the way in and read back transparently"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+
+        try:
+            user = User(username="squeezer", email="squeezer@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            storage = ContentAddressedStorage(os.path.join(tmp, "uploads"))
+            service = DocumentService(db, storage=storage)
+
+            # Test 1: streamed CSV is compressed, the row keeps the original size and hash
+            name, content_type, content = make_payload("csv", 2 * 1024 * 1024, seed=7)
+            document = asyncio.run(service.upload_document_stream(user.id, name, content_type, body_in_chunks(content, 65536)))
+            assert document.codec == default_codec() and document.file_size == len(content)
+            assert document.file_path.endswith(".zz" if document.codec == ZLIB else ".zst")
+            stored_size = os.path.getsize(document.file_path)
+            assert stored_size < len(content) // 2
+            print(f"✅ {len(content)} byte CSV stored in {stored_size} bytes ({document.codec})")
+
+            # Test 2: PDF and DOCX uploads are left alone
+            for kind in ("pdf", "docx"):
+                name, content_type, raw = make_payload(kind, 300 * 1024, seed=3)
+                raw_document = service.upload_document(user.id, MockUploadFile(name, raw, content_type))
+                assert raw_document.codec is None and os.path.getsize(raw_document.file_path) == len(raw)
+            print("✅ PDF and DOCX stored as they came")
+
+            # Test 3: downloads - whole file and a range, both in original bytes
+            status, headers, body, _ = fetch(document)
+            assert status == 200 and body == content and headers["content-length"] == str(len(content))
+            status, headers, body, _ = fetch(document, {"range": "bytes=1000000-1000099"})
+            assert status == 206 and body == content[1000000:1000100]
+            assert headers["content-range"] == f"bytes 1000000-1000099/{len(content)}"
+            # Zero-copy would send the compressed bytes, so it's never used for these
+            status, _, body, messages = fetch(document, extensions={"http.response.zerocopysend": {}})
+            assert body == content and all(m["type"] != "http.response.zerocopysend" for m in messages)
+            print("✅ Full and ranged downloads decompress on the fly")
+
+            # Test 4: the same bytes again share the compressed blob
+            copy = service.upload_document(user.id, MockUploadFile("copy.csv", content, "text/csv"))
+            assert copy.file_path == document.file_path and copy.codec == document.codec
+            print("✅ Duplicate upload shares the compressed blob")
+
+            # Test 5: the profiler reads straight through the compression
+            assert profile_file(copy.file_path, "text/csv", codec=copy.codec) == profile_file(
+                _raw_copy(tmp, content), "text/csv")
+            print("✅ Profile of the compressed file matches the raw one")
+
+            service.delete_document(user.id, document.id)
+            reap_deleted_files(db, storage)
+            assert os.path.exists(copy.file_path)
+            service.delete_document(user.id, copy.id)
+            reap_deleted_files(db, storage)
+            assert not os.path.exists(copy.file_path)
+            print("✅ Shared compressed blob removed with its last document")
+        finally:
+            db.close()
+            engine.dispose()
+
+def _raw_copy(tmp, content):
+    path = os.path.join(tmp, "raw.csv")
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+def test_adopt_compresses():
+    """Files filled some other way (resumable/202 uploads) get compressed while they're hashed"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _, _, content = make_payload("csv", 512 * 1024, seed=5)
+        path = _raw_copy(tmp, content)
+        writer = StreamingFileWriter.adopt(path, mime_type="text/csv")
+        writer.finish()
+        assert writer.codec == default_codec() and writer.size == len(content)
+        assert not os.path.exists(path) and writer.temp_path != path
+        with open_stored(writer.temp_path, writer.codec) as stored:
+            assert stored.read() == content
+        writer.abort()
+
+        # No MIME type (or an incompressible one) - the file is adopted as it is
+        path = _raw_copy(tmp, content)
+        writer = StreamingFileWriter.adopt(path)
+        writer.finish()
+        assert writer.codec is None and writer.temp_path == path
+        print("✅ Adopted CSV compressed in the hashing pass, others taken as they are")
+
+if __name__ == "__main__":
+    test_frames()
+    test_codec_choice()
+    test_compressed_documents()
+    test_adopt_compresses()
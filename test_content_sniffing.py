@@ -0,0 +1,115 @@
+import asyncio
+import os
+import tempfile
+import time
+import zipfile
+from io import BytesIO
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from shared.database import Base
+from shared.validators import sniff_content_types, content_matches, OLE2_MAGIC, DOC, DOCX, PDF, XLS, XLSX, CSV
+from auth.models import User
+from documents.models import Document
+from documents.service import DocumentService
+from documents.storage import LocalFileStorage
+
+def make_office_zip(parts) -> bytes:
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in parts:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+def test_sniffing():
+    """Real formats are recognised from their first bytes, spoofed ones aren't"""
+
+    docx = make_office_zip([("[Content_Types].xml", "<Types/>"), ("word/document.xml", "<w:document/>")])
+    xlsx = make_office_zip([("xl/workbook.xml", "<workbook/>")])
+    # Huge first entry hides the part names, but [Content_Types].xml still gives it away
+    padded = make_office_zip([
+        ("[Content_Types].xml", '<Types><Override ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>'),
+        ("docProps/thumbnail.jpeg", os.urandom(64 * 1024)),
+        ("word/document.xml", "<w:document/>"),
+    ])
+
+    # Test 1: each format maps to what it could be
+    assert sniff_content_types(b"%PDF-1.7\n...") == {PDF}
+    assert sniff_content_types(OLE2_MAGIC + b"\x00" * 100) == {DOC, XLS}
+    assert sniff_content_types(docx) == {DOCX}
+    assert sniff_content_types(xlsx) == {XLSX}
+    assert sniff_content_types(padded) == {DOCX}
+    assert sniff_content_types(b"name,age\nann,31\n") == {CSV}
+    print("✅ PDF, OLE2, DOCX, XLSX and CSV recognised")
+
+    # Test 2: mislabelled content is caught
+    assert not content_matches(PDF, b"MZ\x90\x00 not a pdf")
+    assert not content_matches(DOCX, xlsx)
+    assert not content_matches(CSV, b"\x7fELF\x02\x01\x01\x00")
+    assert not content_matches(XLS, docx)
+    # Any old zip isn't an Office file - small enough to see the central directory, or not
+    plain = make_office_zip([("evil.exe", "MZ" + "\x00" * 100), ("readme.txt", "hello")])
+    assert sniff_content_types(plain) == set() and not content_matches(DOCX, plain)
+    big_plain = make_office_zip([("readme.txt", "hello"), ("payload.bin", os.urandom(64 * 1024))])
+    assert sniff_content_types(big_plain[:4096]) == {DOCX, XLSX}  # Cut off mid-entry - can't tell yet
+    # Entries all in view but the central directory's end isn't - the walk runs into the directory
+    walked = make_office_zip([(f"notes/{n:03}-{'x' * 40}.txt", "note") for n in range(60)])
+    assert len(walked) > 8192 and walked.index(b"PK\x01\x02") < 8192 and not content_matches(XLSX, walked)
+    print("✅ Spoofed content rejected")
+
+    # Test 3: cost doesn't depend on file size - only the prefix is looked at
+    big = b"%PDF-1.4\n" + os.urandom(20 * 1024 * 1024)
+    start = time.perf_counter()
+    for _ in range(1000):
+        content_matches(PDF, big)
+    per_check = (time.perf_counter() - start) / 1000
+    assert per_check < 0.001
+    print(f"✅ Sniffing a 20MB upload takes {per_check * 1e6:.1f}µs")
+
+def test_spoofed_upload_never_reaches_storage():
+    """A mismatch is rejected before the storage writer is even opened"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+
+        class CountingStorage(LocalFileStorage):
+            opened = 0
+            def open_writer(self, user_id, max_size=None, **kwargs):
+                CountingStorage.opened += 1
+                return super().open_writer(user_id, max_size=max_size, **kwargs)
+
+        async def chunks(data, size=1000):
+            for i in range(0, len(data), size):
+                yield data[i:i + size]
+
+        try:
+            user = User(username="sniffer", email="sniff@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            service = DocumentService(db, storage=CountingStorage(os.path.join(tmp, "uploads")))
+
+            # Test 1: an executable named .pdf
+            try:
+                asyncio.run(service.upload_document_stream(user.id, "invoice.pdf", PDF, chunks(b"MZ" + os.urandom(20000))))
+                assert False, "Spoofed PDF accepted!"
+            except HTTPException as e:
+                assert e.status_code == 400
+                print(f"✅ Rejected: {e.detail}")
+            assert CountingStorage.opened == 0 and db.query(Document).count() == 0
+            print("✅ Nothing opened or written for the rejected upload")
+
+            # Test 2: the real thing, split over many small chunks, arrives intact
+            content = b"%PDF-1.4\n" + os.urandom(20000)
+            document = asyncio.run(service.upload_document_stream(user.id, "invoice.pdf", PDF, chunks(content)))
+            with open(document.file_path, "rb") as f:
+                assert f.read() == content
+            print("✅ Peeked bytes are written along with the rest")
+        finally:
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_sniffing()
+    test_spoofed_upload_never_reaches_storage()
@@ -1,5 +1,8 @@
 
-from shared.database import init_database, SessionLocal
+import tempfile
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+from shared.database import Base, init_database, upgrade_schema, SessionLocal
 from auth.models import User
 from documents.models import Document, DocumentStatus
 from werkzeug.security import generate_password_hash
@@ -81,5 +84,47 @@ def test_document_constraints():
     finally:
         db.close()
 
+def test_upgrade_old_database():
+    """A database made before the storage/processing columns existed is brought up to date in place"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/old.db")
+        with engine.begin() as connection:
+            # The original schema, with a user and a document in it
+            connection.exec_driver_sql(
+                "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(100) NOT NULL UNIQUE, "
+                "email VARCHAR(255) NOT NULL UNIQUE, password_hash VARCHAR(255) NOT NULL, created_at DATETIME)")
+            connection.exec_driver_sql(
+                "CREATE TABLE documents (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id), "
+                "filename VARCHAR(100) NOT NULL, file_path VARCHAR(500) NOT NULL, file_size INTEGER NOT NULL, "
+                "mime_type VARCHAR(50) NOT NULL, status VARCHAR(20) NOT NULL, uploaded_at DATETIME, processed_at DATETIME)")
+            connection.exec_driver_sql(
+                "CREATE TABLE upload_sessions (id VARCHAR(26) PRIMARY KEY, user_id INTEGER NOT NULL, filename VARCHAR(255) NOT NULL, "
+                "mime_type VARCHAR(50) NOT NULL, total_size INTEGER NOT NULL, chunk_size INTEGER NOT NULL, "
+                "temp_path VARCHAR(500) NOT NULL, created_at DATETIME)")
+            connection.exec_driver_sql("INSERT INTO upload_sessions VALUES ('S1', 1, 'a.pdf', 'application/pdf', 1, 1, '/tmp/x', NULL)")
+            connection.exec_driver_sql("INSERT INTO users VALUES (1, 'old', 'old@example.com', 'x', NULL)")
+            connection.exec_driver_sql(
+                "INSERT INTO documents VALUES (1, 1, 'old.pdf', 'uploads/user_1/old.pdf', 10, 'application/pdf', "
+                "'completed', '2024-01-01 00:00:00', NULL)")
+
+        Base.metadata.create_all(bind=engine)
+        added = upgrade_schema(engine)
+        assert {"documents.content_hash", "documents.codec", "documents.processing_error"} <= set(added), added
+        assert "ix_documents_user_uploaded" in added and "upload_sessions.state" in added
+        with engine.connect() as connection:
+            # Required column added with its default, so sessions from before it can still be completed
+            assert connection.exec_driver_sql("SELECT state FROM upload_sessions").scalar() == "open"
+        assert upgrade_schema(engine) == []
+
+        db = sessionmaker(bind=engine)()
+        document = db.query(Document).get(1)
+        assert document.file_path == "uploads/user_1/old.pdf" and document.content_hash is None and document.codec is None
+        assert "ix_documents_status_id" in {index["name"] for index in inspect(engine).get_indexes("documents")}
+        db.close()
+        engine.dispose()
+        print(f"✅ Old database upgraded in place: {len(added)} columns/indexes added, existing rows kept")
+
 if __name__ == "__main__":
     test_document_constraints()
+    test_upgrade_old_database()
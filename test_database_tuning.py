@@ -0,0 +1,68 @@
+import tempfile
+import threading
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+from shared.database import Base, create_database_engine, engine_options
+from auth.models import User
+from documents.models import Document
+
+def test_sqlite_tuning():
+    """Pragmas are applied on connect and concurrent writers don't trip over each other"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_database_engine(f"sqlite:///{tmp}/tuned.db")
+        try:
+            # Test 1: pragmas and pooling
+            with engine.connect() as conn:
+                pragmas = {name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                           for name in ("journal_mode", "synchronous", "busy_timeout", "foreign_keys")}
+            assert pragmas == {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 15000, "foreign_keys": 1}
+            assert isinstance(engine.pool, QueuePool)
+            print(f"✅ Connected with {pragmas}")
+
+            # Test 2: eight threads writing at once, no "database is locked"
+            Base.metadata.create_all(bind=engine)
+            Session = sessionmaker(bind=engine)
+            with Session() as db:
+                user = User(username="writer", email="writer@example.com", password_hash="x")
+                db.add(user)
+                db.commit()
+                user_id = user.id
+
+            errors = []
+            def write(n):
+                for i in range(25):
+                    with Session() as db:
+                        try:
+                            db.add(Document(user_id=user_id, filename=f"{n}_{i}.pdf", file_path=f"/x/{n}/{i}",
+                                            file_size=1, mime_type="application/pdf"))
+                            db.commit()
+                        except Exception as e:
+                            errors.append(e)
+            threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            with Session() as db:
+                assert not errors and db.query(Document).count() == 200
+            print("✅ 200 concurrent inserts from 8 threads, no lock errors")
+        finally:
+            engine.dispose()
+
+def test_engine_profiles():
+    """Each backend gets the pool settings that make sense for it"""
+
+    # Test 1: in-memory SQLite shares one connection (each new one would be an empty database)
+    assert engine_options("sqlite://")["poolclass"] is StaticPool
+    print("✅ In-memory SQLite uses a single shared connection")
+
+    # Test 2: PostgreSQL gets pre-ping, recycling and a statement timeout
+    options = engine_options("postgresql+psycopg2://docflow:secret@db/docflow")
+    assert options["pool_pre_ping"] and options["pool_recycle"] > 0
+    assert "statement_timeout" in options["connect_args"]["options"]
+    print("✅ PostgreSQL profile has pre-ping, recycle and statement timeout")
+
+if __name__ == "__main__":
+    test_sqlite_tuning()
+    test_engine_profiles()
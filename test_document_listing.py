@@ -0,0 +1,74 @@
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from fastapi import HTTPException
+from shared.database import Base
+from auth.models import User
+from documents.models import Document
+from documents.service import DocumentService
+
+def test_keyset_pagination():
+    """Page through documents with cursors - every row exactly once, newest first"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+
+        try:
+            user = User(username="lister", email="list@example.com", password_hash="x")
+            other = User(username="other", email="other@example.com", password_hash="x")
+            db.add_all([user, other])
+            db.commit()
+
+            # Inserted in one go, so most rows share the same uploaded_at second - the id tiebreak matters
+            statuses = ["uploaded", "completed", "failed"]
+            db.add_all([
+                Document(user_id=user.id, filename=f"doc_{i}.pdf", file_path=f"/tmp/{i}", file_size=i,
+                         mime_type="application/pdf", status=statuses[i % 3])
+                for i in range(25)
+            ])
+            db.add(Document(user_id=other.id, filename="not_mine.pdf", file_path="/tmp/x", file_size=1,
+                            mime_type="application/pdf"))
+            db.commit()
+
+            service = DocumentService(db, storage=object())
+
+            # Test 1: walking every page returns each of the user's documents once, newest first
+            seen, cursor, pages = [], None, 0
+            while True:
+                rows, cursor = service.list_documents_page(user.id, limit=7, cursor=cursor)
+                seen.extend(row.id for row in rows)
+                pages += 1
+                if not cursor:
+                    break
+            expected = [doc.id for doc in db.query(Document).filter(Document.user_id == user.id)
+                        .order_by(Document.uploaded_at.desc(), Document.id.desc())]
+            assert seen == expected
+            assert pages == 4
+            print(f"✅ {len(seen)} documents over {pages} pages, no gaps or repeats")
+
+            # Test 2: status filter pages the same way
+            seen, cursor = [], None
+            while True:
+                rows, cursor = service.list_documents_page(user.id, status="completed", limit=3, cursor=cursor)
+                assert all(row.status == "completed" for row in rows)
+                seen.extend(row.id for row in rows)
+                if not cursor:
+                    break
+            assert len(seen) == len(set(seen)) == 8
+            print("✅ Status-filtered pages are complete")
+
+            # Test 3: junk cursors are a client error
+            try:
+                service.list_documents_page(user.id, cursor="not-a-cursor")
+                assert False, "Bad cursor accepted!"
+            except HTTPException as e:
+                assert e.status_code == 400
+                print(f"✅ Bad cursor rejected: {e.detail}")
+        finally:
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_keyset_pagination()
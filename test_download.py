@@ -0,0 +1,103 @@
+import asyncio
+import os
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from fastapi import HTTPException
+from shared.database import Base
+from auth.models import User
+from documents.service import DocumentService
+from documents.storage import ContentAddressedStorage
+from documents.download import document_content_response, parse_range
+from test_upload_service import MockUploadFile
+
+def fetch(document, headers=None, method="GET", extensions=None):
+    """Run the response as an ASGI app and collect (status, headers, body, messages)"""
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        response = await document_content_response(document, headers or {}, method)
+        scope = {"type": "http", "method": method, "extensions": extensions or {}}
+        await response(scope, None, send)
+
+    asyncio.run(run())
+    start = messages[0]
+    response_headers = {key.decode(): value.decode() for key, value in start["headers"]}
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return start["status"], response_headers, body, messages
+
+def test_download():
+    """Full, partial and conditional downloads of a stored document"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+
+        try:
+            user = User(username="reader", email="reader@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            service = DocumentService(db, storage=ContentAddressedStorage(os.path.join(tmp, "uploads")))
+            content = b"%PDF-1.4\n" + os.urandom(600 * 1024)
+            document = service.upload_document(user.id, MockUploadFile("annual report.pdf", content, "application/pdf"))
+
+            # Test 1: whole file, in bounded chunks, with validators
+            status, headers, body, messages = fetch(document)
+            assert status == 200 and body == content
+            assert headers["content-length"] == str(len(content))
+            assert headers["etag"] == f'"{document.content_hash}"'
+            assert headers["accept-ranges"] == "bytes" and "last-modified" in headers
+            assert headers["content-disposition"] == 'inline; filename*=utf-8\'\'annual%20report.pdf'
+            assert len(messages) > 2 and max(len(m.get("body", b"")) for m in messages) <= 256 * 1024
+            print(f"✅ Full download in {len(messages) - 1} chunks, ETag {headers['etag'][:12]}...")
+
+            # Test 2: ranges - middle, open-ended, suffix
+            for header, expected in (("bytes=100-199", content[100:200]),
+                                     (f"bytes={len(content) - 10}-", content[-10:]),
+                                     ("bytes=-4", content[-4:])):
+                status, headers, body, _ = fetch(document, {"range": header})
+                assert status == 206 and body == expected
+                assert headers["content-length"] == str(len(expected))
+                assert headers["content-range"].endswith(f"/{len(content)}")
+            print("✅ Range requests return 206 with the right bytes")
+
+            # Test 3: unsatisfiable range, multi-range falls back to the whole file, stale If-Range too
+            try:
+                fetch(document, {"range": f"bytes={len(content)}-"})
+                assert False, "Range past the end accepted!"
+            except HTTPException as e:
+                assert e.status_code == 416 and e.headers["Content-Range"] == f"bytes */{len(content)}"
+            assert parse_range("bytes=0-1,5-9", len(content)) is None
+            status, _, body, _ = fetch(document, {"range": "bytes=0-9", "if-range": '"stale"'})
+            assert status == 200 and body == content
+            print("✅ 416 for ranges past the end, whole file when the range can't be used")
+
+            # Test 4: conditional GETs get a 304 without opening the file
+            os.rename(document.file_path, document.file_path + ".moved")
+            try:
+                for conditional in ({"if-none-match": headers["etag"]},
+                                    {"if-none-match": f'"other", W/{headers["etag"]}'},
+                                    {"if-modified-since": headers["last-modified"]}):
+                    status, not_modified, body, _ = fetch(document, conditional)
+                    assert status == 304 and body == b"" and not_modified["etag"] == headers["etag"]
+            finally:
+                os.rename(document.file_path + ".moved", document.file_path)
+            print("✅ Cached copies revalidate with 304 and no disk access")
+
+            # Test 5: HEAD has the headers and no body, and zero-copy is used when the server offers it
+            status, headers, body, _ = fetch(document, method="HEAD")
+            assert status == 200 and body == b"" and headers["content-length"] == str(len(content))
+            _, _, _, messages = fetch(document, {"range": "bytes=10-"}, extensions={"http.response.zerocopysend": {}})
+            assert messages[1]["type"] == "http.response.zerocopysend"
+            assert (messages[1]["offset"], messages[1]["count"]) == (10, len(content) - 10)
+            print("✅ HEAD works and zero-copy sends are used when available")
+        finally:
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_download()
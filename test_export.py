@@ -0,0 +1,113 @@
+import asyncio
+import io
+import json
+import os
+import tarfile
+import tempfile
+import zipfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from shared.database import Base, get_db
+from shared.cache import LocalCache, ReadThroughCache
+from auth.models import User
+from auth.service import create_access_token
+from documents.models import Document, DocumentStatus
+from documents.service import DocumentService
+from documents.storage import ContentAddressedStorage
+from documents.export import MANIFEST_NAME, export_archive
+from benchmarks.common import asgi_request
+from benchmarks.payloads import make_payload
+from test_streaming_upload import body_in_chunks
+from config import DOWNLOAD_CHUNK_SIZE
+from main import app
+
+def collect(archive_format, service, user_id, status=None):
+    """Run the export, returns (archive bytes, size of each piece sent)"""
+    async def run():
+        pieces = []
+        load_page = lambda cursor: service.export_page(user_id, status, cursor, limit=2)  # Small pages, so paging gets used
+        async for piece in export_archive(archive_format, load_page, {"user_id": user_id}):
+            pieces.append(piece)
+        return pieces
+    pieces = asyncio.run(run())
+    return b"".join(pieces), [len(piece) for piece in pieces]
+
+def test_export():
+    """A user's documents come back as a valid ZIP or tar, streamed in bounded pieces"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+
+        try:
+            owner = User(username="exporter", email="exporter@example.com", password_hash="x")
+            other = User(username="bystander", email="bystander@example.com", password_hash="x")
+            db.add_all([owner, other])
+            db.commit()
+            storage = ContentAddressedStorage(os.path.join(tmp, "uploads"))
+            service = DocumentService(db, storage=storage, cache=ReadThroughCache(LocalCache(100, 60), enabled=False))
+
+            files = {}
+            for kind, size in (("pdf", 3 * 1024 * 1024), ("docx", 200 * 1024), ("csv", 100 * 1024), ("csv", 5 * 1024)):
+                name, content_type, content = make_payload(kind, size, seed=len(files))
+                document = asyncio.run(service.upload_document_stream(owner.id, name, content_type, body_in_chunks(content, 65536)))
+                files[document.id] = (name, content, document)
+            name, content_type, content = make_payload("csv", 1024, seed=99)
+            asyncio.run(service.upload_document_stream(other.id, name, content_type, body_in_chunks(content, 65536)))
+
+            # Test 1: ZIP has every file byte for byte, docx stored, the rest deflated
+            data, pieces = collect("zip", service, owner.id)
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                assert archive.testzip() is None
+                manifest = json.loads(archive.read(MANIFEST_NAME))
+                assert manifest["document_count"] == 4 and manifest["missing"] == []
+                for entry in manifest["documents"]:
+                    name, content, _ = files[entry["document_id"]]
+                    assert archive.read(entry["path"]) == content and entry["filename"] == name
+                    compression = archive.getinfo(entry["path"]).compress_type
+                    assert compression == (zipfile.ZIP_STORED if name.endswith(".docx") else zipfile.ZIP_DEFLATED), name
+            print(f"✅ ZIP export: 4 documents + manifest, {len(data)} bytes for {sum(len(c) for _, c, _ in files.values())} in")
+
+            # Test 2: nothing bigger than a read chunk is ever held - a 3MB file goes out in pieces
+            assert max(pieces) <= DOWNLOAD_CHUNK_SIZE + 1024, max(pieces)
+            print(f"✅ Sent in {len(pieces)} pieces, largest {max(pieces)} bytes")
+
+            # Test 3: tar, filtered by status, and a file missing from disk is listed rather than breaking the archive
+            first, second = sorted(files)[:2]
+            db.query(Document).filter(Document.id.in_([first, second])).update({"status": DocumentStatus.COMPLETED})
+            db.commit()
+            os.remove(files[second][2].file_path)
+            data, _ = collect("tar", service, owner.id, status=DocumentStatus.COMPLETED)
+            with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+                manifest = json.load(archive.extractfile(MANIFEST_NAME))
+                assert [entry["document_id"] for entry in manifest["documents"]] == [first]
+                assert [entry["document_id"] for entry in manifest["missing"]] == [second]
+                assert archive.extractfile(manifest["documents"][0]["path"]).read() == files[first][1]
+            assert len(data) % tarfile.RECORDSIZE == 0
+            print("✅ tar export with ?status=completed, missing file noted in the manifest")
+
+            # Test 4: through the API - only the signed-in user's documents
+            def test_db():
+                session = Session()
+                try:
+                    yield session
+                finally:
+                    session.close()
+            app.dependency_overrides[get_db] = test_db
+            try:
+                token = create_access_token(other.id)[0]
+                status, body, _ = asyncio.run(asgi_request(app, "GET", "/documents/export?format=zip", headers={"Authorization": f"Bearer {token}"}))
+            finally:
+                app.dependency_overrides.pop(get_db, None)
+            assert status == 200
+            with zipfile.ZipFile(io.BytesIO(body)) as archive:
+                assert json.loads(archive.read(MANIFEST_NAME))["document_count"] == 1
+            print("✅ GET /documents/export only includes the caller's documents")
+        finally:
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_export()
@@ -0,0 +1,92 @@
+import os
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from shared.database import Base
+from auth.models import User
+from documents.models import Document
+from processing.models import DocumentText, ProcessingJob
+import processing.extractor as extractor
+
+def make_pdf(page_texts) -> bytes:
+    """Smallest valid PDF with one line of Helvetica text per page"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = b"BT /F1 12 Tf 72 720 Td (" + text.encode() + b") Tj ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % len(kids)
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+def test_pdf_extraction():
+    """Pages come out in order, serially or across the process pool, and are stored once"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "long.pdf")
+        pages = [f"Page number {i} of the report" for i in range(40)]
+        with open(path, "wb") as f:
+            f.write(make_pdf(pages))
+
+        # Test 1: serial path
+        assert [text.strip() for text in extractor.iter_pdf_pages(path)] == pages
+        print("✅ Serial extraction returns every page in order")
+
+        # Test 2: parallel path with small ranges, so several pool tasks are in flight
+        saved = (extractor.EXTRACTION_PROCESSES, extractor.EXTRACTION_PARALLEL_MIN_PAGES, extractor.EXTRACTION_PAGES_PER_TASK)
+        extractor.EXTRACTION_PROCESSES, extractor.EXTRACTION_PARALLEL_MIN_PAGES, extractor.EXTRACTION_PAGES_PER_TASK = 2, 10, 3
+        try:
+            assert [text.strip() for text in extractor.iter_pdf_pages(path)] == pages
+            print("✅ Pooled extraction returns every page in order")
+        finally:
+            extractor.shutdown_extraction_pool()
+            extractor.EXTRACTION_PROCESSES, extractor.EXTRACTION_PARALLEL_MIN_PAGES, extractor.EXTRACTION_PAGES_PER_TASK = saved
+
+        # Test 3: the character cap truncates
+        text, page_count, truncated = extractor.extract_pdf_text(path, max_chars=100)
+        assert page_count == 40 and truncated and len(text) <= 100 + 2 * 40
+        print("✅ Text capped at max_chars")
+
+        # Test 4: processing step stores text, and a duplicate upload reuses it without re-reading the file
+        engine = create_engine(f"sqlite:///{tmp}/test.db")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        try:
+            user = User(username="reader", email="reader@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            first, second = [
+                Document(user_id=user.id, filename=name, file_path=path, file_size=1,
+                         mime_type="application/pdf", content_hash="abc123")
+                for name in ("a.pdf", "b.pdf")
+            ]
+            db.add_all([first, second])
+            db.commit()
+
+            extractor.extract_text_step(db, ProcessingJob(first.id, user.id, path, 1, "application/pdf", "abc123"))
+            missing = os.path.join(tmp, "not-there.pdf")
+            extractor.extract_text_step(db, ProcessingJob(second.id, user.id, missing, 1, "application/pdf", "abc123"))
+
+            stored = {row.document_id: row for row in db.query(DocumentText)}
+            assert stored[first.id].page_count == 40
+            assert stored[first.id].content == stored[second.id].content
+            assert "Page number 39" in stored[second.id].content
+            print("✅ Extracted text stored and reused for identical content")
+        finally:
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_pdf_extraction()
@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+from shared.lazy import LazyModule, lazy_import, optional_import
+
+# Our own top-level packages and modules - their self time is what we control
+PROJECT = {"auth", "documents", "processing", "search", "shared", "users", "config", "main",
+           "serve", "setup_database", "create_test_user"}
+HEAVY = {"fastapi", "starlette", "pydantic", "numpy", "PyPDF2", "celery", "redis", "werkzeug", "zstandard"}
+# Slow CI boxes can scale the budgets up rather than edit them
+SCALE = float(os.getenv("IMPORT_BUDGET_SCALE", "1"))
+
+def import_times(statement: str) -> dict:
+    """{module: self time in ms} from a fresh interpreter running `statement` under -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr[-2000:]
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(self_us) / 1000
+    return times
+
+def top_level(times: dict) -> set:
+    return {name.split(".")[0] for name in times}
+
+def project_ms(times: dict) -> float:
+    return sum(ms for name, ms in times.items() if name.split(".")[0] in PROJECT)
+
+def test_lazy_modules():
+    """lazy_import defers the import to first use, optional_import is None when it's missing"""
+
+    # Test 1: nothing imported until an attribute is needed
+    statement = ("import sys; from shared.lazy import lazy_import; m = lazy_import('wave'); "
+                 "assert 'wave' not in sys.modules; m.open; assert 'wave' in sys.modules")
+    assert subprocess.run([sys.executable, "-c", statement], cwd=os.path.dirname(os.path.abspath(__file__))).returncode == 0
+    module = lazy_import("json")
+    assert isinstance(module, LazyModule) and module.dumps({"a": 1}) == '{"a": 1}'
+    print("✅ Lazy module imported on first attribute access")
+
+    # Test 2: a missing optional package is None straight away, a present one isn't
+    assert optional_import("surely_not_installed_anywhere") is None
+    assert optional_import("csv") is not None
+    print("✅ optional_import is None for missing packages")
+
+def test_heavy_packages_stay_out():
+    """Models, workers and CLI scripts don't drag in the web stack or the parsing libraries"""
+
+    cases = {
+        "import shared.database, auth.models, documents.models, processing.models, users.models, search.models": HEAVY,
+        "import setup_database, create_test_user": HEAVY,
+        "import processing.tasks": HEAVY,
+        "import documents.cleanup": HEAVY,
+        # The API needs the web stack, nothing else
+        "import main": HEAVY - {"fastapi", "starlette", "pydantic"},
+    }
+    for statement, banned in cases.items():
+        loaded = top_level(import_times(statement)) & banned
+        assert not loaded, f"{statement} imported {sorted(loaded)}"
+        print(f"✅ {statement[:60]}: none of {len(banned)} heavy packages imported")
+
+def test_lazy_dependencies_not_loaded():
+    """The modules that use NumPy, PyPDF2 and werkzeug import fine without loading them"""
+
+    statement = ("import sys, processing.analyser, processing.extractor, documents.compression, auth.service; "
+                 "print(' '.join(sorted({'numpy', 'PyPDF2', 'zstandard', 'werkzeug'} & set(sys.modules))))")
+    result = subprocess.run([sys.executable, "-c", statement], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert result.stdout.strip() == "", f"imported eagerly: {result.stdout.strip()}"
+    print("✅ numpy, PyPDF2, zstandard and werkzeug only load when first used")
+
+def test_startup_budget():
+    """Our own modules' share of startup stays small - SQLAlchemy and FastAPI are most of it"""
+
+    # About twice what each takes here (~30ms, ~37ms, ~75ms) - the best of three runs, so one slow run doesn't fail it
+    budgets = {
+        "import shared.database, auth.models, documents.models, processing.models, users.models, search.models": 60,
+        "import processing.tasks": 80,
+        "import main": 160,
+    }
+    for statement, budget in budgets.items():
+        runs = [import_times(statement) for _ in range(3)]
+        times = min(runs, key=project_ms)
+        own, total = project_ms(times), sum(times.values())
+        assert own < budget * SCALE, f"{statement}: {own:.1f}ms in project modules (budget {budget * SCALE:.0f}ms)"
+        print(f"✅ {statement[:40]}: {own:.1f}ms ours of {total:.0f}ms total (budget {budget * SCALE:.0f}ms)")
+
+if __name__ == "__main__":
+    test_lazy_modules()
+    test_heavy_packages_stay_out()
+    test_lazy_dependencies_not_loaded()
+    test_startup_budget()
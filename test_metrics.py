@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+import tempfile
+from fastapi import FastAPI
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+import shared.metrics as metrics
+from shared.database import create_database_engine
+from shared.metrics import REGISTRY, MetricsMiddleware, span
+from shared.utils import run_blocking
+
+def call(app, path, headers=()):
+    """Send one GET through the ASGI app and return (status, headers)"""
+    return asyncio.run(call_async(app, path, headers))
+
+async def call_async(app, path, headers=()):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "root_path": "", "headers": [(k.encode(), v.encode()) for k, v in headers],
+             "client": ("127.0.0.1", 1234), "server": ("testserver", 80)}
+    await app(scope, receive, send)
+    start = messages[0]
+    return start["status"], {k.decode(): v.decode() for k, v in start["headers"]}
+
+def test_metrics():
+    """Spans, query counts, Server-Timing, the Prometheus text and the profiler hook"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_database_engine(f"sqlite:///{tmp}/metrics.db")
+        Session = sessionmaker(bind=engine)
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware)
+
+        @app.get("/things/{thing_id}")
+        async def get_thing(thing_id: int):
+            def work():
+                with Session() as db, span("things.lookup"):
+                    for _ in range(3):
+                        db.execute(text("SELECT 1"))
+            # Runs on the I/O pool - the request's metrics have to follow it there
+            await run_blocking(work)
+            return {"id": thing_id}
+
+        @app.get("/slow")
+        async def slow():
+            await asyncio.sleep(0.05)
+            return {}
+
+        try:
+            # Test 1: Server-Timing has the total, DB time with query count, and the span
+            status, headers = call(app, "/things/7")
+            assert status == 200
+            timing = headers["server-timing"]
+            assert timing.startswith("total;dur=") and 'desc="3 queries"' in timing and "things-lookup;dur=" in timing
+            print(f"✅ Server-Timing: {timing}")
+
+            # Test 2: Prometheus text has the route template (not the raw path) and the stage
+            call(app, "/things/8")
+            exposition = REGISTRY.exposition()
+            assert "# TYPE docflow_http_request_duration_seconds histogram" in exposition
+            assert 'docflow_http_request_duration_seconds_count{method="GET",route="/things/{thing_id}",status="200"} 2' in exposition
+            assert 'docflow_stage_duration_seconds_bucket{stage="things.lookup",le="+Inf"} 2' in exposition
+            assert 'docflow_db_queries_per_request_bucket{route="/things/{thing_id}",le="5"} 2' in exposition
+            print("✅ /metrics exposition has request, stage and query histograms")
+
+            # Test 3: X-Profile: 1 dumps a cProfile file named by the X-Profile-Id header
+            metrics.PROFILE_REQUESTS, metrics.PROFILE_DIR = "header", os.path.join(tmp, "profiles")
+            try:
+                _, headers = call(app, "/things/9")
+                assert "x-profile-id" not in headers
+                _, headers = call(app, "/things/9", headers=[("x-profile", "1")])
+                assert os.path.exists(os.path.join(tmp, "profiles", headers["x-profile-id"] + ".prof"))
+                with open(os.path.join(tmp, "profiles", headers["x-profile-id"] + ".json")) as f:
+                    details = json.load(f)
+                assert details["route"] == "/things/{thing_id}" and details["concurrent_requests"] == 0
+
+                # The profile covers the whole loop, so it says how many other requests were in it
+                async def crowded():
+                    others = [asyncio.ensure_future(call_async(app, "/slow")) for _ in range(2)]
+                    await asyncio.sleep(0)
+                    profiled = asyncio.ensure_future(call_async(app, "/slow", headers=[("x-profile", "1")]))
+                    await asyncio.sleep(0)
+                    late = asyncio.ensure_future(call_async(app, "/slow"))
+                    _, profiled_headers = await profiled
+                    await asyncio.gather(*others, late)
+                    return profiled_headers
+                crowded_headers = asyncio.run(crowded())
+                with open(os.path.join(tmp, "profiles", crowded_headers["x-profile-id"] + ".json")) as f:
+                    assert json.load(f)["concurrent_requests"] == 3
+            finally:
+                metrics.PROFILE_REQUESTS, metrics.PROFILE_DIR = "off", "./profiles"
+            print(f"✅ Profile written for request {headers['x-profile-id']}, with the requests that shared the loop counted")
+        finally:
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_metrics()
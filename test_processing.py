@@ -0,0 +1,86 @@
+import os
+import tempfile
+import threading
+from collections import Counter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from shared.database import Base
+from auth.models import User
+from documents.models import Document, DocumentStatus
+from processing.tasks import DatabaseQueue, Worker
+from processing.workflow import HANDLERS, register_handler, claim_document
+
+TEST_MIME_TYPE = "application/x-docflow-test"
+
+def test_parallel_workers_process_each_document_once():
+    """Several workers draining the same queue never double-process a document"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False, "timeout": 30})
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+
+        seen = Counter()
+        lock = threading.Lock()
+
+        @register_handler(TEST_MIME_TYPE)
+        def count_and_maybe_fail(db, job):
+            with lock:
+                seen[job.document_id] += 1
+            with open(job.file_path, "rb") as f:
+                if f.read() == b"bad":
+                    raise ValueError("could not parse document")
+
+        try:
+            user = User(username="worker", email="worker@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+
+            for i in range(40):
+                path = os.path.join(tmp, f"doc_{i}")
+                with open(path, "wb") as f:
+                    f.write(b"bad" if i % 10 == 0 else b"good")
+                db.add(Document(user_id=user.id, filename=f"doc_{i}", file_path=path, file_size=4,
+                                mime_type=TEST_MIME_TYPE))
+            # One whose file has gone missing
+            db.add(Document(user_id=user.id, filename="gone", file_path=os.path.join(tmp, "gone"),
+                            file_size=4, mime_type=TEST_MIME_TYPE))
+            db.commit()
+
+            # Test 1: four workers drain the queue, each document handled exactly once
+            queue = DatabaseQueue()
+            workers = [Worker(queue, session_factory=Session, poll_interval=0.05) for _ in range(4)]
+            threads = [threading.Thread(target=worker.run) for worker in workers]
+            for thread in threads:
+                thread.start()
+            while db.query(Document).filter(Document.status.in_([DocumentStatus.UPLOADED, DocumentStatus.PROCESSING])).count():
+                db.expire_all()
+                threading.Event().wait(0.05)
+            for worker in workers:
+                worker.stop()
+            for thread in threads:
+                thread.join()
+
+            assert len(seen) == 40 and set(seen.values()) == {1}
+            print(f"✅ {len(seen)} documents processed exactly once by {len(workers)} workers")
+
+            # Test 2: outcomes and timestamps recorded
+            db.expire_all()
+            completed = db.query(Document).filter(Document.status == DocumentStatus.COMPLETED).all()
+            failed = db.query(Document).filter(Document.status == DocumentStatus.FAILED).all()
+            assert len(completed) == 36 and len(failed) == 5
+            assert all(doc.processed_at is not None for doc in completed + failed)
+            assert {doc.processing_error for doc in failed} == {"could not parse document", "Stored file is missing"}
+            print("✅ Completed/failed states, processed_at and errors recorded")
+
+            # Test 3: a finished document can't be claimed again
+            assert claim_document(db, completed[0].id) is None
+            print("✅ Finished documents are not re-claimed")
+        finally:
+            HANDLERS.pop(TEST_MIME_TYPE, None)
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_parallel_workers_process_each_document_once()
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from fastapi import HTTPException
+from shared.database import Base
+from auth.models import User
+from documents.models import Document, UploadSession
+from documents.resumable import ResumableUploadService, MIN_CHUNK_SIZE
+from documents.storage import ContentAddressedStorage
+from test_batch_upload import leftover_temp_files
+from test_streaming_upload import body_in_chunks
+
+def test_resumable_upload():
+    """Chunks in any order, repeats and resumes, then one document at the end"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        uploads = os.path.join(tmp, "uploads")
+        storage = ContentAddressedStorage(uploads)
+
+        try:
+            user = User(username="resumer", email="resume@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            service = ResumableUploadService(db, storage=storage)
+
+            chunk_size = MIN_CHUNK_SIZE
+            content = b"%PDF-1.4\n" + os.urandom(chunk_size * 4 + 1234)
+            pieces = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+
+            def send(upload_id, index, data, service=service):
+                return asyncio.run(service.write_chunk(user.id, upload_id, index, body_in_chunks(data, 64 * 1024)))
+
+            # Test 1: session knows how the file splits up
+            session = service.create_session(user.id, "big report.pdf", "application/pdf", len(content), chunk_size)
+            progress = service.session_progress(user.id, session.id)
+            assert progress["chunk_count"] == 5 and progress["missing_chunks"] == [0, 1, 2, 3, 4]
+            assert os.path.getsize(session.temp_path) == len(content)
+            print(f"✅ Upload session {session.id} expects {progress['chunk_count']} chunks")
+
+            # Test 2: out of order, one sent twice, finishing too early is refused
+            for index in (3, 0, 4, 3):
+                send(session.id, index, pieces[index])
+            progress = service.session_progress(user.id, session.id)
+            assert progress["received_chunks"] == [0, 3, 4] and progress["missing_chunks"] == [1, 2]
+            assert progress["received_bytes"] == len(pieces[0]) + len(pieces[3]) + len(pieces[4])
+            try:
+                service.complete_session(user.id, session.id)
+                assert False, "Incomplete upload finished!"
+            except HTTPException as e:
+                assert e.status_code == 409
+            print("✅ Out-of-order and repeated chunks recorded, incomplete upload refused")
+
+            # Test 3: wrong-sized chunk and out-of-range index are rejected
+            for index, data in ((1, pieces[1][:-1]), (9, pieces[1])):
+                try:
+                    send(session.id, index, data)
+                    assert False, "Bad chunk accepted!"
+                except HTTPException as e:
+                    assert e.status_code == 400
+            assert service.session_progress(user.id, session.id)["missing_chunks"] == [1, 2]
+            print("✅ Short chunk and bad index rejected")
+
+            # Test 4: the rest arrive in parallel (own DB session each, like separate requests)
+            def send_separately(index):
+                with Session() as other:
+                    send(session.id, index, pieces[index], ResumableUploadService(other, storage=storage))
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                list(pool.map(send_separately, (1, 2)))
+            document = service.complete_session(user.id, session.id)
+            with open(document.file_path, "rb") as f:
+                assert f.read() == content
+            assert document.file_size == len(content)
+            assert document.content_hash == hashlib.sha256(content).hexdigest()
+            assert db.query(UploadSession).count() == 0
+            assert leftover_temp_files(uploads) == []
+            print(f"✅ Finished upload is byte-for-byte identical ({document.file_size} bytes)")
+
+            # Test 5: content is still sniffed - an executable named .pdf is thrown out at the end
+            fake = b"MZ\x90\x00" + os.urandom(1000)
+            session = service.create_session(user.id, "invoice.pdf", "application/pdf", len(fake), chunk_size)
+            send(session.id, 0, fake)
+            try:
+                service.complete_session(user.id, session.id)
+                assert False, "Spoofed file accepted!"
+            except HTTPException as e:
+                assert e.status_code == 400
+            assert db.query(UploadSession).count() == 0
+            assert leftover_temp_files(uploads) == []
+            print("✅ Spoofed content rejected when the upload finishes")
+
+            # Test 6: a retried complete while the first is still running gets 409, and only one document is made
+            session = service.create_session(user.id, "retried.pdf", "application/pdf", len(content), chunk_size)
+            for index, piece in enumerate(pieces):
+                send(session.id, index, piece)
+            with Session() as other:
+                other.query(UploadSession).filter(UploadSession.id == session.id).update({UploadSession.state: "completing"})
+                other.commit()
+            for attempt in (lambda: service.complete_session(user.id, session.id),
+                            lambda: send(session.id, 0, pieces[0]),
+                            lambda: service.abort_session(user.id, session.id)):
+                try:
+                    attempt()
+                    assert False, "Claimed session touched again!"
+                except HTTPException as e:
+                    assert e.status_code == 409
+            db.query(UploadSession).filter(UploadSession.id == session.id).update({UploadSession.state: "open"})
+            db.commit()
+
+            def complete_separately(_):
+                with Session() as other:
+                    try:
+                        return ResumableUploadService(other, storage=storage).complete_session(user.id, session.id).id
+                    except HTTPException as e:
+                        return e.status_code
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                outcomes = list(pool.map(complete_separately, range(2)))
+            # The loser sees 409 while the winner runs, or 404 if it's already finished
+            assert len([outcome for outcome in outcomes if outcome in (404, 409)]) == 1, outcomes
+            assert db.query(Document).count() == 2
+            print(f"✅ Concurrent completes made one document ({outcomes})")
+
+            # Test 7: the temp file vanishing mid-complete fails cleanly instead of leaving the session behind
+            session = service.create_session(user.id, "vanished.pdf", "application/pdf", len(pieces[0]), chunk_size)
+            send(session.id, 0, pieces[0])
+            os.remove(session.temp_path)
+            try:
+                service.complete_session(user.id, session.id)
+                assert False, "Missing file completed!"
+            except FileNotFoundError:
+                pass
+            assert db.query(UploadSession).count() == 0 and db.query(Document).count() == 2
+            print("✅ Lost temp file discards the session")
+
+            # Test 8: abandoned uploads can be cancelled or expire
+            session = service.create_session(user.id, "later.pdf", "application/pdf", 100, chunk_size)
+            service.abort_session(user.id, session.id)
+            session = service.create_session(user.id, "forgotten.pdf", "application/pdf", 100, chunk_size)
+            assert service.expire_sessions(ttl_seconds=-60) == 1
+            assert db.query(UploadSession).count() == 0
+            assert leftover_temp_files(uploads) == []
+            assert db.query(Document).count() == 2
+            print("✅ Cancelled and expired uploads cleaned up")
+        finally:
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_resumable_upload()
@@ -0,0 +1,98 @@
+import os
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from fastapi import HTTPException
+from shared.database import Base
+from auth.models import User
+from documents.models import Document, DocumentStatus
+from documents.service import DocumentService
+from processing.models import DocumentText
+from search.index import Fts5Index, InvertedIndex, index_document, search_documents, _indexes
+import search.models  # noqa: F401 - registers the inverted index tables
+
+TEXTS = {
+    "01HZZZZZZZZZZZZZZZZZZZZZZZ_invoice_march.pdf": "Invoice for consulting services. Payment due in thirty days. Invoice total 4,200 EUR.",
+    "01HZZZZZZZZZZZZZZZZZZZZZZY_contract.pdf": "Service contract between the parties. Payment terms: the invoice is due on receipt.",
+    "01HZZZZZZZZZZZZZZZZZZZZZZX_minutes.pdf": "Meeting minutes. Discussed the roadmap and hiring. No payment topics.",
+    "01HZZZZZZZZZZZZZZZZZZZZZZW_café_menu.pdf": "Lunch menu - soup, salad, crème brûlée.",
+}
+# Everyday documents, so the words above are as rare as they'd really be
+TEXTS.update({f"01HZZZZZZZZZZZZZZZZZZZZZ{i:02d}_notes_{i}.pdf": f"Weekly notes number {i} about the garden and the weather."
+              for i in range(12)})
+
+def check_backend(backend_name, make_index):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/search.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        _indexes[str(engine.url)] = make_index(db)
+
+        try:
+            owner = User(username="searcher", email="search@example.com", password_hash="x")
+            other = User(username="nosy", email="nosy@example.com", password_hash="x")
+            db.add_all([owner, other])
+            db.commit()
+
+            ids = {}
+            for user in (owner, other):
+                for filename, content in TEXTS.items():
+                    document = Document(user_id=user.id, filename=filename, file_path=os.path.join(tmp, filename),
+                                        file_size=len(content), mime_type="application/pdf", status=DocumentStatus.COMPLETED)
+                    db.add(document)
+                    db.flush()
+                    db.add(DocumentText(document_id=document.id, content=content, page_count=1))
+                    index_document(db, document.id)
+                    if user is owner:
+                        ids[filename.split("_", 1)[1]] = document.id
+            db.commit()
+
+            # Test 1: ranked - the invoice (in its name and twice in the text) beats the contract
+            found = search_documents(db, owner.id, "invoice", limit=10)
+            assert [r["document_id"] for r in found["results"]] == [ids["invoice_march.pdf"], ids["contract.pdf"]]
+            assert found["results"][0]["score"] > found["results"][1]["score"]
+            assert "**invoice**" in found["results"][0]["snippet"].lower()
+            print(f"✅ [{backend_name}] Ranked: {[(r['filename'][27:], r['score']) for r in found['results']]}")
+
+            # Test 2: every word has to match, and only the user's own documents come back
+            found = search_documents(db, owner.id, "payment due", limit=10)
+            assert {r["document_id"] for r in found["results"]} == {ids["invoice_march.pdf"], ids["contract.pdf"]}
+            assert search_documents(db, owner.id, "payment roadmap hiring", limit=10)["results"][0]["document_id"] == ids["minutes.pdf"]
+            assert search_documents(db, owner.id, "invoice nonexistentword", limit=10)["results"] == []
+            print(f"✅ [{backend_name}] All words must match, other users' documents never show up")
+
+            # Test 3: pages
+            first = search_documents(db, owner.id, "payment", limit=2)
+            second = search_documents(db, owner.id, "payment", limit=2, offset=first["next_offset"])
+            assert first["next_offset"] == 2 and second["next_offset"] is None
+            assert len({r["document_id"] for r in first["results"] + second["results"]}) == 3
+            print(f"✅ [{backend_name}] Paged through 3 results, 2 at a time")
+
+            # Test 4: deleting a document takes it out of the index; junk queries are a 400
+            DocumentService(db, storage=type("NoFiles", (), {"release": lambda *args: None})()).delete_document(owner.id, ids["invoice_march.pdf"])
+            assert [r["document_id"] for r in search_documents(db, owner.id, "invoice", limit=10)["results"]] == [ids["contract.pdf"]]
+            try:
+                search_documents(db, owner.id, "! ?", limit=10)
+                assert False, "Empty query accepted!"
+            except HTTPException as e:
+                assert e.status_code == 400
+            print(f"✅ [{backend_name}] Deleted document gone from results, empty query rejected")
+
+            # Test 5: accents don't need typing
+            found = search_documents(db, owner.id, "creme brulee cafe", limit=10)["results"][0]
+            assert found["document_id"] == ids["café_menu.pdf"]
+            # ...and the snippet highlights the words as they're written
+            assert "**crème** **brûlée**" in found["snippet"], found["snippet"]
+            print(f"✅ [{backend_name}] 'creme brulee cafe' finds the café menu: {found['snippet']}")
+        finally:
+            _indexes.pop(str(engine.url), None)
+            db.close()
+            engine.dispose()
+
+def test_search():
+    """Both search backends give the same answers"""
+    check_backend("fts5", Fts5Index)
+    check_backend("inverted", lambda db: InvertedIndex())
+
+if __name__ == "__main__":
+    test_search()
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from sqlalchemy import create_engine
+from benchmarks.common import ServerProcess, multipart_body
+from shared.health import readiness
+
+def test_readiness_checks():
+    """Readiness reports each dependency, and fails when one is broken"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db")
+        checks = asyncio.run(readiness(engine, os.path.join(tmp, "uploads")))
+        assert checks["database"]["ok"] and checks["storage"]["ok"], checks
+        assert checks["storage"]["free_bytes"] > 0 and "ms" in checks["database"]
+        engine.dispose()
+
+        # A database file in a directory that doesn't exist, and a storage "directory" that's a file
+        broken = create_engine(f"sqlite:///{tmp}/missing/test.db")
+        not_a_dir = os.path.join(tmp, "file")
+        open(not_a_dir, "w").close()
+        checks = asyncio.run(readiness(broken, not_a_dir))
+        assert not checks["database"]["ok"] and not checks["storage"]["ok"]
+        assert checks["database"]["error"] and checks["storage"]["error"]
+        broken.dispose()
+        print("✅ Readiness checks catch a broken database and storage directory")
+
+def test_serve_drains_gracefully():
+    """serve.py workers come up fast, fail readiness on SIGTERM and finish in-flight uploads"""
+
+    command = [sys.executable, "serve.py", "--workers", "2", "--host", "127.0.0.1", "--log-level", "warning",
+               "--drain-delay", "1", "--graceful-timeout", "10"]
+    server = ServerProcess(command=command)
+    with server:
+        # Test 1: ready, with real checks, and quick to start
+        status, body, _ = server.request("GET", "/health/ready")
+        ready = json.loads(body)
+        assert status == 200 and ready["status"] == "ready"
+        assert ready["checks"]["database"]["ok"] and ready["checks"]["storage"]["ok"]
+        status, body, _ = server.request("GET", "/health/live")
+        live = json.loads(body)
+        assert status == 200 and live["pid"] != server.process.pid
+        assert live["startup_ms"] is not None and live["startup_ms"] < 2000, live
+        print(f"✅ Worker {live['pid']} ready, cold start {live['startup_ms']}ms")
+
+        # Test 2: an upload is half sent when the server is told to stop
+        content = b"%PDF-1.4\n" + os.urandom(256 * 1024)
+        body, content_type = multipart_body("draining.pdf", "application/pdf", content)
+        upload = socket.create_connection(("127.0.0.1", server.port), timeout=30)
+        upload.sendall((
+            f"POST /documents/ HTTP/1.1\r\nHost: localhost\r\nAuthorization: Bearer {server.token}\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n"
+        ).encode() + body[:len(body) // 2])
+        time.sleep(0.3)
+        server.process.send_signal(signal.SIGTERM)
+        time.sleep(0.3)
+
+        # Still answering during the drain delay, but not ready
+        status, body_out, _ = server.request("GET", "/health/ready")
+        assert status == 503 and json.loads(body_out)["status"] == "draining"
+        print("✅ /health/ready is 503 while draining")
+
+        # Past the drain delay - accepting has stopped, the upload still finishes
+        time.sleep(1.2)
+        upload.sendall(body[len(body) // 2:])
+        response = b""
+        while b"\r\n\r\n" not in response or not response.rstrip().endswith(b"}"):
+            data = upload.recv(65536)
+            if not data:
+                break
+            response += data
+        upload.close()
+        assert response.startswith(b"HTTP/1.1 201"), response[:200]
+        assert server.process.wait(timeout=20) == 0
+        server.process = None
+        print("✅ In-flight upload finished during shutdown, server exited cleanly")
+
+if __name__ == "__main__":
+    test_readiness_checks()
+    test_serve_drains_gracefully()
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from fastapi import HTTPException
+from shared.database import Base
+from auth.models import User
+from documents.models import Document
+from documents.service import DocumentService, MAX_FILE_SIZE
+from documents.storage import ContentAddressedStorage, LocalFileStorage
+from documents.streaming import MultipartFileStream
+from documents.cleanup import reap_deleted_files
+
+def make_body(boundary: str, filename: str, content_type: str, content: bytes) -> bytes:
+    """Build a multipart body the same way a browser would"""
+    return (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="note"\r\n\r\n'
+        f"ignore me\r\n"
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+
+async def body_in_chunks(body: bytes, size: int = 1000):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+def test_streaming_upload():
+    """Stream uploads through the multipart reader and service without spooling"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        storage = ContentAddressedStorage(os.path.join(tmp, "uploads"))
+
+        try:
+            user = User(username="streamer", email="stream@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            service = DocumentService(db, storage=storage)
+
+            async def upload(body: bytes, chunk_size: int = 1000):
+                stream = MultipartFileStream(body_in_chunks(body, chunk_size), "multipart/form-data; boundary=xyz")
+                part = await stream.next_file()
+                return await service.upload_document_stream(user.id, part.filename, part.content_type, part.chunks())
+
+            # Test 1: valid PDF lands on disk in one piece, form fields are skipped
+            content = b"%PDF-1.4 " + os.urandom(5000)
+            document = asyncio.run(upload(make_body("xyz", "report.pdf", "application/pdf", content)))
+            assert document.file_size == len(content)
+            with open(document.file_path, "rb") as f:
+                assert f.read() == content
+            print(f"✅ Streamed {document.filename} ({document.file_size} bytes)")
+
+            # Test 2: oversized upload is cut off and leaves nothing behind
+            huge = b"%PDF-1.4 " + b"x" * MAX_FILE_SIZE
+            try:
+                asyncio.run(upload(make_body("xyz", "huge.pdf", "application/pdf", huge), 64 * 1024))
+                assert False, "Large file was accepted!"
+            except HTTPException as e:
+                assert e.status_code == 413
+                print(f"✅ Correctly rejected: {e.detail}")
+            assert os.listdir(storage.blob_dir / "incoming") == [], "partial upload left on disk"
+
+            # Test 3: MIME mismatch is rejected before anything is written
+            try:
+                asyncio.run(upload(make_body("xyz", "fake.pdf", "text/plain", b"nope")))
+                assert False, "Mismatch was accepted!"
+            except HTTPException as e:
+                assert e.status_code == 400
+                print(f"✅ Correctly rejected: {e.detail}")
+
+            assert db.query(Document).count() == 1
+
+            # Test 4: the same bytes again share the blob, and it survives until the last delete
+            again = asyncio.run(upload(make_body("xyz", "report copy.pdf", "application/pdf", content)))
+            assert again.file_path == document.file_path
+            assert again.content_hash == document.content_hash
+            service.delete_document(user.id, document.id)
+            reap_deleted_files(db, service.storage)
+            assert os.path.exists(again.file_path), "shared blob removed while still referenced"
+            service.delete_document(user.id, again.id)
+            reap_deleted_files(db, service.storage)
+            assert not os.path.exists(again.file_path), "blob left behind after last reference"
+            print("✅ Duplicate upload shared one blob and was cleaned up with the last reference")
+        finally:
+            db.close()
+            engine.dispose()
+
+def test_same_name_uploads_never_overwrite():
+    """Uploads with the same name in the same instant get separate, time-ordered files"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+
+        try:
+            user = User(username="samename", email="same@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            service = DocumentService(db, storage=LocalFileStorage(os.path.join(tmp, "uploads")))
+
+            async def upload(content: bytes):
+                body = make_body("xyz", "report.pdf", "application/pdf", content)
+                stream = MultipartFileStream(body_in_chunks(body), "multipart/form-data; boundary=xyz")
+                part = await stream.next_file()
+                return await service.upload_document_stream(user.id, part.filename, part.content_type, part.chunks())
+
+            documents = [asyncio.run(upload(b"%%PDF-1.4 copy %d" % i)) for i in range(5)]
+            paths = [doc.file_path for doc in documents]
+            assert len(set(paths)) == 5
+            for i, doc in enumerate(documents):
+                with open(doc.file_path, "rb") as f:
+                    assert f.read() == b"%%PDF-1.4 copy %d" % i
+            # Names start with the ULID, so sorting them sorts by upload time (to the millisecond)
+            assert [doc.filename[:10] for doc in documents] == sorted(doc.filename[:10] for doc in documents)
+            print(f"✅ {len(paths)} same-name uploads kept separately")
+        finally:
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_streaming_upload()
+    test_same_name_uploads_never_overwrite()
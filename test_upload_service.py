@@ -1,6 +1,7 @@
 
 import os
 import tempfile
+import zipfile
 from io import BytesIO
 from sqlalchemy.orm import sessionmaker
 from shared.database import engine, init_database
@@ -112,7 +113,12 @@ def test_upload_service():
         # Test 5: Valid Excel file (test multiple file types)
         print("Test 5: Valid Excel file")
         try:
-            excel_content = b"fake excel content for testing"
+            # Has to really be a spreadsheet now - uploads are sniffed
+            excel_buffer = BytesIO()
+            with zipfile.ZipFile(excel_buffer, "w") as archive:
+                archive.writestr("[Content_Types].xml", '<Types><Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/></Types>')
+                archive.writestr("xl/workbook.xml", "<workbook/>")
+            excel_content = excel_buffer.getvalue()
             excel_file = MockUploadFile("spreadsheet.xlsx", excel_content, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
             
             document = service.upload_document(test_user.id, excel_file)
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import tempfile
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.orm import sessionmaker
+from fastapi import HTTPException
+from shared.database import Base
+from shared.cache import LocalCache, ReadThroughCache
+from auth.models import User
+from documents.models import Document, DocumentStatus
+from documents.service import DocumentService
+from documents.storage import ContentAddressedStorage
+from processing.workflow import claim_document, finish_document
+from users.models import UserUsage
+from users.service import UsageService
+from test_streaming_upload import body_in_chunks
+
+def test_usage_and_quota():
+    """Running per-user totals match the documents table, and the quota stops uploads"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/test.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        queries = []
+        event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: queries.append(statement))
+
+        try:
+            user = User(username="counted", email="counted@example.com", password_hash="x")
+            db.add(user)
+            db.commit()
+            storage = ContentAddressedStorage(os.path.join(tmp, "uploads"))
+            service = DocumentService(db, storage=storage, cache=ReadThroughCache(LocalCache(100, 60), enabled=False))
+            usage = UsageService(db)
+
+            def upload(name, rows):
+                content = b"id,value\n" + b"".join(f"{i},{name}\n".encode() for i in range(rows))
+                return asyncio.run(service.upload_document_stream(user.id, name, "text/csv", body_in_chunks(content, 4096)))
+
+            def matches_documents_table():
+                actual = usage.get_usage(user.id)
+                count, size = db.query(func.count(Document.id), func.coalesce(func.sum(Document.file_size), 0)).filter(
+                    Document.user_id == user.id).one()
+                by_status = dict(db.query(Document.status, func.count()).filter(Document.user_id == user.id).group_by(Document.status))
+                assert actual["documents"]["total"] == count and actual["total_bytes"] == size
+                assert all(actual["documents"][status] == by_status.get(status, 0) for status in DocumentStatus.ALL)
+                return actual
+
+            # Test 1: uploads add up
+            documents = [upload(f"file{i}.csv", 100 * (i + 1)) for i in range(3)]
+            totals = matches_documents_table()
+            assert totals["documents"]["uploaded"] == 3
+            print(f"✅ 3 uploads counted: {totals['total_bytes']} bytes")
+
+            # Test 2: status changes move counts between statuses
+            claim_document(db, documents[0].id)
+            claim_document(db, documents[1].id)
+            finish_document(db, documents[0].id, DocumentStatus.COMPLETED)
+            finish_document(db, documents[0].id, DocumentStatus.FAILED)  # Not processing any more - no change
+            totals = matches_documents_table()
+            assert (totals["documents"]["completed"], totals["documents"]["processing"], totals["documents"]["uploaded"]) == (1, 1, 1)
+            print(f"✅ Status counts follow processing: {totals['documents']}")
+
+            # Test 3: deletes take the bytes back off
+            service.delete_document(user.id, documents[2].id)
+            totals = matches_documents_table()
+            assert totals["documents"]["total"] == 2
+            print(f"✅ Delete counted: {totals['total_bytes']} bytes left")
+
+            # Test 4: reading usage is one primary key lookup
+            queries.clear()
+            usage.get_usage(user.id)
+            assert len(queries) == 1 and "documents" not in queries[0]
+            print("✅ /users/me/usage is a single query on user_usage")
+
+            # Test 5: at the quota, uploads are refused before anything is stored...
+            db.query(UserUsage).filter(UserUsage.user_id == user.id).update({UserUsage.quota_bytes: totals["total_bytes"] + 1000})
+            db.commit()
+            try:
+                usage.check_quota(user.id, 5000)
+                assert False, "Declared size over the quota was accepted!"
+            except HTTPException as e:
+                assert e.status_code == 413 and "quota" in e.detail
+            # ...and a body that only turns out too big once received isn't kept either
+            blobs_before = sum(len(files) for _, _, files in os.walk(storage.blob_dir))
+            try:
+                upload("too_big.csv", 500)
+                assert False, "Upload over the quota was accepted!"
+            except HTTPException as e:
+                assert e.status_code == 413
+            assert sum(len(files) for _, _, files in os.walk(storage.blob_dir)) == blobs_before
+            matches_documents_table()
+            upload("small.csv", 10)  # Still room for this one
+            print(f"✅ Over-quota uploads rejected (413), nothing stored: {usage.get_usage(user.id)['remaining_bytes']} bytes left")
+
+            # Test 6: users from before usage tracking get their totals built from their documents once
+            veteran = User(username="veteran", email="veteran@example.com", password_hash="x")
+            db.add(veteran)
+            db.flush()
+            db.add_all([Document(user_id=veteran.id, filename=f"old_{i}.pdf", file_path=f"/old/{i}", file_size=1000,
+                                 mime_type="application/pdf", status=DocumentStatus.COMPLETED) for i in range(4)])
+            db.commit()
+            totals = usage.get_usage(veteran.id)
+            assert totals["documents"]["completed"] == 4 and totals["total_bytes"] == 4000
+            print("✅ Existing documents counted the first time usage was read")
+        finally:
+            db.close()
+            engine.dispose()
+
+if __name__ == "__main__":
+    test_usage_and_quota()
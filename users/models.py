@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, BigInteger, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from shared.database import Base
+
+
+class UserUsage(Base):
+    """
+    Running totals of a user's documents - kept up to date in the same
+    transaction as every upload, status change and delete, so reading them
+    is one primary key lookup however many documents there are
+    """
+    __tablename__ = "user_usage"
+    
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    document_count = Column(Integer, nullable=False, default=0)
+    uploaded_count = Column(Integer, nullable=False, default=0)
+    processing_count = Column(Integer, nullable=False, default=0)
+    completed_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    total_bytes = Column(BigInteger, nullable=False, default=0)  # Sum of file_size - what the quota is checked against
+    quota_bytes = Column(BigInteger, nullable=True)  # This user's own quota, NULL = STORAGE_QUOTA_BYTES
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<UserUsage(user_id={self.user_id}, documents={self.document_count}, bytes={self.total_bytes})>"
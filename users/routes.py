@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from shared.database import get_db
+from auth.service import current_user_id
+from shared.utils import run_blocking
+from users.service import UsageService
+
+# API endpoints for the signed-in user
+router = APIRouter()
+
+@router.get("/me/usage")
+async def get_my_usage(user_id: int = Depends(current_user_id), db: Session = Depends(get_db)):
+    """
+    How many documents I have (by status), how many bytes they take and how much quota is left
+    
+    Kept as running totals, so this is one row lookup no matter how many documents there are
+    """
+    
+    try:
+        return await run_blocking(UsageService(db).get_usage, user_id)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get usage: {str(e)}")
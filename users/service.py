@@ -0,0 +1,148 @@
+from typing import TYPE_CHECKING, Optional
+from sqlalchemy import case, func, literal, or_, select, update
+from sqlalchemy.orm import Session
+from documents.models import Document, DocumentStatus
+from users.models import UserUsage
+from config import STORAGE_QUOTA_BYTES
+
+if TYPE_CHECKING:
+    from fastapi import HTTPException
+
+# Which counter goes with each status
+STATUS_COLUMNS = {
+    DocumentStatus.UPLOADED: UserUsage.uploaded_count,
+    DocumentStatus.PROCESSING: UserUsage.processing_count,
+    DocumentStatus.COMPLETED: UserUsage.completed_count,
+    DocumentStatus.FAILED: UserUsage.failed_count,
+}
+
+
+def quota_exceeded(used: int, quota: int) -> "HTTPException":
+    # Imported here - processing workers only ever record usage, and shouldn't have to load FastAPI
+    from fastapi import HTTPException
+    return HTTPException(
+        status_code=413,
+        detail=f"Storage quota exceeded - {used / (1024*1024):.1f}MB of {quota // (1024*1024)}MB used"
+    )
+
+
+class UsageService:
+    """
+    Per-user document counts and bytes, and the storage quota
+
+    The record_* methods run inside the caller's transaction, after its
+    document change has been flushed, and never commit. Each is a single
+    UPDATE of the user's row with relative increments, so concurrent
+    uploads can't lose each other's counts. A user without a row gets one
+    built from their documents the first time it's needed (which already
+    includes the change being recorded).
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_usage(self, user_id: int) -> dict:
+        usage = self._usage_row(user_id)
+        if usage is None:
+            self._create_row(user_id)
+            self.db.commit()
+            usage = self._usage_row(user_id)
+        quota = self._quota(usage.quota_bytes)
+        return {
+            "user_id": user_id,
+            "documents": {
+                "total": usage.document_count,
+                "uploaded": usage.uploaded_count,
+                "processing": usage.processing_count,
+                "completed": usage.completed_count,
+                "failed": usage.failed_count,
+            },
+            "total_bytes": usage.total_bytes,
+            "quota_bytes": quota or None,
+            "remaining_bytes": max(0, quota - usage.total_bytes) if quota else None,
+            "updated_at": usage.updated_at,
+        }
+
+    def check_quota(self, user_id: int, incoming_bytes: int = 0):
+        """Cheap early rejection before any bytes are stored - record_upload has the final say"""
+        usage = self._usage_row(user_id)
+        used = usage.total_bytes if usage else 0
+        quota = self._quota(usage.quota_bytes if usage else None)
+        if quota and used + incoming_bytes > quota:
+            raise quota_exceeded(used, quota)
+
+    def record_upload(self, user_id: int, count: int, total_bytes: int, status: str = DocumentStatus.UPLOADED):
+        """New documents - 413 if they'd take the user over quota (the caller rolls back)"""
+        quota = func.coalesce(UserUsage.quota_bytes, STORAGE_QUOTA_BYTES)
+        within_quota = or_(quota <= 0, UserUsage.total_bytes + total_bytes <= quota)
+        outcome = self._apply(user_id, {
+            UserUsage.document_count: UserUsage.document_count + count,
+            STATUS_COLUMNS[status]: STATUS_COLUMNS[status] + count,
+            UserUsage.total_bytes: UserUsage.total_bytes + total_bytes,
+        }, within_quota)
+        if outcome == "updated":
+            return
+        usage = self._usage_row(user_id)
+        quota_bytes = self._quota(usage.quota_bytes)
+        if outcome == "refused":
+            raise quota_exceeded(usage.total_bytes, quota_bytes)
+        # Just built from the documents table, so the new ones are already in it
+        if quota_bytes and usage.total_bytes > quota_bytes:
+            raise quota_exceeded(usage.total_bytes - total_bytes, quota_bytes)
+
+    def record_status_change(self, user_id: int, old_status: str, new_status: str, count: int = 1):
+        if count and old_status != new_status:
+            self._apply(user_id, {
+                STATUS_COLUMNS[old_status]: STATUS_COLUMNS[old_status] - count,
+                STATUS_COLUMNS[new_status]: STATUS_COLUMNS[new_status] + count,
+            })
+
+    def record_delete(self, user_id: int, status: str, file_size: int, count: int = 1):
+        self._apply(user_id, {
+            UserUsage.document_count: UserUsage.document_count - count,
+            STATUS_COLUMNS[status]: STATUS_COLUMNS[status] - count,
+            UserUsage.total_bytes: UserUsage.total_bytes - file_size,
+        })
+
+    def _apply(self, user_id: int, changes: dict, condition=None) -> str:
+        """
+        Add the changes to the user's row: "updated", "refused" (the condition
+        said no) or "created" (the row was built just now and already has them)
+        """
+        while True:
+            statement = update(UserUsage).where(UserUsage.user_id == user_id).values(changes)
+            if condition is not None:
+                statement = statement.where(condition)
+            if self.db.execute(statement.execution_options(synchronize_session=False)).rowcount:
+                return "updated"
+            if self._usage_row(user_id) is not None:
+                return "refused"
+            if self._create_row(user_id):
+                return "created"
+            # Someone else built it between our UPDATE and INSERT - go again
+
+    def _create_row(self, user_id: int) -> bool:
+        """Build the row from the documents table - only ever happens once per user"""
+        totals = select(
+            literal(user_id),
+            func.count(Document.id),
+            *[func.coalesce(func.sum(case((Document.status == status, 1), else_=0)), 0) for status in STATUS_COLUMNS],
+            func.coalesce(func.sum(Document.file_size), 0),
+        ).where(Document.user_id == user_id)
+        columns = ["user_id", "document_count", *[column.key for column in STATUS_COLUMNS.values()], "total_bytes"]
+        statement = self._insert().from_select(columns, totals).on_conflict_do_nothing(index_elements=["user_id"])
+        return self.db.execute(statement).rowcount == 1
+
+    def _insert(self):
+        # INSERT ... ON CONFLICT DO NOTHING is spelled per dialect
+        if self.db.get_bind().dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(UserUsage)
+
+    def _usage_row(self, user_id: int) -> Optional[UserUsage]:
+        return self.db.query(UserUsage).populate_existing().filter(UserUsage.user_id == user_id).first()
+
+    def _quota(self, user_quota: Optional[int]) -> int:
+        return user_quota if user_quota is not None else STORAGE_QUOTA_BYTES